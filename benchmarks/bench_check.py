@@ -0,0 +1,73 @@
+"""
+Measure how long `check_files` takes to scan a tree of many small modules, without and with an up-to-date build.
+
+Usage: python benchmarks/bench_check.py [--files 2000] [--workers 0]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.check import check_files
+from pyfuture.utils import transfer_code
+
+PLAIN = '''"""A module without new syntax."""
+
+import os
+
+
+def join(*parts: str) -> str:
+    return os.path.join(*parts)
+
+
+class Config:
+    def __init__(self, values: dict[str, int]) -> None:
+        self.values = values
+
+    def get(self, key: str, default: int = 0) -> int:
+        return self.values.get(key, default)
+'''
+
+GENERIC = (
+    PLAIN
+    + """
+
+def first[T](items: list[T]) -> T | None:
+    return items[0] if items else None
+"""
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir, build_dir = Path(tmp_dir) / "src", Path(tmp_dir) / "build"
+        outputs = {PLAIN: PLAIN, GENERIC: transfer_code(GENERIC)}
+        for i in range(args.files):
+            code = GENERIC if i % 10 == 0 else PLAIN
+            for root, content in ((src_dir, code), (build_dir, outputs[code])):
+                path = root / f"package{i // 100}" / f"module{i}.py"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(content)
+
+        src_files = sorted(src_dir.glob("**/*.py"))
+        for name, pairs in [
+            ("syntax", [(src_file, None) for src_file in src_files]),
+            ("outputs", [(src_file, build_dir / src_file.relative_to(src_dir)) for src_file in src_files]),
+        ]:
+            start = time.perf_counter()
+            results = check_files(pairs, workers=args.workers)
+            seconds = time.perf_counter() - start
+            violations = sum(not result.ok for result in results)
+            print(f"{name:8} {len(results)} files {seconds:8.2f} s, {violations} violations")
+
+
+if __name__ == "__main__":
+    main()
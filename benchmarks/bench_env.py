@@ -0,0 +1,73 @@
+"""
+Measure `transfer_env` on a generated site-packages, cold and once the environment is recreated with the same
+distributions, where the outputs are reused from the cache.
+
+Usage: python benchmarks/bench_env.py [--distributions 20] [--modules 20]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.env import transfer_env
+
+MODERN = """
+from collections.abc import Callable
+
+type Handler[T] = Callable[[T], None]
+
+
+def describe{i}(value: int | str | None = None) -> str:
+    return f"value {{value:>10}}"
+"""
+
+PLAIN = """
+import os
+
+
+def path{i}(name):
+    return os.path.join("data", name)
+"""
+
+
+def install(site_packages: Path, distributions: int, modules: int) -> None:
+    for d in range(distributions):
+        name = f"dist{d}"
+        files = {}
+        for i in range(modules):
+            # a third of the distributions need lowering, like vendored libraries among their dependencies
+            files[f"{name}/module{i}.py"] = (MODERN if d % 3 == 0 else PLAIN).format(i=i)
+        dist_info = site_packages / f"{name}-1.0.dist-info"
+        dist_info.mkdir(parents=True)
+        requires_python = ">=3.12" if d % 3 == 0 else ">=3.8"
+        (dist_info / "METADATA").write_text(f"Name: {name}\nVersion: 1.0\nRequires-Python: {requires_python}\n")
+        for file, code in files.items():
+            (site_packages / file).parent.mkdir(parents=True, exist_ok=True)
+            (site_packages / file).write_text(code)
+        (dist_info / "RECORD").write_text("".join(f"{file},,\n" for file in files))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--distributions", type=int, default=20)
+    parser.add_argument("--modules", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = Path(tmp_dir) / "cache"
+        for name in ("cold", "recreated"):
+            site_packages = Path(tmp_dir) / name / "site-packages"
+            install(site_packages, args.distributions, args.modules)
+            start = time.perf_counter()
+            results = transfer_env(site_packages, cache_dir=cache_dir)
+            lowered = sum(result.files for result in results)
+            print(
+                f"{name:10} {len(results)} distributions, {lowered} files lowered {time.perf_counter() - start:8.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Measure the scaling of `transfer-dir` across worker threads and processes on a tree of many small modules.
+Threads only scale on free-threaded builds (3.13t+) with the GIL disabled, with the GIL they show its contention.
+
+Usage: python benchmarks/bench_executor.py [--files 100] [--workers 1 2 4]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.__main__ import transfer_dir
+from pyfuture.utils import gil_enabled
+
+CODE = """
+def first[T](items: list[T]) -> T | None:
+    return items[0] if items else None
+
+
+def describe(point: tuple[int, int] | dict[str, int]) -> str:
+    match point:
+        case (x, 0):
+            return f"x={x}"
+        case {"y": y}:
+            return f"y={y}"
+        case _:
+            return "other"
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print(f"GIL enabled: {gil_enabled()}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir, build_dir = Path(tmp_dir) / "src", Path(tmp_dir) / "build"
+        for i in range(args.files):
+            path = src_dir / f"package{i // 100}" / f"module{i}.py"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(CODE)
+
+        start = time.perf_counter()
+        transfer_dir(src_dir, build_dir, use_manifest=False, executor="serial", log_level="WARNING")
+        serial = time.perf_counter() - start
+        print(f"{'serial':10} {1:2} workers {serial:8.2f} s")
+        for executor in ["threads", "processes"]:
+            for workers in args.workers:
+                start = time.perf_counter()
+                transfer_dir(
+                    src_dir, build_dir, use_manifest=False, executor=executor, workers=workers, log_level="WARNING"
+                )
+                duration = time.perf_counter() - start
+                print(f"{executor:10} {workers:2} workers {duration:8.2f} s {serial / duration:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measure the save-to-write latency of watch mode after editing one function of a large module,
+for the incremental transformer and for a full re-transform.
+
+Usage: python benchmarks/bench_incremental.py [--lines 5000] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.incremental import IncrementalTransformer
+from pyfuture.utils import transfer_file
+
+BLOCK = """
+
+def func{i}[T: int | str](x: T, y: list[int] | None = None) -> T:
+    name = f"value {{x}}"
+    match x:
+        case 1:
+            return x
+        case _:
+            return x
+
+
+class Class{i}[T]:
+    def method(self, x: T) -> T:
+        return x
+"""
+
+
+def generate(lines: int) -> str:
+    block_lines = BLOCK.count("\n")
+    return "from __future__ import annotations\n" + "".join(BLOCK.format(i=i) for i in range(lines // block_lines))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    code = generate(args.lines)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_file = Path(tmp_dir) / "module.py"
+        tgt_file = Path(tmp_dir) / "build" / "module.py"
+        incremental = IncrementalTransformer((3, 9))
+        src_file.write_text(code)
+        incremental.transfer_file(src_file, tgt_file)
+
+        full, partial = [], []
+        for i in range(args.repeat):
+            src_file.write_text(code.replace('f"value {x}"', f'f"value {i} {{x}}"', 1))
+
+            start = time.perf_counter()
+            transfer_file(src_file, tgt_file, target=(3, 9))
+            full.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            incremental.transfer_file(src_file, tgt_file)
+            partial.append(time.perf_counter() - start)
+
+    print(f"module: {code.count(chr(10))} lines, {incremental.total} statements")
+    print(f"full:        {min(full) * 1000:8.1f} ms")
+    print(f"incremental: {min(partial) * 1000:8.1f} ms ({incremental.reused}/{incremental.total} statements reused)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure a no-op rebuild of a tree of many small modules with `transfer-dir`, with and without the build manifest.
+
+Usage: python benchmarks/bench_manifest.py [--files 500]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.__main__ import transfer_dir
+
+CODE = """
+def first[T](items: list[T]) -> T | None:
+    return items[0] if items else None
+
+
+def last(items: list[int]) -> int | None:
+    return items[-1] if items else None
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir, build_dir = Path(tmp_dir) / "src", Path(tmp_dir) / "build"
+        for i in range(args.files):
+            path = src_dir / f"package{i // 100}" / f"module{i}.py"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(CODE)
+
+        for name, use_manifest in [("first build", True), ("no manifest", False), ("manifest", True)]:
+            start = time.perf_counter()
+            transfer_dir(src_dir, build_dir, use_manifest=use_manifest, log_level="WARNING")
+            print(f"{name:12} {args.files} files {time.perf_counter() - start:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the speed of native match statements with the if statements they are lowered to,
+on the running interpreter.
+
+Usage: python benchmarks/bench_match.py [--number 200000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import timeit
+
+from pyfuture.codemod.utils import RuleSet, get_transformers
+from pyfuture.utils import apply_transformer
+
+CODE = """
+import dataclasses
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+def dispatch(command):
+    match command:
+        case ["go", direction]:
+            return direction
+        case ["pick", item, *rest]:
+            return item
+        case {"action": "move", "x": x, "y": y}:
+            return x + y
+        case {"action": "stop"}:
+            return 0
+        case Point(x=0, y=y):
+            return y
+        case Point(x, y) if x == y:
+            return x
+        case int(n) | float(n):
+            return n
+        case _:
+            return None
+
+SUBJECTS = [
+    ["go", "north"],
+    ["pick", "key", "now"],
+    {"action": "move", "x": 1, "y": 2},
+    {"action": "stop"},
+    Point(0, 3),
+    Point(2, 2),
+    42,
+    "nothing",
+]
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    lowered_code = apply_transformer(list(get_transformers([RuleSet.pep622])), CODE)
+    for name, code in (("native", CODE), ("lowered", lowered_code)):
+        namespace: dict = {}
+        exec(compile(code, name, "exec"), namespace)
+        timer = timeit.Timer("for subject in SUBJECTS: dispatch(subject)", globals=namespace)
+        seconds = min(timer.repeat(repeat=5, number=args.number // len(namespace["SUBJECTS"])))
+        print(f"{name:8} {seconds * 1e9 / args.number:8.1f} ns per match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Measure how the time to lower a match statement grows with its number of cases.
+
+Usage: python benchmarks/bench_match_scaling.py [--max-cases 1600]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from pyfuture.codemod.utils import RuleSet, get_transformers
+from pyfuture.utils import apply_transformer
+
+
+def generate(cases: int) -> str:
+    body = "".join(f'        case {i} | "{i}":\n            return {i}\n' for i in range(cases))
+    return f"def dispatch(command):\n    match command:\n{body}        case _:\n            return None\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-cases", type=int, default=1600)
+    args = parser.parse_args()
+
+    transformers = list(get_transformers([RuleSet.pep622]))
+    cases = 100
+    previous = None
+    while cases <= args.max_cases:
+        code = generate(cases)
+        start = time.perf_counter()
+        apply_transformer(transformers, code)
+        seconds = time.perf_counter() - start
+        growth = "" if previous is None else f" ({seconds / previous:.2f}x)"
+        print(f"{cases:6} cases {seconds * 1000:10.1f} ms{growth}")
+        previous = seconds
+        cases *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measure `transfer-dir` on a tree where the same generic helpers are copied into many modules,
+with and without the statement memo.
+
+Usage: python benchmarks/bench_memo.py [--files 100]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.__main__ import transfer_dir
+
+HELPERS = """
+
+def first[T](items: list[T]) -> T | None:
+    return items[0] if items else None
+
+
+class Box[T]:
+    def __init__(self, item: T) -> None:
+        self.item = item
+
+    def map[U](self, f: Callable[[T], U]) -> Box[U]:
+        return Box(f(self.item))
+
+
+def describe(point: tuple[int, int] | dict[str, int]) -> str:
+    match point:
+        case (x, 0):
+            return f"x={x}"
+        case {"y": y}:
+            return f"y={y}"
+        case _:
+            return "other"
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir, build_dir = Path(tmp_dir) / "src", Path(tmp_dir) / "build"
+        memo_file = Path(tmp_dir) / "memo.json"
+        for i in range(args.files):
+            path = src_dir / f"package{i // 100}" / f"module{i}.py"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # a vendored copy of the helpers next to code of its own
+            own = f"\n\ndef own{i}(x: int | None) -> int:\n    return x or {i}\n"
+            path.write_text(f"from collections.abc import Callable\n\nVALUE = {i}\n{HELPERS}{own}")
+
+        runs = [
+            ("no memo", {}),
+            ("memo", {"memo": True}),
+            ("memo file", {"memo_file": memo_file}),
+            ("memo file warm", {"memo_file": memo_file}),
+        ]
+        for name, kwargs in runs:
+            start = time.perf_counter()
+            transfer_dir(src_dir, build_dir, use_manifest=False, log_level="WARNING", **kwargs)
+            print(f"{name:15} {args.files} files {time.perf_counter() - start:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Measure how the time to lower a generic class grows with its number of methods.
+
+Usage: python benchmarks/bench_pep695_class.py [--max-methods 800]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from pyfuture.codemod.utils import RuleSet, get_transformers
+from pyfuture.utils import apply_transformer
+
+
+def generate(methods: int) -> str:
+    body = "".join(
+        f"    field_{i}: V | None = None\n"
+        f"    def get_{i}[E: Exception](self, key: K, error: type[E]) -> V | None:\n"
+        f"        value: V | None = self.items.get(key)\n"
+        f"        return value\n"
+        for i in range(methods)
+    )
+    return f"class Repository[K, V]:\n    items: dict[K, V]\n{body}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-methods", type=int, default=800)
+    args = parser.parse_args()
+
+    transformers = list(get_transformers([RuleSet.pep695]))
+    methods = 50
+    previous = None
+    while methods <= args.max_methods:
+        code = generate(methods)
+        start = time.perf_counter()
+        apply_transformer(transformers, code)
+        seconds = time.perf_counter() - start
+        growth = "" if previous is None else f" ({seconds / previous:.2f}x)"
+        print(f"{methods:6} methods {seconds * 1000:10.1f} ms{growth}")
+        previous = seconds
+        methods *= 2
+
+
+if __name__ == "__main__":
+    main()
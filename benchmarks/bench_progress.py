@@ -0,0 +1,86 @@
+"""
+Measure the overhead per file of reporting a bulk run: the events of a transfer and a log message for each file,
+without any sink, with the rich log handler, and with `BulkReporter` on a terminal and on a plain stream.
+
+Usage: python benchmarks/bench_progress.py [--files 20000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import time
+from collections.abc import Callable
+
+from loguru import logger
+from rich.console import Console
+from rich.highlighter import NullHighlighter
+from rich.logging import RichHandler
+from rich.style import Style
+
+from pyfuture import events
+from pyfuture.progress import BulkReporter
+
+
+class _Terminal(io.TextIOWrapper):
+    def isatty(self) -> bool:
+        return True
+
+
+def simulate(files: int) -> None:
+    paths = [f"src/package{i // 100}/module{i}.py" for i in range(files)]
+    for path in paths:
+        events.emit(events.EventKind.queued, path=path)
+    for path in paths:
+        with events.file_scope(path):
+            events.emit(events.EventKind.parsed, duration=0.001, size=1000)
+            events.emit(events.EventKind.rule_applied, rule="TransformUnionTypesCommand", duration=0.001)
+            events.emit(events.EventKind.written, duration=0.0001, size=1000)
+            events.emit(events.EventKind.transferred, duration=0.003, size=1000)
+        logger.info("Transferred {}", path)
+        logger.debug("{}: {} statements", path, 10)
+
+
+def measure(name: str, files: int, setup: Callable[[], BulkReporter | None]) -> None:
+    logger.remove()
+    reporter = setup()
+    start = time.perf_counter()
+    if reporter is None:
+        simulate(files)
+    else:
+        with reporter:
+            simulate(files)
+    elapsed = time.perf_counter() - start
+    logger.remove()
+    print(f"{name:16} {elapsed / files * 1e6:8.1f} us/file")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull, open(os.devnull, "wb") as devnull_bytes:
+
+        def rich_handler() -> None:
+            console = Console(file=devnull, style=Style())
+            handler = RichHandler(console=console, highlighter=NullHighlighter(), markup=True)
+            logger.add(handler, format="{message}", level="INFO")
+
+        def reporter(stream: io.TextIOBase) -> Callable[[], BulkReporter]:
+            def setup() -> BulkReporter:
+                reporter = BulkReporter(stream)
+                logger.add(reporter.write, format="{message}", level="INFO")
+                return reporter
+
+            return setup
+
+        measure("no sink", args.files, lambda: None)
+        measure("rich handler", args.files, rich_handler)
+        measure("reporter (tty)", args.files, reporter(_Terminal(devnull_bytes)))
+        measure("reporter (plain)", args.files, reporter(devnull))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure `transfer-dir` on a tree of modules which only need f-string and union rewrites,
+with the libcst engine and the splice engine, and check that both write the same outputs.
+
+Usage: python benchmarks/bench_splice.py [--files 100]
+"""
+
+from __future__ import annotations
+
+import argparse
+import filecmp
+import tempfile
+import time
+from pathlib import Path
+
+from pyfuture.__main__ import transfer_dir
+
+HEADER = '''"""
+Module {i}.
+"""
+
+from __future__ import annotations
+
+import os
+from collections.abc import Callable
+'''
+
+BLOCK = """
+
+def load{i}(path: str | os.PathLike, default: int | None = None) -> dict[str, int] | None:
+    if not isinstance(path, str | bytes):
+        path = os.fspath(path)
+    print(f"loading {{path}} ({i}) with default {{default:>4}}")
+    return None
+
+
+class Item{i}:
+    name: str | None = None
+    size: int | float = 0
+
+    def describe(self, callback: Callable[[str], None] | None = None) -> str:
+        text = f"{{self.name}}: {{self.size:.2f}} bytes"
+        if callback is not None:
+            callback(text)
+        return text
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = Path(tmp_dir) / "src"
+        for i in range(args.files):
+            path = src_dir / f"package{i // 100}" / f"module{i}.py"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(HEADER.format(i=i) + "".join(BLOCK.format(i=i * 10 + j) for j in range(5)))
+
+        for engine in ("libcst", "splice"):
+            start = time.perf_counter()
+            transfer_dir(src_dir, Path(tmp_dir) / engine, use_manifest=False, log_level="WARNING", engine=engine)
+            print(f"{engine:8} {args.files} files {time.perf_counter() - start:8.2f} s")
+
+        mismatches = [
+            src_file
+            for src_file in src_dir.glob("**/*.py")
+            if not filecmp.cmp(
+                Path(tmp_dir) / "libcst" / src_file.relative_to(src_dir),
+                Path(tmp_dir) / "splice" / src_file.relative_to(src_dir),
+                shallow=False,
+            )
+        ]
+        print(f"{len(mismatches)} outputs differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure the import time of a module with hundreds of `type` statements lowered to lazy aliases,
+against an eager baseline which assigns the values (and the type parameters) at import.
+
+Usage: python benchmarks/bench_type_alias.py [--aliases 400] [--interpreter python3.11]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+from pyfuture.report import import_time
+from pyfuture.utils import transfer_code
+
+HEADER = "from collections.abc import Callable\nfrom typing import Literal, Optional, TypeVar, Union\n\n"
+
+
+def generate(aliases: int) -> tuple[str, str]:
+    """
+    Return a module with aliases `type` statements, and its eager lowering.
+    The literals keep `typing` from reusing the unions and callables it cached for other aliases.
+    """
+    source, eager = [], []
+    for i in range(aliases):
+        match i % 4:
+            case 0:
+                source.append(f"type Mapping{i} = dict[str, list[Literal[{i}]]]\n")
+                eager.append(f"Mapping{i} = dict[str, list[Literal[{i}]]]\n")
+            case 1:
+                source.append(f"type Option{i} = Literal[{i}] | str | None\n")
+                eager.append(f"Option{i} = Union[Literal[{i}], str, None]\n")
+            case 2:
+                source.append(f"type Handler{i} = Callable[[Literal[{i}], str], Optional[list[int]]]\n")
+                eager.append(f"Handler{i} = Callable[[Literal[{i}], str], Optional[list[int]]]\n")
+            case 3:
+                source.append(f"type Pair{i}[T] = tuple[T, Literal[{i}]]\n")
+                eager.append(f'__Pair{i}_T = TypeVar("__Pair{i}_T")\nPair{i} = tuple[__Pair{i}_T, Literal[{i}]]\n')
+    return HEADER + "".join(source), HEADER + "".join(eager)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--aliases", type=int, default=400)
+    parser.add_argument("--interpreter", default=sys.executable)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    source, eager = generate(args.aliases)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        (root / "aliases_eager.py").write_text(eager)
+        (root / "aliases_lazy.py").write_text(transfer_code(source, target=(3, 9)))
+        (root / "aliases_empty.py").write_text(HEADER)
+        baseline = import_time(args.interpreter, root, "aliases_empty", args.repeat) or 0.0
+        for name in ("eager", "lazy"):
+            seconds = import_time(args.interpreter, root, f"aliases_{name}", args.repeat)
+            if seconds is None:
+                print(f"{name:6} failed to import")
+                continue
+            per_alias = (seconds - baseline) / args.aliases * 1e6
+            print(f"{name:6} {args.aliases} aliases {seconds * 1000:8.2f} ms ({per_alias:.2f} us per alias)")
+
+
+if __name__ == "__main__":
+    main()
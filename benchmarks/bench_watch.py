@@ -0,0 +1,96 @@
+"""
+Reproduce an edit storm in watch mode: save random modules of a tree at a fixed rate while `watch_tree` runs,
+and report the latency from saving a file to its output landing in the build directory, by stage.
+
+Usage: python benchmarks/bench_watch.py [--files 50] [--edits 200] [--rate 20] [--debounce 50]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from pyfuture.incremental import IncrementalTransformer
+from pyfuture.latency import LatencyTracker
+from pyfuture.watch import watch_tree
+
+BLOCK = """
+
+def func{i}[T](items: list[T]) -> T | None:
+    return items[0] if items else None
+
+
+class Box{i}[T]:
+    def __init__(self, item: T) -> None:
+        self.item = item
+"""
+
+
+def module(edit: int) -> str:
+    return f"VERSION = {edit}\n" + "".join(BLOCK.format(i=i) for i in range(10))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="edits per second")
+    parser.add_argument("--debounce", type=int, default=50, help="milliseconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.remove()
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir, build_dir = Path(tmp_dir) / "src", Path(tmp_dir) / "build"
+        src_files = [src_dir / f"package{i // 10}" / f"module{i}.py" for i in range(args.files)]
+        incremental = IncrementalTransformer((3, 9))
+        for src_file in src_files:
+            src_file.parent.mkdir(parents=True, exist_ok=True)
+            src_file.write_text(module(0))
+            incremental.transfer_file(src_file, build_dir / src_file.relative_to(src_dir))
+
+        tracker = LatencyTracker(window=args.edits, interval=float("inf"))
+        stop_event = threading.Event()
+        watcher = threading.Thread(
+            target=watch_tree,
+            args=(src_dir, build_dir, incremental, tracker),
+            kwargs={"debounce": args.debounce, "stop_event": stop_event},
+        )
+        watcher.start()
+        time.sleep(1)
+
+        start = time.perf_counter()
+        latest: dict[Path, int] = {}
+        for edit in range(1, args.edits + 1):
+            src_file = rng.choice(src_files)
+            src_file.write_text(module(edit))
+            latest[src_file] = edit
+            time.sleep(max(start + edit / args.rate - time.perf_counter(), 0))
+
+        # wait for the last version of every edited file to land
+        deadline = time.perf_counter() + 120
+        pending = dict(latest)
+        while pending and time.perf_counter() < deadline:
+            for src_file, edit in list(pending.items()):
+                tgt_file = build_dir / src_file.relative_to(src_dir)
+                if f"VERSION = {edit}\n" in tgt_file.read_text():
+                    del pending[src_file]
+            time.sleep(0.01)
+        duration = time.perf_counter() - start
+        stop_event.set()
+        watcher.join()
+
+        print(f"{args.edits} edits of {args.files} files at {args.rate:g}/s, debounce {args.debounce} ms")
+        print(f"drained in {duration:.2f} s, {len(pending)} outputs stale")
+        print(tracker.summary())
+
+
+if __name__ == "__main__":
+    main()
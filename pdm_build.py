@@ -28,10 +28,30 @@ def pdm_build_initialize(context: Context) -> None:
 
 
 def pdm_build_update_files(context: Context, files: dict[str, Path]) -> None:
+    from pyfuture import events
+    from pyfuture.budget import Budget
     from pyfuture.hooks import pdm as pyfuture_pdm_hooks
     from pyfuture.utils import get_target
 
     hook_config = pyfuture_pdm_hooks.get_hook_config(context)
     target_str = pyfuture_pdm_hooks.get_target_str(hook_config)
     target = get_target(target_str)
-    pyfuture_pdm_hooks.pdm_build_update_files(context, files, target)
+    budget = None
+    limits = [hook_config.get(key) for key in ("time-budget", "memory-budget", "max-iterations")]
+    if any(limit is not None for limit in limits):
+        time_budget, memory_budget, max_iterations = limits
+        memory = None if memory_budget is None else memory_budget * 1024 * 1024
+        budget = Budget(time_budget, memory, max_iterations, hook_config.get("budget-fallback", "fail"))
+    with events.open_sinks(hook_config.get("events-file"), hook_config.get("metrics-file")):
+        pyfuture_pdm_hooks.pdm_build_update_files(
+            context,
+            files,
+            target,
+            compile_bytecode=hook_config.get("compile-bytecode", False),
+            invalidation_mode=hook_config.get("invalidation-mode", "checked-hash"),
+            split_threshold=hook_config.get("split-threshold"),
+            preserve_lines=hook_config.get("preserve-lines", False),
+            executor=hook_config.get("executor", "auto"),
+            budget=budget,
+            engine=hook_config.get("engine", "libcst"),
+        )
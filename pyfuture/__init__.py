@@ -1,2 +1,3 @@
 from .__version__ import __version__
+from .session import TransferSession
 from .utils import apply_transformer, transfer_code, transfer_file
@@ -1,5 +1,10 @@
 from __future__ import annotations
 
+import contextlib
+import json
+import os
+import time
+from collections.abc import Iterator
 from pathlib import Path
 
 import typer
@@ -9,14 +14,28 @@ from rich.highlighter import NullHighlighter
 from rich.logging import RichHandler
 from rich.style import Style
 
-from pyfuture.utils import get_target, transfer_file
+from pyfuture import bytecode, env, events, git, report
+from pyfuture.budget import Budget
+from pyfuture.check import check_files
+from pyfuture.incremental import IncrementalTransformer
+from pyfuture.latency import LatencyTracker
+from pyfuture.linemap import LINE_MAP_NAME, load_line_map, save_line_map
+from pyfuture.manifest import BuildManifest
+from pyfuture.memo import StatementMemo
+from pyfuture.progress import BulkReporter
+from pyfuture.utils import get_target, link_file, transfer_file, transfer_files
+from pyfuture.watch import transfer_changed, watch_tree
 
 app = typer.Typer()
 
 
-def init_logger(log_level: str):
-    handler = RichHandler(console=Console(style=Style()), highlighter=NullHighlighter(), markup=True)
+def init_logger(log_level: str, reporter: BulkReporter | None = None):
     logger.remove()
+    if reporter is not None:
+        # messages are batched between the redraws of the progress line
+        logger.add(reporter.write, format="{message}", level=log_level)
+        return
+    handler = RichHandler(console=Console(style=Style()), highlighter=NullHighlighter(), markup=True)
     logger.add(handler, format="{message}", level=log_level)
 
 
@@ -31,62 +50,377 @@ def transfer(src_file: Path, tgt_file: Path, *, target: str = "py39", log_level:
 
 
 @app.command()
-def watch(src_file: Path, tgt_file: Path, *, target: str = "py39", log_level: str = "INFO"):  # pragma: no cover
+def watch(
+    src_file: Path,
+    tgt_file: Path,
+    *,
+    target: str = "py39",
+    debounce: int = 1600,
+    summary_interval: float = 60.0,
+    log_level: str = "INFO",
+):  # pragma: no cover
     """
-    Transfer all python files in src_dir to build_dir, and watch for changes.
+    Transfer src_file to tgt_file, and watch for changes.
+    Changes are grouped for debounce milliseconds, and the latency is summarized every summary_interval seconds.
     """
 
     init_logger(log_level)
-    transfer_file(src_file, tgt_file)
+    incremental = IncrementalTransformer(get_target(target))
+    incremental.transfer_file(src_file, tgt_file)
+    tracker = LatencyTracker(interval=summary_interval)
 
     from watchfiles import Change, watch
 
-    for changes in watch(src_file):
+    for changes in watch(src_file, debounce=debounce):
+        received = time.time()
         for mode, path in changes:
             match mode:
                 case Change.modified:
-                    logger.info("Source file has been modified")
-                    transfer_file(Path(path), tgt_file, target=get_target(target))
+                    latency = transfer_changed(incremental, Path(path), tgt_file, received)
+                    tracker.record(latency)
+                    reused, total = incremental.reused, incremental.total
+                    logger.info(f"Transferred in {latency['total'] * 1000:.1f} ms, {reused}/{total} statements reused")
                 case Change.deleted:
                     logger.info("Source file has been deleted")
                     break
+        if tracker.due():
+            logger.info(f"Latency: {tracker.summary()}")
 
 
 @app.command()
-def transfer_dir(src_dir: Path, build_dir: Path, *, target: str = "py39", log_level: str = "INFO"):
+def transfer_dir(
+    src_dir: Path,
+    build_dir: Path,
+    *,
+    target: str = "py39",
+    compile_bytecode: bool = False,
+    invalidation_mode: str = "checked-hash",
+    split_threshold: int | None = None,
+    changed_since: str | None = None,
+    mirror: bool = False,
+    link_mode: str = "hardlink",
+    use_manifest: bool = True,
+    preserve_lines: bool = False,
+    executor: str = "auto",
+    workers: int = 0,
+    memo: bool = False,
+    memo_file: Path | None = None,
+    time_budget: float | None = None,
+    memory_budget: int | None = None,
+    max_iterations: int | None = None,
+    budget_fallback: str = "fail",
+    engine: str = "libcst",
+    events_file: Path | None = None,
+    metrics_file: Path | None = None,
+    progress: bool = False,
+    log_level: str = "INFO",
+):
     """
     Transfer all python files in src_dir to build_dir.
+    If use_manifest is set and build_dir is not src_dir, the build is recorded in a manifest in build_dir,
+    so that the next build skips the files which did not change and removes the outputs of deleted files.
+    If preserve_lines is set, statements are kept on their original lines where possible, and the lines which
+    moved are listed in `.pyfuture.map` in build_dir.
+    If mirror is set, the complete tree is mirrored, and files which need no change are linked
+    with link_mode ("hardlink", "reflink" or "copy") instead of written.
+    If changed_since is set, only transfer the files changed in git since that revision,
+    and delete or move the outputs of deleted or renamed files.
+    If compile_bytecode is set, also compile them to `.pyc` files with the target interpreter.
+    Files with at least split_threshold lines are split and transformed across worker processes.
+    Files are transferred with executor ("auto", "serial", "threads" or "processes") across workers,
+    "auto" uses threads on free-threaded builds with the GIL disabled, and transfers serially otherwise.
+    If memo is set, top-level statements duplicated across files are transformed once, and memo_file keeps
+    them for the next build.
+    time_budget (seconds), memory_budget (MiB) and max_iterations limit the transform of each file, files which
+    exceed them fail the build or are copied verbatim with budget_fallback "copy".
+    engine ("libcst" or "splice") is how files are transformed, "splice" rewrites the files which only need simple
+    f-string and union rewrites in place, and falls back to libcst for the others.
+    Events are written to events_file as JSON lines, and metrics to metrics_file in the Prometheus text format.
+    If progress is set, the progress is shown on a single line and summarized in the end, see `BulkReporter`.
+    """
+
+    reporter = BulkReporter() if progress else None
+    init_logger(log_level, reporter)
+
+    with events.open_sinks(events_file, metrics_file), reporter or contextlib.nullcontext():
+        manifest = None
+        if use_manifest and src_dir.resolve() != build_dir.resolve():
+            manifest = BuildManifest.load(build_dir)
+        line_map = load_line_map(build_dir / LINE_MAP_NAME) if preserve_lines else {}
+        if changed_since is None:
+            src_files = list(src_dir.glob("**/*.py"))
+        else:
+            src_files = apply_git_changes(src_dir, build_dir, changed_since, manifest, line_map)
+        for src_file in src_files:
+            events.emit(events.EventKind.queued, path=str(src_file))
+
+        tgt_files = [build_dir / src_file.relative_to(src_dir) for src_file in src_files]
+        statement_memo = None
+        if memo_file is not None:
+            statement_memo = StatementMemo.load(memo_file, get_target(target))
+        elif memo:
+            statement_memo = StatementMemo(get_target(target))
+        budget = None
+        if time_budget is not None or memory_budget is not None or max_iterations is not None:
+            memory = None if memory_budget is None else memory_budget * 1024 * 1024
+            budget = Budget(time_budget, memory, max_iterations, budget_fallback)
+        all_runs = transfer_files(
+            list(zip(src_files, tgt_files)),
+            target=get_target(target),
+            split_threshold=split_threshold,
+            link_mode=link_mode if mirror else None,
+            preserve_lines=preserve_lines,
+            manifest=manifest,
+            memo=statement_memo,
+            budget=budget,
+            engine=engine,
+            executor=executor,
+            workers=workers,
+        )
+        if statement_memo is not None:
+            hits, misses = statement_memo.hits, statement_memo.misses
+            logger.info(f"Statement memo: {hits} hits, {misses} misses ({statement_memo.hit_rate:.0%} hit rate)")
+            if memo_file is not None:
+                statement_memo.save()
+        for tgt_file, runs in zip(tgt_files, all_runs):
+            line_map[tgt_file.relative_to(build_dir).as_posix()] = runs or []
+        if manifest is not None:
+            # only a full build knows which sources were deleted
+            if changed_since is None:
+                for tgt_file in manifest.remove_stale(src_dir):
+                    logger.info("Removed stale output: {}", tgt_file.relative_to(build_dir))
+                    line_map.pop(tgt_file.relative_to(build_dir).as_posix(), None)
+            manifest.save()
+        if preserve_lines:
+            save_line_map(build_dir / LINE_MAP_NAME, line_map)
+
+        if mirror:
+            for src_file in iter_data_files(src_dir, build_dir):
+                link_file(src_file, build_dir / src_file.relative_to(src_dir), link_mode)
+
+        if compile_bytecode:
+            pyc_files = bytecode.compile_bytecode(tgt_files, get_target(target), invalidation_mode=invalidation_mode)
+            logger.info(f"Compiled {len(pyc_files)} bytecode files")
+
+
+def iter_data_files(src_dir: Path, build_dir: Path) -> Iterator[Path]:
+    """
+    Iterate over the files in src_dir which are not python files, skipping bytecode caches and build_dir.
+    """
+    build_dir = build_dir.resolve()
+    for src_file in src_dir.rglob("*"):
+        if src_file.suffix == ".py" or "__pycache__" in src_file.parts or not src_file.is_file():
+            continue
+        if src_file.resolve().is_relative_to(build_dir) and src_dir.resolve() != build_dir:
+            continue
+        yield src_file
+
+
+def apply_git_changes(
+    src_dir: Path,
+    build_dir: Path,
+    rev: str,
+    manifest: BuildManifest | None = None,
+    line_map: dict[str, list[tuple[int, int, int]]] | None = None,
+) -> list[Path]:
+    """
+    Delete or move the outputs of the files deleted or renamed since rev along with their entries in manifest
+    and line_map, and return the source files which have to be transferred.
+    """
+    line_map = {} if line_map is None else line_map
+    src_files = []
+    for change in git.changed_files(src_dir, rev):
+        match change.status:
+            case "deleted":
+                tgt_file = build_dir / change.path
+                logger.info("Deleted: {}", change.path)
+                tgt_file.unlink(missing_ok=True)
+                if manifest is not None:
+                    manifest.forget(tgt_file)
+                line_map.pop(change.path.as_posix(), None)
+            case "renamed":
+                assert change.old_path is not None
+                old_tgt_file, tgt_file = build_dir / change.old_path, build_dir / change.path
+                logger.info("Renamed: {} -> {}", change.old_path, change.path)
+                if old_tgt_file.is_file():
+                    tgt_file.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(old_tgt_file, tgt_file)
+                    if manifest is not None:
+                        manifest.rename(old_tgt_file, tgt_file, src_dir / change.path)
+                    if (runs := line_map.pop(change.old_path.as_posix(), None)) is not None:
+                        line_map[change.path.as_posix()] = runs
+                else:
+                    if manifest is not None:
+                        manifest.forget(old_tgt_file)
+                    line_map.pop(change.old_path.as_posix(), None)
+                src_files.append(src_dir / change.path)
+            case _:
+                src_files.append(src_dir / change.path)
+    logger.info(f"{len(src_files)} files changed since {rev}")
+    return src_files
+
+
+@app.command()
+def transfer_env(
+    site_packages: Path,
+    *,
+    target: str = "py39",
+    cache_dir: Path | None = None,
+    trust_requires_python: bool = False,
+    executor: str = "processes",
+    workers: int = 0,
+    log_level: str = "INFO",
+):
+    """
+    Lower the distributions installed in site_packages (e.g. `.venv/lib/python3.9/site-packages`) in place.
+    All distributions are scanned and transferred with executor across workers, those whose Requires-Python
+    allows target last, or not at all if trust_requires_python is set. Outputs are cached in cache_dir
+    (`~/.cache/pyfuture/env` by default) by the RECORD of each distribution, and reused when the same
+    distribution is installed again.
+    """
+
+    init_logger(log_level)
+    start = time.perf_counter()
+    results = env.transfer_env(
+        site_packages,
+        get_target(target),
+        cache_dir=cache_dir,
+        trust_requires_python=trust_requires_python,
+        executor=executor,
+        workers=workers or None,
+    )
+    for result in results:
+        logger.debug("{} {}: {}, {} files lowered", result.name, result.version, result.status, result.files)
+    counts = {status: sum(result.status == status for result in results) for status in ("transferred", "cached")}
+    lowered = sum(result.files for result in results)
+    logger.info(
+        f"{len(results)} distributions in {time.perf_counter() - start:.2f} s: {counts['transferred']} transferred, "
+        + f"{counts['cached']} cached, {lowered} files lowered"
+    )
+
+
+@app.command()
+def check(
+    src_dir: Path,
+    build_dir: Path | None = None,
+    *,
+    target: str = "py39",
+    workers: int = 0,
+    log_level: str = "INFO",
+):
+    """
+    Check all python files in src_dir without writing anything, and exit with status 1 on violations.
+    Without build_dir, files which need any rule set for the target are violations.
+    With build_dir, outputs which are missing or not up to date in build_dir are violations, judged by the
+    hashes in the build manifest of build_dir, and by transforming the sources which are not recorded there.
+    """
+
+    init_logger(log_level)
+    start = time.perf_counter()
+    src_files = sorted(src_dir.glob("**/*.py"))
+    pairs = [
+        (src_file, None if build_dir is None else build_dir / src_file.relative_to(src_dir)) for src_file in src_files
+    ]
+    manifest = None if build_dir is None else BuildManifest.load(build_dir)
+    results = check_files(pairs, get_target(target), workers=workers, manifest=manifest)
+
+    violations = 0
+    for result in results:
+        path = Path(result.path).relative_to(src_dir)
+        rule_sets = ", ".join(result.rule_sets) or "none"
+        if result.error is not None:
+            logger.error("{}: {}", path, result.error)
+        elif result.output is not None and not result.ok:
+            logger.error("{}: output is {}, needs {}", path, result.output, rule_sets)
+        elif not result.ok:
+            logger.error("{}: needs {}", path, rule_sets)
+        else:
+            logger.debug("{}: ok, needs {}", path, rule_sets)
+        violations += not result.ok
+    logger.info(f"Checked {len(results)} files in {time.perf_counter() - start:.2f} s, {violations} violations")
+    if violations:
+        raise typer.Exit(1)
+
+
+@app.command("report")
+def report_dir(
+    src_dir: Path,
+    build_dir: Path,
+    *,
+    target: str = "py39",
+    output: Path | None = None,
+    repeat: int = 3,
+    measure_imports: bool = True,
+    top: int = 10,
+    log_level: str = "INFO",
+):
+    """
+    Report the impact of the transform on the modules in src_dir, whose outputs are in build_dir.
+    Both are import roots. The import time of each module is measured in fresh subprocesses, from the source
+    and the output on the running interpreter and from the output on the target interpreter if available.
+    Modules are ranked by import overhead and bytecode size overhead, and written to output as JSON.
     """
 
     init_logger(log_level)
+    reports = [
+        report.report_module(
+            src_dir, build_dir, src_file, get_target(target), repeat=repeat, measure_imports=measure_imports
+        )
+        for src_file in sorted(src_dir.glob("**/*.py"))
+    ]
+    reports.sort(key=lambda module: (module.import_overhead, module.size_overhead), reverse=True)
+    summary = report.summarize(reports)
 
-    for src_file in src_dir.glob("**/*.py"):
-        tgt_file = build_dir / src_file.relative_to(src_dir)
-        transfer_file(src_file, tgt_file)
+    for module in reports[:top]:
+        if module.error is not None:
+            logger.error("{}: {}", module.path, module.error)
+            continue
+        import_ms, rule_sets = module.import_overhead * 1000, ", ".join(module.rule_sets) or "none"
+        logger.info(
+            f"{module.path}: import +{import_ms:.2f} ms, bytecode +{module.size_overhead} bytes, needs {rule_sets}"
+        )
+    logger.info(
+        "{modules} modules, import +{import_ms:.2f} ms, bytecode +{size_overhead} bytes, {extra_functions} extra "
+        "functions, {extra_type_vars} extra TypeVars, {lowered_matches} matches and {lowered_fstrings} f-strings "
+        "lowered".format(import_ms=summary["import_overhead"] * 1000, **summary)
+    )
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        data = {"target": target, "summary": summary, "modules": [module.to_dict() for module in reports]}
+        output.write_text(json.dumps(data, indent=2))
 
 
 @app.command()
-def watch_dir(src_dir: Path, build_dir: Path, *, target: str = "py39", log_level: str = "INFO"):  # pragma: no cover
+def watch_dir(
+    src_dir: Path,
+    build_dir: Path,
+    *,
+    target: str = "py39",
+    debounce: int = 1600,
+    summary_interval: float = 60.0,
+    events_file: Path | None = None,
+    metrics_file: Path | None = None,
+    log_level: str = "INFO",
+):  # pragma: no cover
     """
     Transfer all python files in src_dir to build_dir, and watch for changes.
+    Changes are grouped for debounce milliseconds. The latency from saving a file to its output landing in
+    build_dir is tracked by stage, and its p50/p95/p99 are summarized every summary_interval seconds.
+    Events are written to events_file as JSON lines, and metrics to metrics_file in the Prometheus text format.
     """
 
     init_logger(log_level)
-    transfer_dir(src_dir, build_dir, target=target)
-
-    from watchfiles import Change, PythonFilter, watch
 
-    for changes in watch(src_dir, watch_filter=PythonFilter()):
-        for mode, path in changes:
-            match mode:
-                case Change.added | Change.modified:
-                    logger.info(f"Created: {path}")
-                    tgt_file = build_dir / Path(path).relative_to(src_dir)
-                    transfer_file(Path(path), tgt_file)
-                case Change.deleted:
-                    logger.info(f"Deleted: {path}")
-                    tgt_file = build_dir / Path(path).relative_to(src_dir)
-                    tgt_file.unlink()
+    incremental = IncrementalTransformer(get_target(target))
+    tracker = LatencyTracker(interval=summary_interval)
+    with events.open_sinks(events_file, metrics_file):
+        for src_file in src_dir.glob("**/*.py"):
+            incremental.transfer_file(src_file, build_dir / src_file.relative_to(src_dir))
+        try:
+            watch_tree(src_dir, build_dir, incremental, tracker, debounce=debounce)
+        finally:
+            if tracker.count:
+                logger.info(f"Latency: {tracker.summary()}")
 
 
 if __name__ == "__main__":  # pragma: no cover
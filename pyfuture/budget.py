@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable
+from contextvars import ContextVar
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+from . import events
+
+FALLBACKS = ("fail", "copy")
+
+# the maximum number of passes of the rules over a module, see `pyfuture.utils.transform_module`
+max_iterations: ContextVar[int | None] = ContextVar("max_iterations", default=None)
+
+
+class BudgetExceeded(Exception):
+    """
+    A file exceeded its budget of wall time, memory or iterations.
+    """
+
+
+@dataclass(frozen=True)
+class Budget:
+    """
+    The limits on transforming a single file, None means unlimited.
+
+    time is the wall time in seconds, and memory the address space in bytes of the worker process transforming
+    the file, which includes the interpreter and the imported rules. With either of them the file is transformed
+    in a worker process, which is killed and replaced when it exceeds them or crashes.
+    iterations is the number of passes of the rules over a module, which stop when the module no longer changes.
+    fallback is what happens to a file exceeding its budget: "fail" raises `BudgetExceeded`, "copy" copies
+    the source verbatim.
+
+    Example:
+    >>> from pyfuture.utils import transfer_code
+    >>> Budget(iterations=2).run(transfer_code, "def test[T](x: T) -> T: return x").splitlines()[0]
+    'from typing import TypeVar'
+    >>> Budget(iterations=1).run(transfer_code, "def test[T](x: T) -> T: return x")
+    Traceback (most recent call last):
+    ...
+    pyfuture.budget.BudgetExceeded: did not converge in 1 iterations
+    """
+
+    time: float | None = None
+    memory: int | None = None
+    iterations: int | None = None
+    fallback: str = "fail"
+
+    def __post_init__(self) -> None:
+        if self.fallback not in FALLBACKS:
+            raise ValueError(f"Unknown budget fallback: {self.fallback}")
+
+    @property
+    def isolated(self) -> bool:
+        return self.time is not None or self.memory is not None
+
+    def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Call func within the budget, in the worker process of the current thread if the budget is isolated.
+        """
+        if self.isolated:
+            return _worker(self).run(func, args, kwargs)
+        token = max_iterations.set(self.iterations)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            max_iterations.reset(token)
+
+
+def _serve(conn: Connection, memory: int | None) -> None:
+    # the worker process keeps no sinks of its parent, and limits its own address space
+    events.clear_sinks()
+    if memory is not None:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    while True:
+        try:
+            iterations, func, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        token = max_iterations.set(iterations)
+        try:
+            response = (True, func(*args, **kwargs))
+        except Exception as e:
+            response = (False, e)
+        finally:
+            max_iterations.reset(token)
+        try:
+            conn.send(response)
+        except Exception as e:
+            # e.g. an exception which can not be pickled
+            conn.send((False, RuntimeError(f"{type(response[1]).__name__}: {response[1]} ({e})")))
+
+
+class _Worker:
+    def __init__(self, budget: Budget) -> None:
+        self.budget = budget
+        self.process: BaseProcess | None = None
+        self.conn: Connection | None = None
+
+    def start(self) -> None:
+        conn, child_conn = multiprocessing.Pipe()
+        # not a daemon, so that it can start worker processes for split modules itself
+        process = multiprocessing.Process(target=_serve, args=(child_conn, self.budget.memory))
+        process.start()
+        self.process = process
+        child_conn.close()
+        self.conn = conn
+
+    def run(self, func: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        if self.process is None or not self.process.is_alive():
+            self.close()
+            self.start()
+        assert self.conn is not None
+        self.conn.send((self.budget.iterations, func, args, kwargs))
+        # also returns when the worker died
+        if not self.conn.poll(self.budget.time):
+            self.close()
+            raise BudgetExceeded(f"exceeded the time budget of {self.budget.time} s")
+        try:
+            ok, value = self.conn.recv()
+        except EOFError:
+            self.close()
+            raise BudgetExceeded("the worker process died, e.g. exceeding the memory budget") from None
+        if ok:
+            return value
+        if isinstance(value, MemoryError):
+            self.close()
+            raise BudgetExceeded(f"exceeded the memory budget of {self.budget.memory} bytes") from value
+        raise value
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.process = None
+
+
+# the worker processes of each thread
+_WORKERS: dict[tuple[int, Budget], _Worker] = {}
+_WORKERS_LOCK = threading.Lock()
+
+
+def _forget_workers() -> None:
+    # a forked process does not own the worker processes of its parent
+    global _WORKERS_LOCK
+    _WORKERS_LOCK = threading.Lock()
+    _WORKERS.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_workers)
+
+
+def _worker(budget: Budget) -> _Worker:
+    key = (threading.get_ident(), budget)
+    with _WORKERS_LOCK:
+        worker = _WORKERS.get(key)
+        if worker is None:
+            worker = _WORKERS[key] = _Worker(budget)
+    return worker
+
+
+@atexit.register
+def close_workers(current_thread: bool = False) -> None:
+    """
+    Stop the worker processes of all threads, or only of the current thread.
+    """
+    thread = threading.get_ident()
+    with _WORKERS_LOCK:
+        keys = [key for key in _WORKERS if not current_thread or key[0] == thread]
+        workers = [_WORKERS.pop(key) for key in keys]
+    for worker in workers:
+        worker.close()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import shutil
+import subprocess
+import sys
+from collections.abc import Iterable
+from pathlib import Path
+
+from loguru import logger
+
+INVALIDATION_MODES = ("checked-hash", "unchecked-hash")
+
+# Executed by the target interpreter, so it has to stay compatible with every supported target.
+_COMPILE_SCRIPT = """
+import concurrent.futures, functools, py_compile, sys
+mode = py_compile.PycInvalidationMode[sys.argv[1]]
+workers = int(sys.argv[2]) or None
+files = sys.stdin.read().splitlines()
+compile_file = functools.partial(py_compile.compile, doraise=True, invalidation_mode=mode)
+if len(files) > 1 and workers != 1:
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        outputs = list(executor.map(compile_file, files, chunksize=16))
+else:
+    outputs = [compile_file(file) for file in files]
+print("\\n".join(outputs))
+"""
+
+
+def find_interpreter(target: tuple[int, int]) -> str | None:
+    """
+    Find a local interpreter for the target version.
+
+    Example:
+    >>> find_interpreter(sys.version_info[:2]) == sys.executable
+    True
+    >>> find_interpreter((3, 0)) is None
+    True
+    """
+    if sys.version_info[:2] == tuple(target):
+        return sys.executable
+    return shutil.which(f"python{target[0]}.{target[1]}")
+
+
+def compile_bytecode(
+    files: Iterable[Path],
+    target: tuple[int, int],
+    *,
+    invalidation_mode: str = "checked-hash",
+    workers: int = 0,
+) -> list[Path]:
+    """
+    Compile files to hash-based `.pyc` files in `__pycache__` with the target interpreter,
+    and return the paths of the compiled files. If the target interpreter is not available,
+    nothing is compiled.
+
+    Example:
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     src_file = Path(tmp_dir) / "example.py"
+    ...     _ = src_file.write_text("x = 1\\n")
+    ...     pyc_files = compile_bytecode([src_file], sys.version_info[:2])
+    ...     print([str(pyc_file.relative_to(tmp_dir).parent) for pyc_file in pyc_files])
+    ['__pycache__']
+    """
+    if invalidation_mode not in INVALIDATION_MODES:
+        raise ValueError(f"Unknown invalidation mode: {invalidation_mode}")
+    files = [Path(file) for file in files]
+    if not files:
+        return []
+    interpreter = find_interpreter(target)
+    if interpreter is None:
+        logger.warning(f"Python {target[0]}.{target[1]} is not available, skip compiling bytecode")
+        return []
+
+    mode = invalidation_mode.replace("-", "_").upper()
+    result = subprocess.run(
+        [interpreter, "-c", _COMPILE_SCRIPT, mode, str(workers)],
+        input="\n".join(str(file) for file in files),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to compile bytecode:\n{result.stderr}")
+    return [Path(line) for line in result.stdout.splitlines() if line]
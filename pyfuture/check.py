@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import ast
+import os
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import libcst as cst
+
+from .codemod.utils import NodeTypeIndex, RuleSet, get_transformers
+from .incremental import get_ast_triggers
+from .utils import file_hash, get_rule_sets, transfer_code
+
+if TYPE_CHECKING:
+    from .manifest import BuildManifest
+
+
+def _is_union(node: ast.AST | None) -> bool:
+    return isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr)
+
+
+def _needs_pep604(node: ast.AST) -> bool:
+    # the union rule only rewrites annotations and the classes of `isinstance` and `issubclass`
+    match node:
+        case ast.arg(annotation=annotation) | ast.AnnAssign(annotation=annotation):
+            return _is_union(annotation)
+        case ast.FunctionDef(returns=returns) | ast.AsyncFunctionDef(returns=returns):
+            return _is_union(returns)
+        case ast.Call(func=ast.Name(id="isinstance" | "issubclass"), args=[_, cls_info]):
+            return _is_union(cls_info)
+    return False
+
+
+# nodes of newer syntax are missing from the ast of older interpreters, which can not parse that syntax either
+_MATCH = getattr(ast, "Match", None)
+_TYPE_ALIAS = getattr(ast, "TypeAlias", None)
+
+
+def _needs_pep695(node: ast.AST) -> bool:
+    return (_TYPE_ALIAS is not None and isinstance(node, _TYPE_ALIAS)) or bool(getattr(node, "type_params", None))
+
+
+# whether a node of the stdlib ast needs a built-in rule set
+_SCANNERS: dict[RuleSet | str, Callable[[ast.AST], bool]] = {
+    RuleSet.pep604: _needs_pep604,
+    RuleSet.pep622: lambda node: _MATCH is not None and isinstance(node, _MATCH),
+    RuleSet.pep695: _needs_pep695,
+    RuleSet.pep701: lambda node: isinstance(node, ast.JoinedStr),
+}
+
+
+def _trigger_scanner(rule_set: RuleSet | str) -> Callable[[ast.AST], bool]:
+    known_triggers = get_ast_triggers()
+    node_types: list[type[ast.AST]] = []
+    for transformer in get_transformers(rule_set):
+        triggers = getattr(transformer, "TRIGGERS", None)
+        if triggers is None or any(trigger not in known_triggers for trigger in triggers):
+            return lambda node: True
+        for trigger in triggers:
+            node_types.extend(known_triggers[trigger])
+    types = tuple(node_types)
+    return lambda node: isinstance(node, types)
+
+
+def needed_rule_sets(tree: ast.AST, rule_sets: Iterable[RuleSet | str]) -> list[RuleSet | str]:
+    """
+    Scan a stdlib ast once, and return the rule sets which would change it.
+    Custom rule sets are needed if any node matches their `TRIGGERS`, or always if they have none.
+
+    Example:
+    >>> tree = ast.parse("def f(x: int | None): return f'{x}'\\ny = 1 | 2\\n")
+    >>> [rule_set.value for rule_set in needed_rule_sets(tree, get_rule_sets((3, 9)))]
+    ['pep701', 'pep604']
+    """
+    scanners = {rule_set: _SCANNERS.get(rule_set) or _trigger_scanner(rule_set) for rule_set in rule_sets}
+    needed: set[RuleSet | str] = set()
+    for node in ast.walk(tree):
+        for rule_set, scanner in scanners.items():
+            if rule_set not in needed and scanner(node):
+                needed.add(rule_set)
+        if len(needed) == len(scanners):
+            break
+    return [rule_set for rule_set in scanners if rule_set in needed]
+
+
+def triggered_rule_sets(code: str, rule_sets: Iterable[RuleSet | str]) -> list[RuleSet | str]:
+    """
+    Return the rule sets with any `TRIGGERS` in code parsed by libcst, for code the interpreter is too old
+    to parse with ast. Unlike `needed_rule_sets` this does not tell the unions which are no annotations apart.
+
+    Example:
+    >>> [rule_set.value for rule_set in triggered_rule_sets("y = 1 | 2\\n", get_rule_sets((3, 9)))]
+    ['pep604']
+    """
+    index = NodeTypeIndex(cst.parse_module(code))
+    needed = []
+    for rule_set in rule_sets:
+        for transformer in get_transformers(rule_set):
+            triggers = getattr(transformer, "TRIGGERS", None)
+            if triggers is None or index.contains(triggers):
+                needed.append(rule_set)
+                break
+    return needed
+
+
+@dataclass
+class CheckResult:
+    """
+    The result of checking one source file. output is "missing", "stale" or "up-to-date" if its output was checked.
+    """
+
+    path: str
+    rule_sets: list[str] = field(default_factory=list)
+    output: str | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        if self.error is not None:
+            return False
+        if self.output is not None:
+            return self.output == "up-to-date"
+        return not self.rule_sets
+
+
+def check_file(
+    src_file: Path,
+    tgt_file: Path | None = None,
+    target: tuple[int, int] = (3, 9),
+    manifest: BuildManifest | None = None,
+) -> CheckResult:
+    """
+    Check which rule sets src_file needs for target, and whether tgt_file is up to date if it is given.
+    Outputs recorded in the build manifest are compared with the hashes of their source and output recorded
+    there, in any mode they were built with. Outputs of other files which need no rule set are compared with
+    the source by hash, the rest are transformed in memory to compare them, nothing is written.
+    Sources the interpreter can not parse with ast are checked with `triggered_rule_sets` instead.
+    """
+    result = CheckResult(str(src_file))
+    try:
+        code = src_file.read_text()
+    except (OSError, ValueError) as e:
+        result.error = f"{type(e).__name__}: {e}"
+        return result
+    try:
+        rule_sets = needed_rule_sets(ast.parse(code), get_rule_sets(target))
+    except SyntaxError as e:
+        try:
+            rule_sets = triggered_rule_sets(code, get_rule_sets(target))
+        except (cst.ParserSyntaxError, RecursionError):
+            # invalid for libcst as well, so the error of the interpreter is reported
+            result.error = f"{type(e).__name__}: {e}"
+            return result
+    except (ValueError, RecursionError) as e:
+        result.error = f"{type(e).__name__}: {e}"
+        return result
+    result.rule_sets = [rule_set.value if isinstance(rule_set, RuleSet) else rule_set for rule_set in rule_sets]
+    if tgt_file is None:
+        return result
+
+    if not tgt_file.is_file():
+        result.output = "missing"
+        return result
+    entry = None if manifest is None else manifest.lookup(src_file, tgt_file, target, preserve_lines=None)
+    if entry is not None:
+        hashes = (file_hash(code), file_hash(tgt_file.read_text()))
+        result.output = "up-to-date" if hashes == (entry.hash, entry.output_hash) else "stale"
+        return result
+    if result.rule_sets:
+        try:
+            expected = transfer_code(code, target=target)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+            return result
+    else:
+        expected = code
+    result.output = "up-to-date" if file_hash(tgt_file.read_text()) == file_hash(expected) else "stale"
+    return result
+
+
+def _check_files(
+    pairs: Sequence[tuple[Path, Path | None]], target: tuple[int, int], manifest: BuildManifest | None = None
+) -> list[CheckResult]:
+    return [check_file(src_file, tgt_file, target, manifest) for src_file, tgt_file in pairs]
+
+
+def _manifest_part(manifest: BuildManifest | None, pairs: Sequence[tuple[Path, Path | None]]) -> BuildManifest | None:
+    if manifest is None:
+        return None
+    return manifest.part([tgt_file for _, tgt_file in pairs if tgt_file is not None])
+
+
+def check_files(
+    pairs: Sequence[tuple[Path, Path | None]],
+    target: tuple[int, int] = (3, 9),
+    workers: int | None = None,
+    manifest: BuildManifest | None = None,
+) -> list[CheckResult]:
+    """
+    Check pairs of source file and output file (or None) across worker processes, in batches to keep
+    the scheduling overhead low for many small files. The outputs are checked against manifest if it is given,
+    see `check_file`.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(pairs) <= 1:
+        return _check_files(pairs, target, manifest)
+    batch_size = max(-(-len(pairs) // (workers * 4)), 1)
+    batches = [pairs[i : i + batch_size] for i in range(0, len(pairs), batch_size)]
+    with ProcessPoolExecutor(min(workers, len(batches))) as executor:
+        futures = [executor.submit(_check_files, batch, target, _manifest_part(manifest, batch)) for batch in batches]
+        return [result for future in futures for result in future.result()]
@@ -2,14 +2,14 @@ from __future__ import annotations
 
 import libcst as cst
 from libcst import matchers as m
-from libcst.codemod import CodemodContext, VisitorBasedCodemodCommand
+from libcst.codemod import CodemodContext
 from libcst.codemod.visitors import AddImportsVisitor
-from libcst.metadata import ScopeProvider
 
-from ..utils import transform_bit_or
+from ..utils import RuleCommand, RuleSet, register_rule, transform_bit_or
 
 
-class TransformUnionTypesCommand(VisitorBasedCodemodCommand):
+@register_rule(RuleSet.pep604)
+class TransformUnionTypesCommand(RuleCommand):
     """
     Transform union types to typing.Union.
 
@@ -26,11 +26,25 @@ class TransformUnionTypesCommand(VisitorBasedCodemodCommand):
         return x
     """
 
-    METADATA_DEPENDENCIES = (ScopeProvider,)
+    TRIGGERS = (cst.BitOr,)
+    STATEMENT_LOCAL = True
 
     def __init__(self, context: CodemodContext) -> None:
         super().__init__(context)
 
+    # unions are transformed from the original nodes, so their operands are not visited, which keeps
+    # long unions from nesting the recursive visitor
+
+    def visit_Call(self, node: cst.Call) -> bool:
+        return not (
+            m.matches(node.func, m.Name("isinstance") | m.Name("issubclass"))
+            and len(node.args) > 1
+            and m.matches(node.args[1].value, m.BinaryOperation(operator=m.BitOr()))
+        )
+
+    def visit_Annotation(self, node: cst.Annotation) -> bool:
+        return not m.matches(node.annotation, m.BinaryOperation(operator=m.BitOr()))
+
     def leave_Call(self, original_node: cst.Call, updated_node: cst.Call):
         if not m.matches(original_node.func, m.Name("isinstance") | m.Name("issubclass")):
             return updated_node
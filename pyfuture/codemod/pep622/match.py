@@ -1,157 +1,143 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import TYPE_CHECKING
 
 import libcst as cst
-from libcst import (
-    BaseStatement,
-    ClassDef,
-    FlattenSentinel,
-    FunctionDef,
-    RemovalSentinel,
-)
-from libcst.codemod import (
-    CodemodContext,
-    VisitorBasedCodemodCommand,
-)
-from libcst.metadata import FunctionScope, ScopeProvider
-
-from ...transformer import ReplaceTransformer
-
-
-def match_selector(left: cst.BaseExpression, case: cst.MatchCase):
-    match case.pattern:
-        case cst.MatchAs():
-            """
-                case _
-            """
-            if case.pattern.pattern is None and case.pattern.name is None:
-                gen_if = cst.Else(body=case.body)
-            elif case.pattern.name is not None:
-                """
-                case [x] as y
-                """
-                gen_if = cst.If(
-                    test=cst.Comparison(
-                        left=left,
-                        comparisons=[
-                            cst.ComparisonTarget(
-                                operator=match_op_selector([left, case.pattern.name]),
-                                comparator=case.pattern.name,
-                            )
-                        ],
-                    ),
-                    body=case.body,
-                )
-            else:
-                # TODO(gouzil): case [x] if x>0
-                raise NotImplementedError()
-        case cst.MatchClass():
-            """
-            class demo:
-                pass
-
-            case demo():
-                pass
-            """
-            gen_if = cst.If(
-                test=cst.Call(
-                    func=cst.Name(value="isinstance"),
-                    args=[
-                        cst.Arg(value=left),
-                        cst.Arg(value=case.pattern.cls),
-                    ],
-                ),
-                body=case.body,
-            )
-        case cst.MatchValue():
-            """
-            case "test":
-            """
-            gen_if = cst.If(
-                test=cst.Comparison(
-                    left=left,
-                    comparisons=[
-                        cst.ComparisonTarget(
-                            operator=match_op_selector([left, case.pattern.value]),
-                            comparator=case.pattern.value,
-                        )
-                    ],
-                ),
-                body=case.body,
-            )
-        case _:
-            raise RuntimeError(f"no support type: {case.pattern}")
-    return gen_if
-
-
-def match_transform(
-    left: cst.BaseExpression,
-    case: cst.MatchCase,
-    root_if: cst.If,
-) -> cst.If | cst.Else:
-    if root_if.orelse is None:
-        return root_if.with_changes(orelse=match_selector(left, case))
-    else:
-        assert isinstance(root_if.orelse, cst.If)
-        return root_if.with_changes(
-            orelse=match_transform(
-                left=left,
-                case=case,
-                root_if=root_if.orelse,
+from libcst.codemod import CodemodContext
+from libcst.codemod.visitors import AddImportsVisitor
+
+from ..utils import RuleCommand, RuleSet, register_rule
+from .patterns import MATCH_ARGS_FUNCTION, MISSING, SUBJECT, PatternCompiler, Value, capture_names, code_of, guard_of
+
+
+def prepend_statements(
+    body: cst.BaseSuite,
+    statements: list[cst.BaseStatement],
+) -> cst.BaseSuite:
+    if not statements:
+        return body
+    if isinstance(body, cst.SimpleStatementSuite):
+        return cst.IndentedBlock(body=[*statements, cst.SimpleStatementLine(body=body.body)])
+    assert isinstance(body, cst.IndentedBlock)
+    return body.with_changes(body=[*statements, *body.body])
+
+
+if TYPE_CHECKING:
+    # a case with its test (`None` if irrefutable) and the assignments of its captured names
+    Branch = tuple[cst.MatchCase, str | None, list[cst.BaseStatement]]
+
+# the longest if/elif chain generated for a match statement, libcst visits and generates an elif chain
+# recursively, so longer matches are split into several chains to keep the recursion depth bounded
+MAX_CHAIN = 64
+
+
+def build_chain(branches: list[Branch], orelse: cst.If | cst.Else | None = None) -> cst.If:
+    """
+    Build an if/elif chain from the branches in a single pass from the last branch to the first.
+    """
+    for case, test, assignments in reversed(branches):
+        body = prepend_statements(case.body, assignments)
+        if test is None:
+            orelse = cst.Else(body=body, leading_lines=case.leading_lines)
+        else:
+            orelse = cst.If(
+                test=cst.parse_expression(test),
+                body=body,
+                orelse=orelse,
+                leading_lines=case.leading_lines,
             )
-        )
-
-
-def match_op_selector(arg_list: list[Any]):
-    assert len(arg_list) == 2
-    # left: cst.CSTNode,node: cst.CSTNode
-    # TODO(gouzil): Need to support MatchOr first
-    # match arg_list:
-    #     case (
-    #         [cst.SimpleString(), cst.SimpleString()]
-    #         | [cst.Name(), cst.SimpleString()]
-    #         | [cst.SimpleString(), cst.Name()]
-    #         | [cst.Name(), cst.Integer()]
-    #         | [cst.Integer(), cst.Name()]
-    #     ):
-    #         """
-    #         demo:
-    #             "test" == "test"
-    #             "test" == 123
-    #         """
-    #         op = cst.Equal()
-    #     case _:
-    #         op = cst.Is()
-
-    op = cst.Equal()
-    return op
-
-
-# TODO(gouzil): format
-def replace_match_node(
-    body_scope: FunctionScope,
-    match_body: cst.Match,
-    zero_case: cst.MatchCase,
-    root_if: cst.If | None = None,
-) -> FunctionDef:
-    assert isinstance(body_scope.node, FunctionDef)
-    new_body_code: list[cst.CSTNode] = list(body_scope.node.body.body)
-    index: int = new_body_code.index(match_body)
-    del new_body_code[index]
-    if root_if is None:
-        for body in zero_case.body.body:
-            new_body_code.insert(index, body)
-            index += 1
+    assert isinstance(orelse, cst.If)
+    return orelse.with_changes(leading_lines=[])
+
+
+def build_segments(branches: list[Branch], flag: str) -> list[cst.BaseStatement]:
+    """
+    Build the branches as consecutive if/elif chains of at most `MAX_CHAIN` branches, where each chain
+    only runs if no branch of the previous chains matched.
+    """
+    segments = [branches[i : i + MAX_CHAIN] for i in range(0, len(branches), MAX_CHAIN)]
+    if segments[-1][0][1] is None:
+        # an irrefutable case stays the else branch of the last chain
+        last = segments.pop()
+        segments[-1] += last
+    statements: list[cst.BaseStatement] = [cst.parse_statement(f"{flag} = True\n")]
+    not_matched = cst.Else(body=cst.IndentedBlock(body=[cst.parse_statement(f"{flag} = False\n")]))
+    for i, segment in enumerate(segments):
+        chain = build_chain(segment, not_matched if i < len(segments) - 1 else None)
+        if i == 0:
+            statements.append(chain)
+        else:
+            body = [chain] if i == len(segments) - 1 else [cst.parse_statement(f"{flag} = True\n"), chain]
+            statements.append(cst.If(test=cst.parse_expression(f"not {flag}"), body=cst.IndentedBlock(body=body)))
+    return statements
+
+
+def lower_match(node: cst.Match, uid: int = 0) -> tuple[list[cst.BaseStatement], bool]:
+    """
+    Lower a match statement to an if statement, and return the statements with whether
+    `collections.abc` is needed. uid distinguishes the temporaries of nested matches.
+
+    Each case becomes one branch whose test is the conjunction of the tests of its pattern. Tests on the
+    subject shared by several cases (sequence and mapping checks, the length, key lookups and `isinstance`)
+    are evaluated once, by the first case needing them. Captured names are assigned at the start of the
+    branch, or with assignment expressions before the guard and within or-patterns.
+    """
+    statements: list[str] = []
+    subject = code_of(node.subject)
+    captures = set().union(*(capture_names(case.pattern) for case in node.cases))
+    if not isinstance(node.subject, cst.Name) or subject in captures:
+        statements.append(f"{SUBJECT} = {subject}")
+        subject = SUBJECT
+
+    compiler = PatternCompiler(subject)
+    compiler.share([case.pattern for case in node.cases])
+
+    branches: list[Branch] = []
+    for case in node.cases:
+        bindings: list[tuple[str, str]] = []
+        tests = compiler.compile(case.pattern, Value(subject, root=True), bindings)
+        if case.guard is not None:
+            if bindings:
+                tests.append("[" + ", ".join(f"{name} := {value}" for name, value in bindings) + "]")
+            tests.append(guard_of(case.guard))
+            bindings = []
+        assignments: list[cst.BaseStatement] = [cst.parse_statement(f"{name} = {value}\n") for name, value in bindings]
+        if len(tests) == 1 and isinstance(case.pattern, cst.MatchOr):
+            # strip the parentheses of a single or-pattern
+            tests = [tests[0][1:-1]]
+        branches.append((case, " and ".join(tests) or None, assignments))
+        if not tests:
+            # an irrefutable pattern is always the last case
+            break
+
+    if compiler.needs_missing:
+        statements.insert(0, f"{MISSING} = object()")
+    if compiler.needs_match_args:
+        statements.insert(0, MATCH_ARGS_FUNCTION.strip())
+    new_statements: list[cst.BaseStatement] = [cst.parse_statement(f"{statement}\n") for statement in statements]
+
+    first_case, first_test, first_assignments = branches[0]
+    if first_test is None:
+        body = prepend_statements(first_case.body, first_assignments)
+        if isinstance(body, cst.IndentedBlock):
+            new_statements += body.body
+        else:
+            assert isinstance(body, cst.SimpleStatementSuite)
+            new_statements.append(cst.SimpleStatementLine(body=body.body))
+    elif len(branches) <= MAX_CHAIN:
+        new_statements.append(build_chain(branches))
     else:
-        new_body_code.insert(index, root_if)
-    new_root_if = body_scope.node.body.with_changes(body=new_body_code)
-    return body_scope.node.with_changes(body=new_root_if)
+        new_statements += build_segments(branches, f"__match_matched_{uid}")
+
+    if new_statements:
+        new_statements[0] = new_statements[0].with_changes(leading_lines=node.leading_lines)
+    return new_statements, compiler.needs_abc
 
 
-class TransformMatchCommand(VisitorBasedCodemodCommand):
+@register_rule(RuleSet.pep622)
+class TransformMatchCommand(RuleCommand):
     """
-    Remove math from the node and replace it with a new function
+    Lower match statements to if statements.
 
     Example:
     >>> transformer = TransformMatchCommand(CodemodContext())
@@ -241,91 +227,57 @@ class TransformMatchCommand(VisitorBasedCodemodCommand):
 
     >>> module = cst.parse_module(\"""
     ... def test5():
-    ...     test_value = 123
-    ...     match test_value:
-    ...         case [x] as y:
-    ...             print("other")
+    ...    for i in range(2):
+    ...        match i:
+    ...            case 0 | 1:
+    ...                yield 0
+    ...            case 2:
+    ...                yield 1
     ... \""")
     >>> new_module = transformer.transform_module(module)
     >>> print(new_module.code)
     def test5():
-        test_value = 123
-        if test_value == y:
-            print("other")
+       for i in range(2):
+           if i == 0 or i == 1:
+               yield 0
+           elif i == 2:
+               yield 1
 
     >>> module = cst.parse_module(\"""
-    ... def test6():
-    ...    for i in range(2):
-    ...        match i:
-    ...            case 0:
-    ...                yield 0
-    ...            case 1:
-    ...                yield 1
+    ... def test6(point):
+    ...     match point:
+    ...         case (x, 0) if x > 0:
+    ...             return "positive x axis"
+    ...         case {"x": 0, "y": y}:
+    ...             return "y axis"
     ... \""")
     >>> new_module = transformer.transform_module(module)
+    >>> print(new_module.code.splitlines()[-2])
+            y = __match_1
+    >>> namespace = {}
+    >>> exec(new_module.code, namespace)
+    >>> [namespace["test6"](point) for point in [(1, 0), {"x": 0, "y": 2}, "x0"]]
+    ['positive x axis', 'y axis', None]
     """
 
-    # TODO(zrr1999): Need to support nested
-
-    METADATA_DEPENDENCIES = (ScopeProvider,)
+    TRIGGERS = (cst.Match,)
+    STATEMENT_LOCAL = True
 
     def __init__(self, context: CodemodContext) -> None:
-        self.node_to_body: dict[FunctionDef | ClassDef, Any] = {}
         super().__init__(context)
-
-    def visit_FunctionDef(self, node: FunctionDef) -> bool | None:
-        body_scope = self.get_metadata(ScopeProvider, node.body)
-        assert isinstance(body_scope, FunctionScope)
-        assert isinstance(body_scope.node, FunctionDef)
-        replacemences = {}
-        for body in body_scope.node.body.body:
-            if not isinstance(body, cst.Match):
-                continue
-            zero_case: cst.MatchCase = body.cases[0]
-            if (
-                len(body.cases) == 1
-                and isinstance(zero_case.pattern, cst.MatchAs)
-                and zero_case.pattern.pattern is None
-            ):
-                # replace match
-                replacemences[node] = replace_match_node(
-                    body_scope,
-                    body,
-                    zero_case,
-                    None,
-                )
-            else:
-                root_if = match_selector(body.subject, zero_case)
-                for cs in body.cases[1:]:
-                    assert isinstance(root_if, cst.If)
-                    root_if = match_transform(
-                        body.subject,
-                        cs,
-                        root_if,
-                    )
-
-                assert isinstance(root_if, cst.If)
-                # replace match
-                replacemences[node] = replace_match_node(
-                    body_scope,
-                    body,
-                    zero_case,
-                    root_if,
-                )
-
-        new_node = node.visit(ReplaceTransformer(replacemences))
-
-        assert isinstance(new_node, FunctionDef)
-
-        self.node_to_body[node] = new_node
-
-        return False
-
-    def leave_FunctionDef(
-        self, original_node: FunctionDef, updated_node: FunctionDef
-    ) -> BaseStatement | FlattenSentinel[BaseStatement] | RemovalSentinel:
-        body = self.node_to_body.get(original_node, None)
-        if body is None:
-            return updated_node
-
-        return FlattenSentinel([body])
+        # the number of enclosing match statements, which makes the temporaries of nested matches unique
+        self.depth = 0
+
+    def visit_Match(self, node: cst.Match) -> None:
+        self.depth += 1
+
+    def leave_Match(
+        self, original_node: cst.Match, updated_node: cst.Match
+    ) -> cst.BaseStatement | cst.FlattenSentinel[cst.BaseStatement] | cst.RemovalSentinel:
+        self.depth -= 1
+        statements, needs_abc = lower_match(updated_node, self.depth)
+        if needs_abc:
+            AddImportsVisitor.add_needed_import(self.context, "collections.abc")
+        if not statements:
+            return cst.RemovalSentinel.REMOVE
+        return cst.FlattenSentinel(statements)
@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+import libcst as cst
+
+SUBJECT = "__match_subject"
+MISSING = "__match_missing"
+MATCH_ARGS = "__match_args"
+SEQUENCE = "collections.abc.Sequence"
+MAPPING = "collections.abc.Mapping"
+
+# the names of the positional sub-patterns of a class pattern, dataclasses only define `__match_args__`
+# since python 3.10, so their init fields are used like the `__match_args__` they would get
+MATCH_ARGS_FUNCTION = f"""
+def {MATCH_ARGS}(cls, count):
+    import dataclasses
+
+    match_args = getattr(cls, "__match_args__", None)
+    if match_args is None and dataclasses.is_dataclass(cls):
+        match_args = tuple(field.name for field in dataclasses.fields(cls) if field.init)
+    if match_args is None:
+        match_args = ()
+    if count > len(match_args):
+        raise TypeError(f"{{cls.__name__}}() accepts {{len(match_args)}} positional sub-patterns ({{count}} given)")
+    return match_args
+"""
+
+NON_SEQUENCES = "(str, bytes, bytearray, dict, int, float)"
+NON_MAPPINGS = "(list, tuple, str, bytes, bytearray, int, float)"
+
+# builtin classes whose single positional sub-pattern matches the subject itself
+SELF_MATCHING_CLASSES = {
+    "bool",
+    "bytearray",
+    "bytes",
+    "dict",
+    "float",
+    "frozenset",
+    "int",
+    "list",
+    "set",
+    "str",
+    "tuple",
+}
+
+# expressions which can be used as an operand of `and`, `not`, comparisons and subscripts without parentheses
+_ATOMS = (
+    cst.Name,
+    cst.Attribute,
+    cst.Call,
+    cst.Subscript,
+    cst.BaseNumber,
+    cst.SimpleString,
+    cst.ConcatenatedString,
+    cst.List,
+    cst.Tuple,
+    cst.Dict,
+    cst.Set,
+)
+
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+
+
+def code_of(node: cst.CSTNode) -> str:
+    return cst.Module(body=[]).code_for_node(node)
+
+
+def atom_of(node: cst.BaseExpression) -> str:
+    code = code_of(node)
+    if isinstance(node, _ATOMS) or node.lpar:
+        return code
+    return f"({code})"
+
+
+def guard_of(node: cst.BaseExpression) -> str:
+    if isinstance(node, (cst.Comparison, cst.UnaryOperation)) or (
+        isinstance(node, cst.BooleanOperation) and isinstance(node.operator, cst.And)
+    ):
+        return code_of(node)
+    return atom_of(node)
+
+
+def strip_as(pattern: cst.MatchPattern) -> cst.MatchPattern:
+    while isinstance(pattern, cst.MatchAs) and pattern.pattern is not None:
+        pattern = pattern.pattern
+    return pattern
+
+
+def is_wildcard(pattern: cst.MatchPattern) -> bool:
+    return isinstance(pattern, cst.MatchAs) and pattern.pattern is None and pattern.name is None
+
+
+def is_simple(pattern: cst.MatchPattern) -> bool:
+    """
+    Whether the pattern uses the value it matches at most once.
+    """
+    return isinstance(pattern, (cst.MatchValue, cst.MatchSingleton)) or (
+        isinstance(pattern, cst.MatchAs) and pattern.pattern is None
+    )
+
+
+def capture_names(pattern: cst.CSTNode) -> set[str]:
+    names = set()
+
+    class Collector(cst.CSTVisitor):
+        def visit_MatchAs(self, node: cst.MatchAs) -> None:
+            if node.name is not None:
+                names.add(node.name.value)
+
+        def visit_MatchStar(self, node: cst.MatchStar) -> None:
+            if node.name is not None:
+                names.add(node.name.value)
+
+        def visit_MatchMapping(self, node: cst.MatchMapping) -> None:
+            if node.rest is not None:
+                names.add(node.rest.value)
+
+    pattern.visit(Collector())
+    return names
+
+
+@dataclass
+class Value:
+    """
+    A value being matched. If it has a temp, the first use evaluates expr and binds it to temp with
+    an assignment expression, which is always the first test of the sub-pattern, and later uses read temp.
+    """
+
+    expr: str
+    temp: str | None = None
+    root: bool = False
+    bound: bool = False
+
+    def use(self) -> str:
+        if self.temp is None:
+            return self.expr
+        if self.bound:
+            return self.temp
+        self.bound = True
+        return f"({self.temp} := {self.expr})"
+
+    def peek(self) -> str:
+        return self.temp if self.temp is not None and self.bound else self.expr
+
+
+@dataclass
+class Shared:
+    """
+    Tests on the subject shared by several cases. They are bound to temps by the first case that
+    needs them, where they are the first tests, so they are evaluated before any later case reads them.
+    """
+
+    sequence: bool = False
+    mapping: bool = False
+    keys: dict[str, str] = field(default_factory=dict)
+    classes: dict[str, str] = field(default_factory=dict)
+    defined: set[str] = field(default_factory=set)
+
+
+class PatternCompiler:
+    """
+    Compile the patterns of a match statement to test expressions and bindings of captured names.
+
+    The tests follow the semantics of PEP 634: sequence patterns check `collections.abc.Sequence`
+    (excluding `str`, `bytes` and `bytearray`) and the length, mapping patterns check
+    `collections.abc.Mapping` and look keys up with `get`, class patterns check `isinstance` and
+    look attributes up with `getattr` (positional sub-patterns through `__match_args__`, or the init fields of
+    dataclasses without it, like before python 3.10).
+    """
+
+    def __init__(self, subject: str) -> None:
+        self.subject = subject
+        self.counter = 0
+        self.needs_missing = False
+        self.needs_match_args = False
+        self.needs_abc = False
+        self.shared = Shared()
+
+    def new_temp(self) -> str:
+        temp = f"__match_{self.counter}"
+        self.counter += 1
+        return temp
+
+    def share(self, patterns: list[cst.MatchPattern]) -> None:
+        """
+        Find the sequence, length, mapping, key lookup and `isinstance` tests on the subject which are
+        needed by several cases, so that they are evaluated once.
+        """
+        roots = [strip_as(pattern) for pattern in patterns]
+        mappings = [root for root in roots if isinstance(root, cst.MatchMapping)]
+        key_counts = Counter(key for root in mappings for key in {code_of(element.key) for element in root.elements})
+        class_counts = Counter(code_of(root.cls) for root in roots if isinstance(root, cst.MatchClass))
+
+        shared = self.shared
+        shared.sequence = sum(isinstance(root, cst.MatchSequence) for root in roots) >= 2
+        shared.mapping = len(mappings) >= 2
+        if shared.mapping:
+            shared.keys = {key: self.new_temp() for key, count in key_counts.items() if count >= 2}
+        shared.classes = {cls: self.new_temp() for cls, count in class_counts.items() if count >= 2}
+
+    def define(self, name: str) -> bool:
+        """
+        Return whether the shared test is not defined yet, and mark it defined.
+        """
+        if name in self.shared.defined:
+            return False
+        self.shared.defined.add(name)
+        return True
+
+    def compile(
+        self,
+        pattern: cst.MatchPattern,
+        value: Value,
+        bindings: list[tuple[str, str]],
+        inline: bool = False,
+    ) -> list[str]:
+        """
+        Compile pattern matching value to tests which are joined with `and`.
+        Captured names are appended to bindings, or bound inline with assignment expressions if inline is set.
+        """
+        match pattern:
+            case cst.MatchAs(pattern=None, name=None):
+                return []
+            case cst.MatchAs(pattern=None, name=cst.Name(value=name)):
+                return self.bind(name, value, bindings, inline)
+            case cst.MatchAs(pattern=sub_pattern, name=name) if sub_pattern is not None:
+                tests = self.compile(sub_pattern, value, bindings, inline)
+                if name is not None:
+                    tests += self.bind(name.value, value, bindings, inline)
+                return tests
+            case cst.MatchSingleton():
+                return [f"{value.use()} is {code_of(pattern.value)}"]
+            case cst.MatchValue():
+                return [f"{value.use()} == {atom_of(pattern.value)}"]
+            case cst.MatchSequence():
+                return self.compile_sequence(pattern, value, bindings, inline)
+            case cst.MatchMapping():
+                return self.compile_mapping(pattern, value, bindings, inline)
+            case cst.MatchClass():
+                return self.compile_class(pattern, value, bindings, inline)
+            case cst.MatchOr():
+                return [self.compile_or(pattern, value)]
+            case _:
+                raise NotImplementedError(f"Unsupported pattern: {type(pattern).__name__}")
+
+    def bind(self, name: str, value: Value, bindings: list[tuple[str, str]], inline: bool) -> list[str]:
+        if inline:
+            return [f"[{name} := {value.use()}]"]
+        bindings.append((name, value.peek()))
+        return []
+
+    def sequence_test(self, value: Value) -> str:
+        self.needs_abc = True
+        # check the common builtin types first, which is much faster than checking the abstract base class
+        builtin = f"isinstance({value.use()}, (list, tuple))"
+        abstract = f"not isinstance({value.use()}, {NON_SEQUENCES}) and isinstance({value.use()}, {SEQUENCE})"
+        return f"({builtin} or {abstract})"
+
+    def mapping_test(self, value: Value) -> str:
+        self.needs_abc = True
+        builtin = f"isinstance({value.use()}, dict)"
+        abstract = f"not isinstance({value.use()}, {NON_MAPPINGS}) and isinstance({value.use()}, {MAPPING})"
+        return f"({builtin} or {abstract})"
+
+    def sub_value(self, expr: str, pattern: cst.MatchPattern) -> Value:
+        if is_simple(pattern) or _IDENTIFIER.fullmatch(expr):
+            return Value(expr)
+        return Value(expr, self.new_temp())
+
+    def compile_sequence(
+        self,
+        pattern: cst.MatchSequence,
+        value: Value,
+        bindings: list[tuple[str, str]],
+        inline: bool,
+    ) -> list[str]:
+        elements = list(pattern.patterns)
+        star = next((i for i, element in enumerate(elements) if isinstance(element, cst.MatchStar)), None)
+        size = len(elements) if star is None else len(elements) - 1
+        after = 0 if star is None else len(elements) - star - 1
+
+        tests = []
+        if value.root and self.shared.sequence:
+            length = "__match_len"
+            if self.define("sequence"):
+                tests.append(f"(__match_is_sequence := {self.sequence_test(value)})")
+                tests.append(f"({length} := len({value.use()})) {'==' if star is None else '>='} {size}")
+            else:
+                tests.append(f"__match_is_sequence and {length} {'==' if star is None else '>='} {size}")
+        else:
+            tests.append(self.sequence_test(value))
+            star_element = None if star is None else elements[star]
+            if isinstance(star_element, cst.MatchStar) and (after or star_element.name is not None):
+                length = self.new_temp()
+                tests.append(f"({length} := len({value.use()})) >= {size}")
+            else:
+                length = f"len({value.use()})"
+                tests.append(f"{length} {'==' if star is None else '>='} {size}")
+
+        sequence = value.use()
+        for i, element in enumerate(elements):
+            if isinstance(element, cst.MatchStar):
+                if element.name is not None:
+                    stop = f"{length} - {after}" if after else length
+                    rest = Value(f"list(map({sequence}.__getitem__, range({i}, {stop})))")
+                    tests += self.bind(element.name.value, rest, bindings, inline)
+                continue
+            assert isinstance(element, cst.MatchSequenceElement)
+            if is_wildcard(element.value):
+                continue
+            index = str(i) if star is None or i < star else f"{length} - {len(elements) - i}"
+            tests += self.compile(
+                element.value, self.sub_value(f"{sequence}[{index}]", element.value), bindings, inline
+            )
+        return tests
+
+    def compile_mapping(
+        self,
+        pattern: cst.MatchMapping,
+        value: Value,
+        bindings: list[tuple[str, str]],
+        inline: bool,
+    ) -> list[str]:
+        tests = []
+        shared = value.root and self.shared.mapping
+        if not shared:
+            self.needs_abc = True
+            tests.append(self.mapping_test(value))
+        elif self.define("mapping"):
+            self.needs_abc = True
+            tests.append(f"(__match_is_mapping := {self.mapping_test(value)})")
+            if self.shared.keys:
+                self.needs_missing = True
+                lookups = (f"{temp} := {value.use()}.get({key}, {MISSING})" for key, temp in self.shared.keys.items())
+                tests.append(f"[{', '.join(lookups)}]")
+        else:
+            tests.append("__match_is_mapping")
+
+        # look all keys up before matching the values, as CPython does
+        mapping = value.use()
+        values = []
+        for element in pattern.elements:
+            key = code_of(element.key)
+            if shared and key in self.shared.keys:
+                key_value = Value(self.shared.keys[key])
+            else:
+                key_value = Value(f"{mapping}.get({key}, {MISSING})", self.new_temp())
+            self.needs_missing = True
+            tests.append(f"{key_value.use()} is not {MISSING}")
+            values.append((element.pattern, key_value))
+        for sub_pattern, key_value in values:
+            tests += self.compile(sub_pattern, key_value, bindings, inline)
+
+        if pattern.rest is not None:
+            keys = [code_of(element.key) for element in pattern.elements]
+            if keys:
+                excluded = f"({keys[0]},)" if len(keys) == 1 else f"({', '.join(keys)})"
+                items = f"__match_key: __match_value for __match_key, __match_value in {mapping}.items()"
+                rest = Value(f"{{{items} if __match_key not in {excluded}}}")
+            else:
+                rest = Value(f"dict({mapping})")
+            tests += self.bind(pattern.rest.value, rest, bindings, inline)
+        return tests
+
+    def compile_class(
+        self,
+        pattern: cst.MatchClass,
+        value: Value,
+        bindings: list[tuple[str, str]],
+        inline: bool,
+    ) -> list[str]:
+        cls = code_of(pattern.cls)
+        if value.root and cls in self.shared.classes:
+            temp = self.shared.classes[cls]
+            test = f"({temp} := isinstance({value.use()}, {atom_of(pattern.cls)}))"
+            tests = [test if self.define(cls) else temp]
+        else:
+            tests = [f"isinstance({value.use()}, {atom_of(pattern.cls)})"]
+        instance = value.use()
+
+        positional = list(pattern.patterns)
+        if len(positional) == 1 and cls in SELF_MATCHING_CLASSES:
+            tests += self.compile(positional[0].value, Value(instance), bindings, inline)
+            positional = []
+
+        attributes = []
+        if positional:
+            self.needs_match_args = True
+            names = Value(f"{MATCH_ARGS}({cls}, {len(positional)})", self.new_temp())
+            attributes = [(f"{names.use()}[{i}]", element.value) for i, element in enumerate(positional)]
+        attributes += [(f'"{keyword.key.value}"', keyword.pattern) for keyword in pattern.kwds]
+        for name, sub_pattern in attributes:
+            self.needs_missing = True
+            temp = None if is_wildcard(sub_pattern) else self.new_temp()
+            attribute = Value(f"getattr({instance}, {name}, {MISSING})", temp)
+            tests.append(f"{attribute.use()} is not {MISSING}")
+            tests += self.compile(sub_pattern, attribute, bindings, inline)
+        return tests
+
+    def compile_or(self, pattern: cst.MatchOr, value: Value) -> str:
+        if value.root:
+            # alternatives are not always tested, so they do not use the shared tests
+            value = Value(value.expr)
+        alternatives = []
+        for element in pattern.patterns:
+            # names captured by an alternative have to be bound while testing it
+            tests = self.compile(element.pattern, value, [], inline=True)
+            if not tests:
+                alternatives.append("True")
+            elif len(tests) == 1:
+                alternatives.append(tests[0])
+            else:
+                alternatives.append("(" + " and ".join(tests) + ")")
+        return "(" + " or ".join(alternatives) + ")"
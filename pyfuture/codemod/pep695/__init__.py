@@ -1 +1,2 @@
+from .type_alias import TransformTypeAliasCommand
 from .type_parameters import TransformTypeParametersCommand
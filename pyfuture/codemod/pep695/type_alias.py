@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+
+import libcst as cst
+from libcst import matchers as m
+from libcst.codemod import CodemodContext
+from libcst.codemod.visitors import AddImportsVisitor
+from libcst.metadata import Scope, ScopeProvider
+
+from ...transformer import ReplaceTransformer
+from ..utils import RuleCommand, RuleSet, gen_type_param, register_rule, transform_bit_or
+from .type_parameters import rename_accesses
+
+LAZY_TYPE_ALIAS = "_LazyTypeAlias"
+
+# like `typing.TypeAliasType`, the value is evaluated on first access, and generic aliases are subscripted
+# without evaluating it; it is callable since `typing` only accepts callables as types before 3.11, and imports
+# what it needs itself, so that a module only imports what its own code uses
+_LAZY_TYPE_ALIAS_CLASS = f"""
+class {LAZY_TYPE_ALIAS}:
+    def __init__(self, name, evaluate, type_params=()):
+        self.__name__ = name
+        self.__type_params__ = type_params
+        self.__evaluate = evaluate
+
+    def __getattr__(self, name):
+        if name != "__value__":
+            raise AttributeError(name)
+        self.__value__ = self.__evaluate()
+        return self.__value__
+
+    def __getitem__(self, parameters):
+        if not self.__type_params__:
+            raise TypeError("Only generic type aliases are subscriptable")
+        from types import GenericAlias
+
+        return GenericAlias(self, parameters if isinstance(parameters, tuple) else (parameters,))
+
+    def __or__(self, other):
+        from typing import Union
+
+        return Union[self, other]
+
+    def __ror__(self, other):
+        from typing import Union
+
+        return Union[other, self]
+
+    def __call__(self, *args, **kwargs):
+        raise TypeError("Type aliases are not callable")
+
+    def __repr__(self):
+        return self.__name__
+"""
+
+
+class _UnionTransformer(cst.CSTTransformer):
+    # like `TransformUnionTypesCommand`, the operands of a union are split iteratively and lowered on their own
+    def __init__(self) -> None:
+        super().__init__()
+        self.changed = False
+
+    def visit_BinaryOperation(self, node: cst.BinaryOperation) -> bool:
+        return not isinstance(node.operator, cst.BitOr)
+
+    def leave_BinaryOperation(
+        self, original_node: cst.BinaryOperation, updated_node: cst.BinaryOperation
+    ) -> cst.BaseExpression:
+        union = transform_bit_or(original_node)
+        if union is None:
+            return updated_node
+        self.changed = True
+        new_union = union.visit(self)
+        assert isinstance(new_union, cst.BaseExpression)
+        return new_union
+
+
+def _is_head(index: int, statement: cst.BaseStatement) -> bool:
+    if m.matches(statement, m.SimpleStatementLine(body=[m.Import() | m.ImportFrom()])):
+        return True
+    docstring = m.SimpleStatementLine(body=[m.Expr(m.SimpleString() | m.ConcatenatedString())])
+    return index == 0 and m.matches(statement, docstring)
+
+
+@register_rule(RuleSet.pep695)
+class TransformTypeAliasCommand(RuleCommand):
+    """
+    Transform `type` statements to lazily evaluated aliases, whose value is only evaluated on first access
+    of `__value__` like in python 3.12, so that forward references and expensive values cost nothing at import.
+    Generic aliases get their type parameters from a wrapper function, with mangled names.
+    The class of the aliases is defined once after the leading imports, so the rule is not statement-local.
+
+    Example:
+    >>> transformer = TransformTypeAliasCommand(CodemodContext())
+    >>> module = cst.parse_module(\"""
+    ... import os
+    ... type Path = str | os.PathLike[str]
+    ... type Pair[T] = tuple[T, T]
+    ... type Nested = list[int | None]
+    ... \""")
+    >>> new_module = transformer.transform_module(module)
+    >>> print(new_module.code.split("class _LazyTypeAlias:")[0].strip())
+    import os
+    from typing import TypeVar, Union
+    >>> print("\\n".join(new_module.code.splitlines()[-6:]))
+    Path = _LazyTypeAlias("Path", lambda: Union[str, os.PathLike[str]])
+    def __wrapper_type_Pair():
+        __Pair_T = TypeVar("__Pair_T")
+        return _LazyTypeAlias("Pair", lambda: tuple[__Pair_T, __Pair_T], (__Pair_T,))
+    Pair = __wrapper_type_Pair()
+    Nested = _LazyTypeAlias("Nested", lambda: list[Union[int, None]])
+    """
+
+    METADATA_DEPENDENCIES = (ScopeProvider,)
+    TRIGGERS = (cst.TypeAlias,)
+
+    def __init__(self, context: CodemodContext) -> None:
+        super().__init__(context)
+        self.wrappers: dict[cst.TypeAlias, cst.FunctionDef] = {}
+        self.replacements: dict[cst.TypeAlias, cst.Assign] = {}
+
+    def visit_TypeAlias(self, node: cst.TypeAlias) -> bool:
+        name = node.name.value
+        value = node.value
+        type_params = node.type_parameters
+        prefix = f"__{name}_"
+        if type_params is not None:
+            replacements: dict[cst.CSTNode, cst.CSTNode] = {}
+            scope = self.get_metadata(ScopeProvider, type_params)
+            assert isinstance(scope, Scope)
+            rename_accesses(scope, type_params, prefix, replacements)
+            value = value.visit(ReplaceTransformer(replacements))
+            assert isinstance(value, cst.BaseExpression)
+        unions = _UnionTransformer()
+        value = value.visit(unions)
+        assert isinstance(value, cst.BaseExpression)
+        if unions.changed:
+            AddImportsVisitor.add_needed_import(self.context, "typing", "Union")
+
+        args = [cst.Arg(cst.SimpleString(f'"{name}"')), cst.Arg(cst.Lambda(cst.Parameters(), value))]
+        if type_params is None:
+            alias = cst.Call(cst.Name(LAZY_TYPE_ALIAS), args)
+        else:
+            type_vars = []
+            elements = []
+            for type_param in type_params.params:
+                new_name = cst.Name(f"{prefix}{type_param.param.name.value}")
+                AddImportsVisitor.add_needed_import(self.context, "typing", type_param.param.__class__.__name__)
+                type_vars.append(gen_type_param(type_param.param, new_name, self.context))
+                elements.append(cst.Element(new_name))
+            if len(elements) == 1:
+                elements[0] = elements[0].with_changes(comma=cst.Comma())
+            args.append(cst.Arg(cst.Tuple(elements)))
+            wrapper_name = f"__wrapper_type_{name}"
+            self.wrappers[node] = cst.FunctionDef(
+                name=cst.Name(wrapper_name),
+                params=cst.Parameters(),
+                body=cst.IndentedBlock(
+                    [*type_vars, cst.SimpleStatementLine([cst.Return(cst.Call(cst.Name(LAZY_TYPE_ALIAS), args))])]
+                ),
+            )
+            alias = cst.Call(cst.Name(wrapper_name))
+        self.replacements[node] = cst.Assign(targets=[cst.AssignTarget(node.name)], value=alias)
+        return False
+
+    def leave_TypeAlias(self, original_node: cst.TypeAlias, updated_node: cst.TypeAlias):
+        return self.replacements[original_node].with_changes(semicolon=updated_node.semicolon)
+
+    def _wrappers(self, statements: Sequence[cst.BaseSmallStatement]) -> list[cst.FunctionDef]:
+        return [self.wrappers[node] for node in statements if isinstance(node, cst.TypeAlias) and node in self.wrappers]
+
+    def leave_SimpleStatementLine(
+        self, original_node: cst.SimpleStatementLine, updated_node: cst.SimpleStatementLine
+    ) -> cst.BaseStatement | cst.FlattenSentinel[cst.BaseStatement]:
+        wrappers = self._wrappers(original_node.body)
+        if not wrappers:
+            return updated_node
+        # the wrappers only define functions, so they are moved in front of the line with its leading lines
+        wrappers[0] = wrappers[0].with_changes(leading_lines=updated_node.leading_lines)
+        return cst.FlattenSentinel([*wrappers, updated_node.with_changes(leading_lines=[])])
+
+    def leave_SimpleStatementSuite(
+        self, original_node: cst.SimpleStatementSuite, updated_node: cst.SimpleStatementSuite
+    ) -> cst.BaseSuite:
+        wrappers = self._wrappers(original_node.body)
+        if not wrappers:
+            return updated_node
+        line = cst.SimpleStatementLine(updated_node.body, trailing_whitespace=updated_node.trailing_whitespace)
+        return cst.IndentedBlock([*wrappers, line])
+
+    def leave_Module(self, original_node: cst.Module, updated_node: cst.Module) -> cst.Module:
+        if not self.replacements:
+            return updated_node
+        body = list(updated_node.body)
+        # the class is defined once, also when a later pass transforms aliases left by other rules
+        if any(m.matches(statement, m.ClassDef(name=m.Name(LAZY_TYPE_ALIAS))) for statement in body):
+            return updated_node
+        head = 0
+        while head < len(body) and _is_head(head, body[head]):
+            head += 1
+        helper = cst.parse_statement(_LAZY_TYPE_ALIAS_CLASS.lstrip())
+        if head > 0:
+            helper = helper.with_changes(leading_lines=[cst.EmptyLine(), cst.EmptyLine()])
+        body.insert(head, helper)
+        return updated_node.with_changes(body=body)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import Callable
 from typing import Any
 
 import libcst as cst
@@ -9,25 +10,68 @@ from libcst import (
     AssignTarget,
     Call,
     ClassDef,
+    CSTNode,
     FunctionDef,
     Index,
     Name,
     SimpleStatementLine,
     Subscript,
     SubscriptElement,
+    TypeParameters,
 )
-from libcst.codemod import (
-    CodemodContext,
-    VisitorBasedCodemodCommand,
-)
+from libcst.codemod import CodemodContext
 from libcst.codemod.visitors import AddImportsVisitor
 from libcst.metadata import Scope, ScopeProvider
 
 from ...transformer import ReplaceTransformer
-from ..utils import gen_func_wrapper, gen_type_param
+from ..utils import RuleCommand, RuleSet, gen_func_wrapper, gen_type_param, register_rule
+
+
+def rename_accesses(
+    scope: Scope, type_params: TypeParameters, prefix: str, replacements: dict[CSTNode, CSTNode]
+) -> None:
+    """
+    Map every access of the type parameters to its prefixed name. The accesses are taken from the
+    references of the type parameter assignments in their scope, so they are found in any nested scope at once.
+    """
+    for type_param in type_params.params:
+        name = type_param.param.name.value
+        new_name = Name(value=f"{prefix}{name}")
+        for assignment in scope.assignments[name]:
+            for access in assignment.references:
+                assert isinstance(access.node, Name)
+                replacements[access.node] = new_name
 
 
-class TransformTypeParametersCommand(VisitorBasedCodemodCommand):
+class ClassBodyTransformer(ReplaceTransformer):
+    """
+    Replace nodes like `ReplaceTransformer`, and also remove the type parameters of the given methods,
+    which are moved in front of the methods with their prefixes.
+    """
+
+    def __init__(
+        self,
+        replacements: dict[CSTNode, CSTNode],
+        methods: dict[CSTNode, str],
+        remove_type_parameters: Callable[..., tuple[list[SimpleStatementLine], FunctionDef]],
+    ):
+        super().__init__(replacements)
+        self.methods = methods
+        self.remove_type_parameters = remove_type_parameters
+
+    def on_leave(
+        self, original_node: CSTNode, updated_node: CSTNode
+    ) -> CSTNode | cst.RemovalSentinel | cst.FlattenSentinel[CSTNode]:
+        prefix = self.methods.get(original_node)
+        if prefix is None:
+            return super().on_leave(original_node, updated_node)
+        assert isinstance(updated_node, FunctionDef)
+        type_vars, new_node = self.remove_type_parameters(updated_node, prefix=prefix)
+        return cst.FlattenSentinel([*type_vars, new_node])
+
+
+@register_rule(RuleSet.pep695)
+class TransformTypeParametersCommand(RuleCommand):
     """
     Remove type parameters from node, and return a list of statements and a new node.
 
@@ -76,6 +120,8 @@ class TransformTypeParametersCommand(VisitorBasedCodemodCommand):
     """
 
     METADATA_DEPENDENCIES = (ScopeProvider,)
+    TRIGGERS = (cst.TypeParameters,)
+    STATEMENT_LOCAL = True
 
     def __init__(self, context: CodemodContext) -> None:
         self.node_to_wrapper: dict[FunctionDef | ClassDef, Any] = {}
@@ -118,21 +164,19 @@ class TransformTypeParametersCommand(VisitorBasedCodemodCommand):
 
         return statements, new_node
 
+    def rename_accesses(self, type_params: TypeParameters, prefix: str, replacements: dict[CSTNode, CSTNode]) -> None:
+        scope = self.get_metadata(ScopeProvider, type_params)
+        assert isinstance(scope, Scope)
+        rename_accesses(scope, type_params, prefix, replacements)
+
     def visit_FunctionDef(self, node: FunctionDef):
         type_params = node.type_parameters
         if type_params is None:
             return False
 
-        node_scope = self.get_metadata(ScopeProvider, type_params)
-        body_scope = self.get_metadata(ScopeProvider, node.body)
-        replacemences = {}
+        replacemences: dict[CSTNode, CSTNode] = {}
         prefix = f"__{node.name.value}_"
-        for type_param in type_params.params:
-            for scope in [node_scope, body_scope]:
-                assert isinstance(scope, Scope)
-                for access in set(scope.accesses[type_param.param.name]):
-                    assert isinstance(access.node, Name)
-                    replacemences[access.node] = Name(value=f"{prefix}{type_param.param.name.value}")
+        self.rename_accesses(type_params, prefix, replacemences)
         new_node = node.visit(ReplaceTransformer(replacemences))
         assert isinstance(new_node, FunctionDef)
 
@@ -163,40 +207,22 @@ class TransformTypeParametersCommand(VisitorBasedCodemodCommand):
 
     def visit_ClassDef(self, node: ClassDef):
         type_params = node.type_parameters
-        replacemences = {}
-        scopes = []
+        replacemences: dict[CSTNode, CSTNode] = {}
+        methods: dict[CSTNode, str] = {}
         for subnode in node.body.body:
-            subnode_scope = self.get_metadata(ScopeProvider, subnode)
-            scopes.append(subnode_scope)
-            if isinstance(subnode, FunctionDef):
-                subnode_body_scope = self.get_metadata(ScopeProvider, subnode.body)
-                scopes.append(subnode_body_scope)
-
-                subnode_type_params = subnode.type_parameters
-                if subnode_type_params is None:
-                    continue
-                subnode_type_scope = self.get_metadata(ScopeProvider, subnode_type_params)
-                scopes.append(subnode_type_scope)
-
+            if isinstance(subnode, FunctionDef) and subnode.type_parameters is not None:
                 prefix = f"__{node.name.value}_{subnode.name.value}_"
-                for type_param in subnode_type_params.params:
-                    for scope in [subnode_type_scope, subnode_body_scope]:
-                        assert isinstance(scope, Scope)
-                        for access in set(scope.accesses[type_param.param.name]):
-                            assert isinstance(access.node, Name)
-                            replacemences[access.node] = Name(value=f"{prefix}{type_param.param.name.value}")
+                methods[subnode] = prefix
+                self.rename_accesses(subnode.type_parameters, prefix, replacemences)
 
         prefix = f"__{node.name.value}_"
         if type_params is not None:
-            scopes.append(self.get_metadata(ScopeProvider, type_params))
-            for type_param in type_params.params:
-                for scope in scopes:
-                    assert isinstance(scope, Scope)
-                    for access in set(scope.accesses[type_param.param.name]):
-                        assert isinstance(access.node, Name)
-                        replacemences[access.node] = Name(value=f"{prefix}{type_param.param.name.value}")
+            self.rename_accesses(type_params, prefix, replacemences)
 
-        new_node = node.visit(ReplaceTransformer(replacemences))
+        new_node = node
+        if replacemences or methods:
+            # rename the accesses and move the type parameters of methods into the class body in one traversal
+            new_node = node.visit(ClassBodyTransformer(replacemences, methods, self.remove_type_parameters))
         assert isinstance(new_node, ClassDef)
 
         type_vars, new_node = self.remove_type_parameters(new_node, prefix=prefix)
@@ -209,12 +235,4 @@ class TransformTypeParametersCommand(VisitorBasedCodemodCommand):
         if self.node_to_wrapper.get(original_node, None) is None:
             return updated_node
         new_node, type_vars = self.node_to_wrapper[original_node]
-        replacemences = {}
-        for subnode in new_node.body.body:
-            if isinstance(subnode, FunctionDef):
-                prefix = f"__{new_node.name.value}_{subnode.name.value}_"
-                sub_type_vars, new_subnode = self.remove_type_parameters(subnode, prefix=prefix)
-                replacemences[subnode] = cst.FlattenSentinel([*sub_type_vars, new_subnode])
-
-        new_node = new_node.visit(ReplaceTransformer(replacemences))
         return cst.FlattenSentinel([*type_vars, new_node])
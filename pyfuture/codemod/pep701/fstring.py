@@ -1,14 +1,14 @@
 from __future__ import annotations
 
 import libcst as cst
-from libcst.codemod import (
-    CodemodContext,
-    VisitorBasedCodemodCommand,
-)
+from libcst.codemod import CodemodContext
 from libcst.metadata import ScopeProvider
 
+from ..utils import RuleCommand, RuleSet, register_rule
 
-class TransformFStringCommand(VisitorBasedCodemodCommand):
+
+@register_rule(RuleSet.pep701)
+class TransformFStringCommand(RuleCommand):
     """
     Remove f-string from node, and return a new node with the formatted string.
 
@@ -39,6 +39,8 @@ class TransformFStringCommand(VisitorBasedCodemodCommand):
     """
 
     METADATA_DEPENDENCIES = (ScopeProvider,)
+    TRIGGERS = (cst.FormattedString,)
+    STATEMENT_LOCAL = True
 
     def __init__(self, context: CodemodContext) -> None:
         super().__init__(context)
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-from collections.abc import Iterable
+from collections.abc import Callable, Collection, Iterable
 from enum import Enum
+from typing import ClassVar, TypeVar
 
 import libcst as cst
-from libcst.codemod import Codemod, CodemodContext
+from libcst.codemod import Codemod, CodemodContext, VisitorBasedCodemodCommand
 from libcst.codemod.visitors import AddImportsVisitor
 
+CodemodT = TypeVar("CodemodT", bound=type[Codemod])
+
 
 class RuleSet(Enum):
     # python 3.10+
@@ -17,7 +20,31 @@ class RuleSet(Enum):
     pep701 = "pep701"
 
 
-def get_transformers(rule_sets: list[RuleSet] | RuleSet) -> Iterable[type[Codemod]]:
+_RULES: dict[RuleSet | str, list[type[Codemod]]] = {}
+
+
+def register_rule(rule_set: RuleSet | str) -> Callable[[CodemodT], CodemodT]:
+    """
+    Register a codemod transformer to the rule set, custom rule sets can be registered with a string name.
+    Transformers of a rule set are returned in registration order.
+
+    Example:
+    >>> @register_rule("example")
+    ... class ExampleCommand(RuleCommand):
+    ...     TRIGGERS = (cst.Lambda,)
+    >>> print([transformer.__name__ for transformer in get_transformers("example")])
+    ['ExampleCommand']
+    >>> _ = _RULES.pop("example")
+    """
+
+    def decorator(transformer: CodemodT) -> CodemodT:
+        _RULES.setdefault(rule_set, []).append(transformer)
+        return transformer
+
+    return decorator
+
+
+def get_transformers(rule_sets: Iterable[RuleSet | str] | RuleSet | str) -> Iterable[type[Codemod]]:
     """
     Get codemod transformers for specified rule set.
 
@@ -26,26 +53,92 @@ def get_transformers(rule_sets: list[RuleSet] | RuleSet) -> Iterable[type[Codemo
     >>> print([transformer.__name__ for transformer in transformers])
     ['TransformUnionTypesCommand', 'TransformMatchCommand']
     """
-    from .pep604 import TransformUnionTypesCommand
-    from .pep622 import TransformMatchCommand
-    from .pep695 import TransformTypeParametersCommand
-    from .pep701 import TransformFStringCommand
-
-    if not isinstance(rule_sets, list):
+    if isinstance(rule_sets, (RuleSet, str)):
         rule_sets = [rule_sets]
 
     for rule_set in rule_sets:
-        match rule_set:
-            case RuleSet.pep604:
-                yield TransformUnionTypesCommand
-            case RuleSet.pep622:
-                yield TransformMatchCommand
-            case RuleSet.pep695:
-                yield TransformTypeParametersCommand
-            case RuleSet.pep701:
-                yield TransformFStringCommand
-            case _:  # pragma: no cover
-                raise ValueError(f"Unknown rule set: {rule_set}")
+        if rule_set not in _RULES:
+            raise ValueError(f"Unknown rule set: {rule_set}")
+        yield from _RULES[rule_set]
+
+
+class RuleCommand(VisitorBasedCodemodCommand):
+    """
+    Base class of the rule transformers.
+
+    `TRIGGERS` declares the node types the rule can transform, `None` means the rule always runs.
+    `STATEMENT_LOCAL` declares that the rule transforms each top-level statement independently of the others.
+    Top-level statements listed in `skipped_statements` (indexes into the module body) are left untouched.
+    `changed` tells whether the last transform replaced any node, otherwise the module is unchanged.
+    """
+
+    TRIGGERS: ClassVar[tuple[type[cst.CSTNode], ...] | None] = None
+    STATEMENT_LOCAL: ClassVar[bool] = False
+
+    def __init__(self, context: CodemodContext) -> None:
+        super().__init__(context)
+        self.skipped_statements: Collection[int] = ()
+        self.skipped_nodes: set[cst.CSTNode] = set()
+        self.changed = False
+
+    def transform_module_impl(self, tree: cst.Module) -> cst.Module:
+        # metadata resolution works on a copy of the module, so the skipped nodes are resolved here
+        self.skipped_nodes = {tree.body[i] for i in self.skipped_statements}
+        self.changed = False
+        return super().transform_module_impl(tree)
+
+    def on_visit(self, node: cst.CSTNode) -> bool:
+        if node in self.skipped_nodes:
+            return False
+        return super().on_visit(node)
+
+    def on_leave(self, original_node, updated_node):
+        if original_node in self.skipped_nodes:
+            return updated_node
+        new_node = super().on_leave(original_node, updated_node)
+        # libcst rebuilds every visited node, so only the nodes returned in place of `updated_node` are changes
+        if new_node is not updated_node:
+            self.changed = True
+        return new_node
+
+
+class _NodeTypeCollector(cst.CSTVisitor):
+    def __init__(self) -> None:
+        self.types: set[type[cst.CSTNode]] = set()
+
+    def on_visit(self, node: cst.CSTNode) -> bool:
+        self.types.add(type(node))
+        return True
+
+
+class NodeTypeIndex:
+    """
+    Index of the node types present in a module and in each of its top-level statements, built in one pass.
+
+    Example:
+    >>> index = NodeTypeIndex(cst.parse_module("x: int | str\\nprint(f'{x}')\\n"))
+    >>> index.contains((cst.FormattedString,))
+    True
+    >>> index.contains((cst.Match,))
+    False
+    >>> index.untriggered_statements((cst.BitOr,))
+    {1}
+    """
+
+    def __init__(self, module: cst.Module) -> None:
+        self.types: set[type[cst.CSTNode]] = set()
+        self.statement_types: list[set[type[cst.CSTNode]]] = []
+        for statement in module.body:
+            collector = _NodeTypeCollector()
+            statement.visit(collector)
+            self.statement_types.append(collector.types)
+            self.types |= collector.types
+
+    def contains(self, triggers: Iterable[type[cst.CSTNode]]) -> bool:
+        return not self.types.isdisjoint(triggers)
+
+    def untriggered_statements(self, triggers: Iterable[type[cst.CSTNode]]) -> set[int]:
+        return {i for i, types in enumerate(self.statement_types) if types.isdisjoint(triggers)}
 
 
 def transform_bit_or(op: cst.BinaryOperation, use_union: bool = True) -> cst.Subscript | cst.Tuple | None:
@@ -71,19 +164,16 @@ def transform_bit_or(op: cst.BinaryOperation, use_union: bool = True) -> cst.Sub
     if not isinstance(op.operator, cst.BitOr):
         return None
 
-    def _split_bit_or(_op: cst.BinaryOperation) -> list[cst.BaseExpression]:
-        _out = []
-        if isinstance((left := _op.left), cst.BinaryOperation) and isinstance(left.operator, cst.BitOr):
-            _out.extend(_split_bit_or(left))
+    # split the operands iteratively, long unions are nested as deeply as they have operands
+    items: list[cst.BaseExpression] = []
+    stack: list[cst.BaseExpression] = [op]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, cst.BinaryOperation) and isinstance(node.operator, cst.BitOr):
+            stack.append(node.right)
+            stack.append(node.left)
         else:
-            _out.append(left)
-        if isinstance((right := _op.right), cst.BinaryOperation):
-            _out.extend(_split_bit_or(right))
-        else:
-            _out.append(right)
-        return _out
-
-    items = _split_bit_or(op)
+            items.append(node)
     if not use_union:
         return cst.Tuple(elements=[cst.Element(item) for item in items])
     slices = [
@@ -124,7 +214,7 @@ def gen_type_param(
     type_name = type_param.name if type_name is None else type_name
 
     match type_param:
-        case cst.TypeVar(_, bound):
+        case cst.TypeVar(bound=bound):
             args = [
                 cst.Arg(cst.SimpleString(f'"{type_name.value}"')),
             ]
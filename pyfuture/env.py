@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from importlib import metadata
+from pathlib import Path
+
+from loguru import logger
+
+from .__version__ import __version__
+from .check import check_files
+from .utils import file_hash, get_rule_sets, transfer_files, write_output
+
+_LOWER_BOUND = re.compile(r"\s*(>=|>|~=|==)\s*3\.(\d+)")
+
+
+def default_cache_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME") or "~/.cache").expanduser() / "pyfuture" / "env"
+
+
+def min_python(requires_python: str | None) -> tuple[int, int] | None:
+    """
+    Return the lowest python version allowed by a `Requires-Python` specifier, or None if it has no lower bound.
+
+    Example:
+    >>> min_python(">=3.12"), min_python(">= 3.8, <4"), min_python("~=3.10.2"), min_python("!=3.0.*")
+    ((3, 12), (3, 8), (3, 10), None)
+    """
+    if requires_python is None:
+        return None
+    bounds = [(3, int(match.group(2))) for spec in requires_python.split(",") if (match := _LOWER_BOUND.match(spec))]
+    return max(bounds, default=None)
+
+
+@dataclass
+class InstalledDistribution:
+    """
+    A distribution installed in site_packages, with the python files listed in its `RECORD`
+    relative to site_packages.
+    """
+
+    name: str
+    version: str
+    site_packages: Path
+    record: str
+    files: list[str]
+    requires_python: str | None = None
+
+    def cache_key(self, target: tuple[int, int]) -> str:
+        """
+        The key of the outputs for target, the same for any environment with the same distribution installed.
+        """
+        rule_sets = [rule_set.value for rule_set in get_rule_sets(target)]
+        return file_hash(json.dumps([__version__, list(target), rule_sets, self.record]))
+
+    def compatible(self, target: tuple[int, int]) -> bool:
+        """
+        Whether the metadata declares that the distribution supports target, so that it needs no lowering.
+        """
+        lowest = min_python(self.requires_python)
+        return lowest is not None and lowest <= target
+
+
+def find_distributions(site_packages: Path) -> list[InstalledDistribution]:
+    """
+    Find the distributions installed in site_packages, skipping those without a `RECORD`, e.g. installed by
+    other tools than pip, and the files installed outside site_packages, e.g. scripts.
+    """
+    distributions = []
+    for dist in metadata.distributions(path=[str(site_packages)]):
+        record = dist.read_text("RECORD")
+        if record is None:
+            logger.debug("{}: no RECORD, skipped", dist.metadata["Name"])
+            continue
+        files = sorted(
+            file.as_posix()
+            for file in dist.files or []
+            if file.suffix == ".py" and ".." not in file.parts and (site_packages / file).is_file()
+        )
+        distributions.append(
+            InstalledDistribution(
+                name=dist.metadata["Name"],
+                version=dist.version,
+                site_packages=site_packages,
+                record=record,
+                files=files,
+                requires_python=dist.metadata.get("Requires-Python"),
+            )
+        )
+    return sorted(distributions, key=lambda dist: dist.name.lower())
+
+
+@dataclass
+class EnvResult:
+    """
+    What was done with a distribution: status is "cached", "compatible" or "transferred",
+    files is the number of files which were lowered.
+    """
+
+    name: str
+    version: str
+    status: str
+    files: int = 0
+
+
+class EnvCache:
+    """
+    The outputs of the distributions transferred before, keyed by `InstalledDistribution.cache_key`.
+    The outputs of a distribution are kept in a directory named by its key, and listed in an index
+    which is written last, so that a cache entry is only used once it is complete.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir = cache_dir
+
+    def index_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def output_dir(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def load(self, key: str) -> list[str] | None:
+        """
+        Return the files with outputs of a cache entry, or None if there is none.
+        """
+        try:
+            return json.loads(self.index_path(key).read_text())["files"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring the cache entry {self.index_path(key)}: {e}")
+            return None
+
+    def save(self, key: str, dist: InstalledDistribution, files: list[str]) -> None:
+        data = {"name": dist.name, "version": dist.version, "files": files}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_path(key).with_name(f"{key}.json.tmp")
+        tmp_file.write_text(json.dumps(data, indent=1))
+        os.replace(tmp_file, self.index_path(key))
+
+    def apply(self, key: str, dist: InstalledDistribution, files: list[str]) -> None:
+        """
+        Write the outputs of a cache entry over the files of dist, files which are up to date are not written.
+        """
+        for file in files:
+            write_output(dist.site_packages / file, (self.output_dir(key) / file).read_text())
+
+
+def transfer_env(
+    site_packages: Path,
+    target: tuple[int, int] = (3, 9),
+    *,
+    cache_dir: Path | None = None,
+    trust_requires_python: bool = False,
+    executor: str = "processes",
+    workers: int | None = None,
+) -> list[EnvResult]:
+    """
+    Lower the python files of the distributions installed in site_packages to target in place.
+
+    The files of the distributions are scanned for the rule sets they need, and only those which need any
+    are transferred, both across workers, see `check_files` and `transfer_files`. `Requires-Python` does not
+    tell whether a distribution needs lowering, e.g. internal libraries written for 3.12 declare `>=3.9` to be
+    installed on 3.9, so distributions whose metadata allows target are only scanned last, or skipped if
+    trust_requires_python is set. The outputs are cached in cache_dir by
+    the `RECORD` of each distribution, and reused without scanning when the same distribution is installed
+    again. `RECORD` keeps the hashes of the installed files.
+
+    Example:
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     site_packages = Path(tmp_dir) / "site-packages"
+    ...     (site_packages / "demo-1.0.dist-info").mkdir(parents=True)
+    ...     _ = (site_packages / "demo-1.0.dist-info" / "METADATA").write_text("Name: demo\\nVersion: 1.0\\n")
+    ...     _ = (site_packages / "demo-1.0.dist-info" / "RECORD").write_text("demo.py,,\\n")
+    ...     _ = (site_packages / "demo.py").write_text("x: int | None = None\\n")
+    ...     cache_dir = Path(tmp_dir) / "cache"
+    ...     print(transfer_env(site_packages, cache_dir=cache_dir, workers=1))
+    ...     print((site_packages / "demo.py").read_text().splitlines()[-1])
+    ...     _ = (site_packages / "demo.py").write_text("x: int | None = None\\n")
+    ...     print(transfer_env(site_packages, cache_dir=cache_dir, workers=1))
+    [EnvResult(name='demo', version='1.0', status='transferred', files=1)]
+    x: Union[int, None] = None
+    [EnvResult(name='demo', version='1.0', status='cached', files=1)]
+    """
+    cache = EnvCache(default_cache_dir() if cache_dir is None else cache_dir)
+    results: dict[str, EnvResult] = {}
+    pending: list[tuple[InstalledDistribution, str]] = []
+    distributions = find_distributions(site_packages)
+    for dist in distributions:
+        key = dist.cache_key(target)
+        files = cache.load(key)
+        if files is not None:
+            cache.apply(key, dist, files)
+            results[dist.name] = EnvResult(dist.name, dist.version, "cached", len(files))
+        elif trust_requires_python and dist.compatible(target):
+            results[dist.name] = EnvResult(dist.name, dist.version, "compatible")
+        else:
+            pending.append((dist, key))
+    # the distributions which do not declare to support target most likely need lowering
+    pending.sort(key=lambda item: item[0].compatible(target))
+
+    # scan and transfer the files of all distributions at once, to spread them over the workers
+    pairs = [(site_packages / file, None) for dist, _ in pending for file in dist.files]
+    checked = {Path(result.path): result for result in check_files(pairs, target, workers=workers)}
+    needed: dict[str, list[str]] = {}
+    transfers = []
+    for dist, key in pending:
+        needed[key] = []
+        for file in dist.files:
+            result = checked[site_packages / file]
+            if result.error is not None:
+                logger.warning("{}: {}, skipped", site_packages / file, result.error)
+            elif result.rule_sets:
+                needed[key].append(file)
+                transfers.append((site_packages / file, cache.output_dir(key) / file))
+    transfer_files(transfers, target=target, executor=executor, workers=workers)
+
+    for dist, key in pending:
+        cache.save(key, dist, needed[key])
+        cache.apply(key, dist, needed[key])
+        results[dist.name] = EnvResult(dist.name, dist.version, "transferred", len(needed[key]))
+    return [results[dist.name] for dist in distributions]
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from pathlib import Path
+
+
+class EventKind(Enum):
+    queued = "queued"
+    parsed = "parsed"
+    rule_applied = "rule_applied"
+    cache_hit = "cache_hit"
+    cache_miss = "cache_miss"
+    written = "written"
+    linked = "linked"
+    write_skipped = "write_skipped"
+    transferred = "transferred"
+    # copied verbatim after exceeding the budget, see `pyfuture.budget.Budget`
+    copied = "copied"
+    error = "error"
+
+
+@dataclass
+class Event:
+    kind: EventKind
+    path: str | None = None
+    duration: float | None = None
+    size: int | None = None
+    rule: str | None = None
+    message: str | None = None
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        data = {key: value for key, value in asdict(self).items() if value is not None}
+        data["kind"] = self.kind.value
+        return data
+
+
+Sink = Callable[[Event], None]
+
+_SINKS: list[Sink] = []
+# sinks are not thread-safe, events emitted by several threads are passed to them one at a time
+_SINKS_LOCK = threading.Lock()
+current_path: ContextVar[str | None] = ContextVar("current_path", default=None)
+
+
+def add_sink(sink: Sink) -> None:
+    _SINKS.append(sink)
+
+
+def remove_sink(sink: Sink) -> None:
+    _SINKS.remove(sink)
+
+
+def has_sinks() -> bool:
+    return bool(_SINKS)
+
+
+def forward(event: Event) -> None:
+    """
+    Pass an event emitted elsewhere, e.g. collected in a worker process, to all sinks as it is.
+    """
+    with _SINKS_LOCK:
+        for sink in _SINKS:
+            sink(event)
+
+
+def clear_sinks() -> None:
+    """
+    Remove all sinks, e.g. in worker processes, which would otherwise write to copies of the sinks of their parent.
+    """
+    _SINKS.clear()
+
+
+def emit(kind: EventKind, **kwargs) -> None:
+    """
+    Emit an event to all sinks, the path defaults to the file currently being transferred.
+
+    Example:
+    >>> events = []
+    >>> add_sink(events.append)
+    >>> with file_scope("example.py"):
+    ...     emit(EventKind.parsed, duration=0.5, size=10)
+    >>> remove_sink(events.append)
+    >>> events[0].path, events[0].duration, events[0].size
+    ('example.py', 0.5, 10)
+    """
+    if not _SINKS:
+        return
+    kwargs.setdefault("path", current_path.get())
+    event = Event(kind, **kwargs)
+    with _SINKS_LOCK:
+        for sink in _SINKS:
+            sink(event)
+
+
+@contextlib.contextmanager
+def file_scope(path: str | Path) -> Iterator[None]:
+    token = current_path.set(str(path))
+    try:
+        yield
+    finally:
+        current_path.reset(token)
+
+
+class JsonlSink:
+    """
+    Write each event as a line of JSON.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open("a", buffering=1)
+
+    def __call__(self, event: Event) -> None:
+        self.file.write(json.dumps(event.to_dict()) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class PrometheusSink:
+    """
+    Aggregate events into counters and duration histograms, and write them in the Prometheus text format,
+    so that the node exporter textfile collector can scrape them.
+
+    Example:
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     sink = PrometheusSink(Path(tmp_dir) / "pyfuture.prom")
+    ...     sink(Event(EventKind.parsed, duration=0.002, size=100))
+    ...     sink.close()
+    ...     text = (Path(tmp_dir) / "pyfuture.prom").read_text()
+    >>> print(text.splitlines()[2])
+    pyfuture_events_total{kind="parsed"} 1
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+    def __init__(self, path: Path, flush_interval: float = 5.0) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.counts: dict[tuple[str, ...], int] = defaultdict(int)
+        self.sizes: dict[tuple[str, ...], int] = defaultdict(int)
+        self.buckets: dict[tuple[str, ...], list[int]] = defaultdict(lambda: [0] * len(self.BUCKETS))
+        self.sums: dict[tuple[str, ...], float] = defaultdict(float)
+        self.durations: dict[tuple[str, ...], int] = defaultdict(int)
+
+    def __call__(self, event: Event) -> None:
+        labels = (event.kind.value,) if event.rule is None else (event.kind.value, event.rule)
+        self.counts[labels] += 1
+        if event.size is not None:
+            self.sizes[labels] += event.size
+        if event.duration is not None:
+            self.durations[labels] += 1
+            self.sums[labels] += event.duration
+            buckets = self.buckets[labels]
+            for i, bound in enumerate(self.BUCKETS):
+                if event.duration <= bound:
+                    buckets[i] += 1
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    @staticmethod
+    def format_labels(labels: tuple[str, ...], **extra: str) -> str:
+        pairs = [f'kind="{labels[0]}"']
+        if len(labels) > 1:
+            pairs.append(f'rule="{labels[1]}"')
+        pairs.extend(f'{key}="{value}"' for key, value in extra.items())
+        return "{" + ",".join(pairs) + "}"
+
+    def render(self) -> str:
+        lines = [
+            "# HELP pyfuture_events_total Number of pyfuture events.",
+            "# TYPE pyfuture_events_total counter",
+        ]
+        lines.extend(
+            f"pyfuture_events_total{self.format_labels(labels)} {count}" for labels, count in self.counts.items()
+        )
+        lines.extend(
+            [
+                "# HELP pyfuture_event_bytes_total Size in bytes of the sources and outputs of pyfuture events.",
+                "# TYPE pyfuture_event_bytes_total counter",
+            ]
+        )
+        lines.extend(
+            f"pyfuture_event_bytes_total{self.format_labels(labels)} {size}" for labels, size in self.sizes.items()
+        )
+        lines.extend(
+            [
+                "# HELP pyfuture_event_duration_seconds Duration of pyfuture events.",
+                "# TYPE pyfuture_event_duration_seconds histogram",
+            ]
+        )
+        for labels, count in self.durations.items():
+            for bound, bucket in zip(self.BUCKETS, self.buckets[labels]):
+                lines.append(
+                    f"pyfuture_event_duration_seconds_bucket{self.format_labels(labels, le=str(bound))} {bucket}"
+                )
+            lines.append(f"pyfuture_event_duration_seconds_bucket{self.format_labels(labels, le='+Inf')} {count}")
+            lines.append(f"pyfuture_event_duration_seconds_sum{self.format_labels(labels)} {self.sums[labels]}")
+            lines.append(f"pyfuture_event_duration_seconds_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write atomically, so that the collector never reads a partial file
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(self.render())
+        os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        self.flush()
+
+
+@contextlib.contextmanager
+def open_sinks(events_file: Path | None = None, metrics_file: Path | None = None) -> Iterator[None]:
+    """
+    Register the built-in sinks for the duration of the context.
+    """
+    sinks: list[JsonlSink | PrometheusSink] = []
+    if events_file is not None:
+        sinks.append(JsonlSink(Path(events_file)))
+    if metrics_file is not None:
+        sinks.append(PrometheusSink(Path(metrics_file)))
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+            sink.close()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class FileChange:
+    """
+    A changed python file, with paths relative to the directory passed to `changed_files`.
+    status is one of "added", "modified", "deleted" and "renamed", old_path is only set for renamed files.
+    """
+
+    status: str
+    path: Path
+    old_path: Path | None = None
+
+
+def run_git(cwd: Path, *args: str) -> str:
+    result = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed:\n{result.stderr}")
+    return result.stdout
+
+
+def changed_files(src_dir: Path, rev: str) -> list[FileChange]:
+    """
+    List the python files in src_dir which are added, modified, renamed or deleted in the working tree
+    relative to rev, including untracked files that are not ignored.
+
+    Example:
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     src_dir = Path(tmp_dir)
+    ...     _ = run_git(src_dir, "init", "-q")
+    ...     _ = (src_dir / "a.py").write_text("a = 1\\n")
+    ...     _ = (src_dir / "b.py").write_text("b = 1\\n")
+    ...     _ = run_git(src_dir, "add", ".")
+    ...     _ = run_git(src_dir, "-c", "user.name=test", "-c", "user.email=test@test", "commit", "-qm", "init")
+    ...     _ = (src_dir / "a.py").rename(src_dir / "c.py")
+    ...     _ = (src_dir / "d.py").write_text("d = 1\\n")
+    ...     changes = changed_files(src_dir, "HEAD")
+    >>> [(change.status, str(change.path)) for change in changes]
+    [('deleted', 'a.py'), ('added', 'c.py'), ('added', 'd.py')]
+    """
+    src_dir = Path(src_dir).resolve()
+    root = Path(run_git(src_dir, "rev-parse", "--show-toplevel").strip()).resolve()
+
+    def relative(path: str) -> Path | None:
+        abs_path = root / path
+        if abs_path.suffix != ".py" or not abs_path.is_relative_to(src_dir):
+            return None
+        return abs_path.relative_to(src_dir)
+
+    changes: list[FileChange] = []
+    fields = run_git(root, "diff", "--name-status", "-M", "-z", rev, "--", str(src_dir)).split("\0")
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i][0]
+        if status in ("R", "C"):
+            old_path, path = relative(fields[i + 1]), relative(fields[i + 2])
+            i += 3
+        else:
+            old_path, path = relative(fields[i + 1]), relative(fields[i + 1])
+            i += 2
+
+        if status == "D" or (status == "R" and path is None):
+            if old_path is not None:
+                changes.append(FileChange("deleted", old_path))
+        elif path is None:
+            continue
+        elif status == "R" and old_path is not None:
+            changes.append(FileChange("renamed", path, old_path))
+        elif status in ("A", "C", "R"):
+            changes.append(FileChange("added", path))
+        else:
+            changes.append(FileChange("modified", path))
+
+    untracked = run_git(root, "ls-files", "--others", "--exclude-standard", "-z", "--", str(src_dir)).split("\0")
+    changes.extend(FileChange("added", path) for file in untracked if file and (path := relative(file)) is not None)
+    return changes
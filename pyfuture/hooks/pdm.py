@@ -5,7 +5,11 @@ from pathlib import Path
 
 from pdm.backend.hooks.base import Context
 
-from pyfuture.utils import transfer_file
+from pyfuture import bytecode
+from pyfuture.budget import Budget
+from pyfuture.linemap import LINE_MAP_NAME, save_line_map
+from pyfuture.manifest import BuildManifest
+from pyfuture.utils import transfer_files
 
 
 def get_target_str(hook_config: dict) -> str | None:
@@ -40,15 +44,48 @@ def pdm_build_initialize(context: Context, target_str: str | None) -> None:  # p
 
 
 def pdm_build_update_files(
-    context: Context, files: dict[str, Path], target: tuple[int, int]
+    context: Context,
+    files: dict[str, Path],
+    target: tuple[int, int],
+    *,
+    compile_bytecode: bool = False,
+    invalidation_mode: str = "checked-hash",
+    split_threshold: int | None = None,
+    preserve_lines: bool = False,
+    executor: str = "auto",
+    budget: Budget | None = None,
+    engine: str = "libcst",
 ) -> None:  # pragma: no cover
     build_dir = context.ensure_build_dir()
     package_dir = Path(context.config.build_config.package_dir)
     includes = context.config.build_config.includes
+    manifest = BuildManifest.load(build_dir)
+    pairs = []
     for include in includes:
         src_path = package_dir / include
         tgt_path = build_dir / include
         for src_file in src_path.glob("**/*.py"):
             tgt_file = tgt_path / src_file.relative_to(src_path)
             files[f"{tgt_file.relative_to(build_dir)}"] = tgt_file
-            transfer_file(src_file, tgt_file, target=target)
+            pairs.append((src_file, tgt_file))
+    all_runs = transfer_files(
+        pairs,
+        target=target,
+        split_threshold=split_threshold,
+        preserve_lines=preserve_lines,
+        manifest=manifest,
+        budget=budget,
+        engine=engine,
+        executor=executor,
+    )
+    tgt_files = [tgt_file for _, tgt_file in pairs]
+    line_map = {tgt_file.relative_to(build_dir).as_posix(): runs for tgt_file, runs in zip(tgt_files, all_runs)}
+    manifest.remove_stale(package_dir)
+    manifest.save()
+    if preserve_lines:
+        # next to the build, the line map is not part of the wheel
+        save_line_map(build_dir / LINE_MAP_NAME, line_map)
+
+    if compile_bytecode:
+        for pyc_file in bytecode.compile_bytecode(tgt_files, target, invalidation_mode=invalidation_mode):
+            files[f"{pyc_file.relative_to(build_dir)}"] = pyc_file
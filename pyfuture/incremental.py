@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import ast
+import contextlib
+import functools
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import libcst as cst
+from libcst.codemod import Codemod
+from libcst.codemod.visitors import ImportItem
+
+from . import events
+from .nesting import MAX_NESTING, nesting_depth
+from .parallel import detect_format, requires_whole_module, split_statements, stitch_chunks, transform_chunk
+from .utils import apply_transformer, get_rule_sets, get_transformers, write_output
+
+# the names of the stdlib ast nodes corresponding to the trigger nodes of the built-in rules
+_AST_TRIGGER_NAMES: dict[type[cst.CSTNode], tuple[str, ...]] = {
+    cst.BitOr: ("BitOr",),
+    cst.FormattedString: ("JoinedStr",),
+    cst.Match: ("Match",),
+    cst.TypeParameters: ("TypeVar", "ParamSpec", "TypeVarTuple"),
+    cst.TypeAlias: ("TypeAlias",),
+}
+
+
+@functools.cache
+def get_ast_triggers() -> dict[type[cst.CSTNode], tuple[type[ast.AST], ...]]:
+    """
+    Get the stdlib ast nodes corresponding to the trigger nodes of the built-in rules.
+    Nodes of newer syntax are missing from the ast of older interpreters, which can not parse that syntax
+    either, so callers fall back to libcst when `ast.parse` raises `SyntaxError`.
+
+    Example:
+    >>> get_ast_triggers()[cst.FormattedString]
+    (<class 'ast.JoinedStr'>,)
+    """
+    return {
+        trigger: tuple(getattr(ast, name) for name in names if hasattr(ast, name))
+        for trigger, names in _AST_TRIGGER_NAMES.items()
+    }
+
+
+def may_trigger(code: str, transformers: list[type[Codemod]]) -> bool:
+    """
+    Cheaply check with the stdlib ast whether any transformer may change code.
+    Transformers without `TRIGGERS` or with triggers unknown to `get_ast_triggers`, and code the interpreter
+    can not parse, are assumed to change it.
+
+    Example:
+    >>> from pyfuture.codemod.utils import RuleSet
+    >>> transformers = list(get_transformers([RuleSet.pep701]))
+    >>> may_trigger("x = 1\\n", transformers)
+    False
+    >>> may_trigger("x = f'{1}'\\n", transformers)
+    True
+    """
+    known_triggers = get_ast_triggers()
+    ast_triggers: list[type[ast.AST]] = []
+    for transformer in transformers:
+        triggers = getattr(transformer, "TRIGGERS", None)
+        if triggers is None or any(trigger not in known_triggers for trigger in triggers):
+            return True
+        for trigger in triggers:
+            ast_triggers.extend(known_triggers[trigger])
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+    node_types = tuple(ast_triggers)
+    return any(isinstance(node, node_types) for node in ast.walk(tree))
+
+
+@dataclass
+class FileState:
+    source: str
+    output: str
+    format: tuple[str, str] | None = None
+    statements: dict[tuple[str, bool], tuple[str, list[ImportItem]]] = field(default_factory=dict)
+
+
+class IncrementalTransformer:
+    """
+    Re-transform files at top-level statement granularity, which is used by watch mode.
+
+    The previous source, its top-level statements with their transformed code and needed imports,
+    and the output are kept for every file. When a file changes, only the statements that changed
+    are transformed again and spliced into the cached output.
+
+    Example:
+    >>> transformer = IncrementalTransformer((3, 9))
+    >>> code = "def a[T](x: T) -> T: return x\\n\\ndef b[T](x: T) -> T: return x\\n"
+    >>> _ = transformer.transform("example.py", code)
+    >>> new_code = transformer.transform("example.py", code.replace("def b", "def c"))
+    >>> transformer.reused, transformer.total
+    (1, 2)
+    >>> print(new_code.splitlines()[-1])
+    c = __wrapper_func_c()
+    """
+
+    def __init__(self, target: tuple[int, int] = (3, 9)) -> None:
+        self.transformers = list(get_transformers(get_rule_sets(target)))
+        self.files: dict[str, FileState] = {}
+        self.reused = 0
+        self.total = 0
+
+    def transform(self, path: str | Path, code: str) -> str:
+        path = str(path)
+        state = self.files.get(path)
+        if state is not None and state.source == code:
+            self.reused = self.total = len(state.statements)
+            return state.output
+
+        tree = None
+        if nesting_depth(code) <= MAX_NESTING:
+            # older interpreters can not parse newer syntax, which is transformed as a whole by libcst
+            with contextlib.suppress(SyntaxError):
+                tree = ast.parse(code)
+        if tree is None or requires_whole_module(self.transformers, tree):
+            output = apply_transformer(self.transformers, code)
+            self.files[path] = FileState(code, output)
+            self.reused, self.total = 0, 1
+            return output
+
+        indent, newline = detect_format(code)
+        previous = state.statements if state is not None and state.format == (indent, newline) else {}
+        statements: dict[tuple[str, bool], tuple[str, list[ImportItem]]] = {}
+        results = []
+        self.reused = 0
+        pieces = split_statements(code, tree)
+        for i, statement in enumerate(pieces):
+            key = (statement, i == 0)
+            result = previous.get(key)
+            if result is not None:
+                self.reused += 1
+            elif may_trigger(statement, self.transformers):
+                result = transform_chunk(self.transformers, statement, indent, newline, i == 0)
+            else:
+                result = (statement, [])
+            statements[key] = result
+            results.append(result)
+        self.total = len(results)
+
+        output = stitch_chunks(tree, pieces[0].count("\n"), results)
+        self.files[path] = FileState(code, output, (indent, newline), statements)
+        return output
+
+    def transfer_file(self, src_file: Path, tgt_file: Path) -> dict[str, float]:
+        """
+        Transfer code from src_file and write to tgt_file incrementally,
+        and return the duration of reading, transforming and writing in seconds.
+        """
+        with events.file_scope(src_file):
+            try:
+                start = time.perf_counter()
+                code = src_file.read_text()
+                read = time.perf_counter()
+                new_code = self.transform(src_file, code)
+                transformed = time.perf_counter()
+            except Exception as e:
+                events.emit(events.EventKind.error, message=f"{type(e).__name__}: {e}")
+                raise
+            write_output(tgt_file, new_code)
+        return {"read": read - start, "transform": transformed - read, "write": time.perf_counter() - transformed}
+
+    def forget(self, path: str | Path) -> None:
+        self.files.pop(str(path), None)
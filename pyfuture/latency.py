@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import math
+import time
+from collections import deque
+
+# the stages of the latency from saving a source to its output landing in the build directory
+STAGES = ("debounce", "read", "transform", "write", "total")
+PERCENTILES = (50, 95, 99)
+
+
+class RollingHistogram:
+    """
+    The latencies of the last window events in seconds, and their percentiles.
+
+    Example:
+    >>> histogram = RollingHistogram(window=100)
+    >>> for i in range(1, 201):
+    ...     histogram.add(i / 1000)
+    >>> len(histogram), histogram.percentile(50), histogram.percentile(99)
+    (100, 0.15, 0.199)
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> float | None:
+        # nearest rank, so that percentiles are always observed latencies
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+class LatencyTracker:
+    """
+    Track the latency of watch mode events by stage, see `STAGES`, and summarize it every interval seconds.
+
+    Example:
+    >>> tracker = LatencyTracker(interval=0)
+    >>> tracker.record({"debounce": 0.05, "transform": 0.02, "total": 0.073})
+    >>> tracker.record({"debounce": 0.06, "transform": 0.01, "total": 0.075})
+    >>> tracker.due()
+    True
+    >>> print(tracker.summary())
+    2 events, total p50/p95/p99 73.0/75.0/75.0 ms, debounce 50.0/60.0/60.0 ms, transform 10.0/20.0/20.0 ms
+    """
+
+    def __init__(self, window: int = 1000, interval: float = 60.0) -> None:
+        self.histograms = {stage: RollingHistogram(window) for stage in STAGES}
+        self.interval = interval
+        self.count = 0
+        self.last_summary = time.monotonic()
+
+    def record(self, latency: dict[str, float]) -> None:
+        for stage, value in latency.items():
+            self.histograms[stage].add(value)
+        self.count += 1
+
+    def percentiles(self, stage: str) -> dict[int, float | None]:
+        return {q: self.histograms[stage].percentile(q) for q in PERCENTILES}
+
+    def summary(self) -> str:
+        parts = [f"{self.count} events"]
+        for stage in ("total", *(stage for stage in STAGES if stage != "total")):
+            if not self.histograms[stage]:
+                continue
+            values = "/".join(f"{value * 1000:.1f}" for value in self.percentiles(stage).values() if value is not None)
+            label = "total p50/p95/p99" if stage == "total" else stage
+            parts.append(f"{label} {values} ms")
+        return ", ".join(parts)
+
+    def due(self) -> bool:
+        """
+        Whether a summary is due, which restarts the interval.
+        """
+        now = time.monotonic()
+        if self.count == 0 or now - self.last_summary < self.interval:
+            return False
+        self.last_summary = now
+        return True
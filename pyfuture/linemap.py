@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import bisect
+import io
+import json
+import os
+import re
+import tokenize
+from dataclasses import dataclass
+from pathlib import Path
+
+from .utils import transfer_code
+
+LINE_MAP_NAME = ".pyfuture.map"
+
+# a run of output lines (out_start, src_start, length) mapped to consecutive source lines,
+# output lines outside of any run are on their original line
+Run = tuple[int, int, int]
+
+# the tokens starting compound statements, which can not be joined by `;`
+_COMPOUND_KEYWORDS = frozenset(
+    ["def", "class", "if", "elif", "else", "for", "while", "with", "try", "except", "finally", "async", "match", "@"]
+)
+
+
+def _marker(code: str) -> str:
+    # a marker which does not occur in code, so that lines of strings are never taken for marked lines
+    marker = "__pyfuture_line"
+    while marker in code:
+        marker += "_"
+    return marker
+
+
+def mark_lines(code: str) -> str:
+    """
+    Mark the last line of each logical line in code with its line number in a trailing comment,
+    which the transformers carry along with the statement.
+
+    Example:
+    >>> print(mark_lines("x = 1\\n\\nif x:  # check\\n    y = (\\n        1)\\n"), end="")
+    x = 1  # __pyfuture_line_1__
+    <BLANKLINE>
+    if x:  # check  # __pyfuture_line_3__
+        y = (
+            1)  # __pyfuture_line_5__
+    """
+    lines = io.StringIO(code).readlines()
+    ends: dict[int, int] = {}
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.NEWLINE and token.start[0] <= len(lines):
+                ends[token.start[0]] = token.start[1]
+    except (tokenize.TokenError, SyntaxError):
+        return code
+    marker = _marker(code)
+    for row, column in ends.items():
+        line = lines[row - 1]
+        lines[row - 1] = f"{line[:column]}  # {marker}_{row}__{line[column:]}"
+    return "".join(lines)
+
+
+@dataclass
+class _Line:
+    text: str
+    # the source line of a marked line, None for generated lines and lines continued by a marked line
+    src: int | None
+    indent: int = 0
+    # a complete simple statement without comment, which can be joined with others by `;`
+    simple: bool = False
+    # whether statements can be joined in front of it, which is not the case for docstrings and future imports
+    leading: bool = True
+
+
+def _scan_lines(lines: list[str]) -> tuple[set[int], dict[int, tuple[int, bool]]]:
+    """
+    Return the lines containing code, and the indentation and leading flag of the simple statement lines.
+    """
+    code_rows: set[int] = set()
+    simple_rows: dict[int, tuple[int, bool]] = {}
+    first: tokenize.TokenInfo | None = None
+    commented = False
+    skipped = (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER)
+    readline = iter(line + "\n" for line in lines).__next__
+    try:
+        for token in tokenize.generate_tokens(readline):
+            if token.type == tokenize.COMMENT:
+                commented = True
+            if token.type == tokenize.NEWLINE:
+                if (
+                    first is not None
+                    and first.start[0] == token.start[0]
+                    and first.string not in _COMPOUND_KEYWORDS
+                    and not commented
+                ):
+                    text = lines[first.start[0] - 1].lstrip()
+                    leading = first.type == tokenize.NAME and not text.startswith("from __future__")
+                    simple_rows[token.start[0]] = (first.start[1], leading)
+                first, commented = None, False
+                continue
+            if token.type in skipped:
+                continue
+            if first is None:
+                first = token
+            code_rows.update(range(token.start[0], token.end[0] + 1))
+    except (tokenize.TokenError, SyntaxError):
+        return set(range(1, len(lines) + 1)), {}
+    return code_rows, simple_rows
+
+
+def _join(first: _Line, second: _Line) -> _Line:
+    src = first.src if first.src is not None else second.src
+    return _Line(f"{first.text.rstrip()}; {second.text.strip()}", src, first.indent, True, first.leading)
+
+
+def _joinable(first: _Line, second: _Line) -> bool:
+    return first.simple and second.simple and second.leading and first.indent == second.indent
+
+
+def _pack(
+    pending: list[_Line], room: int, previous: _Line | None, line: _Line
+) -> tuple[_Line | None, list[_Line], _Line]:
+    """
+    Join the generated lines pending before line with each other, the previous line and line by `;`
+    until they fit into room, and return the new previous line, pending lines and line.
+    """
+    excess = len(pending) - room
+    packed: list[_Line] = []
+    for item in pending:
+        if excess > 0 and packed and item.src is None and packed[-1].src is None and _joinable(packed[-1], item):
+            packed[-1] = _join(packed[-1], item)
+            excess -= 1
+        else:
+            packed.append(item)
+    if excess > 0 and packed and previous is not None and packed[0].src is None and _joinable(previous, packed[0]):
+        previous = _join(previous, packed.pop(0))
+        excess -= 1
+    if excess > 0 and packed and packed[-1].src is None and _joinable(packed[-1], line):
+        line = _join(packed.pop(), line)
+    return previous, packed, line
+
+
+def restore_lines(code: str, marked_code: str, newline: str = "\n") -> tuple[str, list[Run]]:
+    """
+    Lay out marked_code, transformed from code marked by `mark_lines`, so that marked lines are on their
+    original line again, and return it with the runs of lines which could not be kept on their original line.
+
+    Generated lines are put into the blank lines before the next marked line, and joined with other simple
+    statements by `;` if there are not enough of them. Blank lines and comments on their own lines are dropped.
+
+    Example:
+    >>> code = "import os\\n\\n\\ndef test[T](x: T) -> T:\\n    return x\\n\\n\\ny = test(1)\\n"
+    >>> new_code, runs = restore_lines(code, transfer_code(mark_lines(code)))
+    >>> print(new_code, end="")
+    import os; from typing import TypeVar
+    def __wrapper_func_test():
+        __test_T = TypeVar("__test_T")
+        def test(x: __test_T) -> __test_T:
+            return x
+        return test
+    test = __wrapper_func_test()
+    y = test(1)
+    >>> runs
+    []
+    """
+    pattern = re.compile("  # " + _marker(code) + r"_(\d+)__$")
+    raw_lines = [line.rstrip("\r\n") for line in io.StringIO(marked_code).readlines()]
+    lines = []
+    for text in raw_lines:
+        match = pattern.search(text)
+        lines.append(_Line(text[: match.start()], int(match[1])) if match else _Line(text, None))
+    code_rows, simple_rows = _scan_lines([line.text for line in lines])
+    for row, (indent, leading) in simple_rows.items():
+        lines[row - 1].indent, lines[row - 1].simple, lines[row - 1].leading = indent, True, leading
+
+    out: list[str] = []
+    srcs: list[int] = []
+    previous: _Line | None = None
+    pending: list[_Line] = []
+    for row, line in enumerate(lines, 1):
+        if row not in code_rows:
+            continue
+        src = line.src
+        if src is None:
+            pending.append(line)
+            continue
+        room = src - len(out) - 1
+        if len(pending) > room:
+            previous, pending, line = _pack(pending, room, previous, line)
+            if previous is not None:
+                out[-1] = previous.text
+        for _ in range(room - len(pending)):
+            out.append("")
+            srcs.append(len(out))
+        # the pending lines end right before line, or are attributed to the lines between the previous line
+        # and line if they do not fit, which keeps the continuation lines of a statement on their source lines
+        start = previous.src + 1 if previous is not None and previous.src is not None else 1
+        for i, item in enumerate(pending):
+            out.append(item.text)
+            srcs.append(min(max(src - len(pending) + i, start), src))
+        out.append(line.text)
+        srcs.append(src)
+        previous, pending = line, []
+    source_lines = code.count("\n") + (not code.endswith("\n"))
+    for item in pending:
+        out.append(item.text)
+        srcs.append(min(len(out), source_lines))
+
+    runs: list[Run] = []
+    for out_line, src_line in enumerate(srcs, 1):
+        if out_line == src_line:
+            continue
+        if runs and runs[-1][0] + runs[-1][2] == out_line and runs[-1][1] + runs[-1][2] == src_line:
+            runs[-1] = (runs[-1][0], runs[-1][1], runs[-1][2] + 1)
+        else:
+            runs.append((out_line, src_line, 1))
+    return "".join(line + newline for line in out), runs
+
+
+def transfer_code_preserving_lines(
+    code: str,
+    *,
+    target: tuple[int, int] = (3, 9),
+    split_threshold: int | None = None,
+) -> tuple[str, list[Run]]:
+    """
+    Transfer code to the target version keeping every statement on its original line where possible,
+    and return the new code with the runs of lines which were moved, see `restore_lines`.
+
+    Example:
+    >>> new_code, runs = transfer_code_preserving_lines("def test[T](x: T) -> T:\\n    return x\\n")
+    >>> print(new_code, end="")
+    from typing import TypeVar
+    def __wrapper_func_test():
+        __test_T = TypeVar("__test_T")
+        def test(x: __test_T) -> __test_T:
+            return x
+        return test
+    test = __wrapper_func_test()
+    >>> runs
+    [(2, 1, 1), (3, 1, 1), (4, 1, 2), (6, 2, 1), (7, 2, 1)]
+    >>> [remap_line(runs, line) for line in range(1, 8)]
+    [1, 1, 1, 1, 2, 2, 2]
+    """
+    marked_code = mark_lines(code)
+    new_code = transfer_code(marked_code, target=target, split_threshold=split_threshold)
+    if new_code == marked_code:
+        return code, []
+    newline = match.group() if (match := re.search(r"\r\n?|\n", code)) else "\n"
+    return restore_lines(code, new_code, newline)
+
+
+def remap_line(runs: list[Run], line: int) -> int:
+    """
+    Map a line of an output file back to its source line.
+    """
+    i = bisect.bisect_right(runs, (line, float("inf"), 0)) - 1
+    if i >= 0:
+        out_start, src_start, length = runs[i]
+        if line < out_start + length:
+            return src_start + line - out_start
+    return line
+
+
+def load_line_map(path: Path) -> dict[str, list[Run]]:
+    """
+    Load the runs of each output file, keyed by its path relative to the build directory.
+    """
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    return {file: [tuple(run) for run in runs] for file, runs in data["files"].items()}
+
+
+def save_line_map(path: Path, line_map: dict[str, list[Run]]) -> None:
+    """
+    Save the line map of a build directory, only files with moved lines are listed.
+
+    Example:
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     save_line_map(Path(tmp_dir) / LINE_MAP_NAME, {"a.py": [(3, 1, 2)], "b.py": []})
+    ...     print((Path(tmp_dir) / LINE_MAP_NAME).read_text())
+    ...     print(load_line_map(Path(tmp_dir) / LINE_MAP_NAME))
+    {"version": 1, "files": {"a.py": [[3, 1, 2]]}}
+    {'a.py': [(3, 1, 2)]}
+    """
+    data = {"version": 1, "files": {file: runs for file, runs in sorted(line_map.items()) if runs}}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f"{path.name}.tmp")
+    tmp_file.write_text(json.dumps(data, separators=(", ", ": ")))
+    os.replace(tmp_file, path)
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from loguru import logger
+
+from .__version__ import __version__
+from .utils import file_hash, get_rule_sets
+
+MANIFEST_NAME = ".pyfuture-manifest.json"
+
+
+def _rule_sets(target: tuple[int, int]) -> list[str]:
+    return [rule_set.value for rule_set in get_rule_sets(target)]
+
+
+@dataclass
+class ManifestEntry:
+    """
+    What an output in the build directory was transferred from, and with which target and rule sets.
+    """
+
+    source: str
+    size: int
+    mtime_ns: int
+    hash: str
+    target: tuple[int, int]
+    rule_sets: list[str]
+    output_hash: str
+    # the runs of moved lines if the output preserves lines, see `pyfuture.linemap`
+    line_map: list[tuple[int, int, int]] | None = None
+
+
+class BuildManifest:
+    """
+    The sources and outputs of the last build in build_dir, keyed by the output path relative to build_dir.
+    Unchanged sources are recognized by a single `stat`, and sources whose stat changed but not their content
+    by their hash, so that no-op rebuilds transform and write nothing.
+    Outputs changed or deleted outside pyfuture are not detected, remove the build directory to rebuild them.
+
+    Example:
+    >>> import tempfile
+    >>> from pyfuture.utils import transfer_file
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     src_file, tgt_file = Path(tmp_dir) / "a.py", Path(tmp_dir) / "build" / "a.py"
+    ...     _ = src_file.write_text("x: int | None = None\\n")
+    ...     manifest = BuildManifest.load(tgt_file.parent)
+    ...     transfer_file(src_file, tgt_file, manifest=manifest)
+    ...     manifest.save()
+    ...     manifest = BuildManifest.load(tgt_file.parent)
+    ...     print(manifest.fresh(src_file, tgt_file, (3, 9)) is not None)
+    True
+    """
+
+    def __init__(self, build_dir: Path, entries: dict[str, ManifestEntry] | None = None) -> None:
+        self.build_dir = build_dir
+        self.entries: dict[str, ManifestEntry] = entries or {}
+        # the outputs recorded or found fresh in this build
+        self.seen: set[str] = set()
+
+    @property
+    def path(self) -> Path:
+        return self.build_dir / MANIFEST_NAME
+
+    @classmethod
+    def load(cls, build_dir: Path) -> BuildManifest:
+        """
+        Load the manifest of build_dir, which is empty if there is none or it was written by another version.
+        """
+        manifest = cls(build_dir)
+        try:
+            data = json.loads(manifest.path.read_text())
+        except FileNotFoundError:
+            return manifest
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring the build manifest {manifest.path}: {e}")
+            return manifest
+        if data.get("version") != __version__:
+            return manifest
+        for key, entry in data.get("entries", {}).items():
+            entry["target"] = tuple(entry["target"])
+            if entry.get("line_map") is not None:
+                entry["line_map"] = [tuple(run) for run in entry["line_map"]]
+            manifest.entries[key] = ManifestEntry(**entry)
+        return manifest
+
+    def save(self) -> None:
+        data = {"version": __version__, "entries": {key: asdict(entry) for key, entry in self.entries.items()}}
+        self.build_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_name(f"{MANIFEST_NAME}.tmp")
+        tmp_file.write_text(json.dumps(data, indent=1, sort_keys=True))
+        os.replace(tmp_file, self.path)
+
+    def key(self, tgt_file: Path) -> str:
+        return tgt_file.relative_to(self.build_dir).as_posix()
+
+    def part(self, tgt_files: list[Path]) -> BuildManifest:
+        """
+        Return a manifest holding only the entries of tgt_files, to be used by a worker and merged back.
+        """
+        keys = [self.key(tgt_file) for tgt_file in tgt_files]
+        return BuildManifest(self.build_dir, {key: self.entries[key] for key in keys if key in self.entries})
+
+    def merge(self, part: BuildManifest) -> None:
+        self.entries.update(part.entries)
+        self.seen |= part.seen
+
+    def lookup(
+        self, src_file: Path, tgt_file: Path, target: tuple[int, int], preserve_lines: bool | None = False
+    ) -> ManifestEntry | None:
+        """
+        Return the entry of tgt_file if it was transferred from src_file with the same target, rule sets and mode,
+        or in any mode if preserve_lines is None.
+        """
+        entry = self.entries.get(self.key(tgt_file))
+        if entry is None or entry.source != os.path.abspath(src_file):
+            return None
+        if entry.target != tuple(target) or entry.rule_sets != _rule_sets(target):
+            return None
+        if preserve_lines is not None and (entry.line_map is not None) != preserve_lines:
+            return None
+        return entry
+
+    def fresh(
+        self, src_file: Path, tgt_file: Path, target: tuple[int, int], preserve_lines: bool = False
+    ) -> ManifestEntry | None:
+        """
+        Return the entry of tgt_file if it is up to date with src_file, judged by the stat of src_file only.
+        """
+        entry = self.lookup(src_file, tgt_file, target, preserve_lines)
+        if entry is None:
+            return None
+        try:
+            stat = src_file.stat()
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            return None
+        self.seen.add(self.key(tgt_file))
+        return entry
+
+    def refresh(
+        self,
+        src_file: Path,
+        tgt_file: Path,
+        stat: os.stat_result,
+        code: str,
+        target: tuple[int, int],
+        preserve_lines: bool = False,
+    ) -> ManifestEntry | None:
+        """
+        Return the entry of tgt_file if it is up to date with code read from src_file although its stat changed,
+        e.g. after a checkout, and record the new stat.
+        """
+        entry = self.lookup(src_file, tgt_file, target, preserve_lines)
+        if entry is None or entry.hash != file_hash(code):
+            return None
+        entry.size, entry.mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.seen.add(self.key(tgt_file))
+        return entry
+
+    def record(
+        self,
+        src_file: Path,
+        tgt_file: Path,
+        stat: os.stat_result,
+        code: str,
+        output: str,
+        target: tuple[int, int],
+        line_map: list[tuple[int, int, int]] | None = None,
+    ) -> None:
+        """
+        Record that tgt_file contains output, transferred from code read from src_file with stat.
+        """
+        key = self.key(tgt_file)
+        major, minor = target
+        self.entries[key] = ManifestEntry(
+            source=os.path.abspath(src_file),
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            hash=file_hash(code),
+            target=(major, minor),
+            rule_sets=_rule_sets(target),
+            output_hash=file_hash(output),
+            line_map=line_map,
+        )
+        self.seen.add(key)
+
+    def forget(self, tgt_file: Path) -> None:
+        """
+        Forget the entry of tgt_file, e.g. after its source was deleted.
+        """
+        self.entries.pop(self.key(tgt_file), None)
+
+    def rename(self, old_tgt_file: Path, tgt_file: Path, src_file: Path) -> None:
+        """
+        Move the entry of old_tgt_file to tgt_file after the output was moved along with its source to src_file.
+        """
+        entry = self.entries.pop(self.key(old_tgt_file), None)
+        if entry is not None:
+            entry.source = os.path.abspath(src_file)
+            self.entries[self.key(tgt_file)] = entry
+
+    def remove_stale(self, src_dir: Path | None = None) -> list[Path]:
+        """
+        Remove the outputs recorded in a previous build but not in this one whose source was deleted or is
+        in src_dir, and return them. Outputs of other source directories sharing build_dir are kept as long as
+        their sources exist. Outputs which were changed since they were recorded are only forgotten.
+        """
+        src_root = None if src_dir is None else Path(os.path.abspath(src_dir))
+        removed = []
+        for key in [key for key in self.entries if key not in self.seen]:
+            source = Path(self.entries[key].source)
+            if source.exists() and (src_root is None or not source.is_relative_to(src_root)):
+                continue
+            entry = self.entries.pop(key)
+            tgt_file = self.build_dir / key
+            try:
+                if file_hash(tgt_file.read_text()) != entry.output_hash:
+                    continue
+            except (OSError, ValueError):
+                continue
+            tgt_file.unlink()
+            removed.append(tgt_file)
+        return removed
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import ast
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from libcst.codemod.visitors import ImportItem
+from loguru import logger
+
+from .__version__ import __version__
+from .incremental import may_trigger
+from .nesting import MAX_NESTING, nesting_depth
+from .parallel import detect_format, requires_whole_module, split_statements, stitch_chunks, transform_chunk
+from .utils import apply_transformer, get_rule_sets, get_transformers
+
+
+class StatementMemo:
+    """
+    Memoize the transformed code of top-level statements and the imports they need across files, so that
+    statements duplicated in many files (vendored copies, generated code, copy-pasted helpers) are transformed once.
+
+    Statements are keyed by their exact source, including their leading comments, which the rules move along
+    with them, and the indentation and newline of their module. Modules which have to be transformed as a whole,
+    see `requires_whole_module`, are not memoized.
+
+    Example:
+    >>> memo = StatementMemo((3, 9))
+    >>> helper = "def first[T](items: list[T]) -> T:\\n    return items[0]\\n"
+    >>> new_code = memo.transform("import os\\nx = 1\\n" + helper)
+    >>> new_code = memo.transform("import sys\\ny = 2\\n" + helper)
+    >>> memo.hits, memo.misses
+    (1, 1)
+    >>> print(new_code.splitlines()[1])
+    from typing import TypeVar
+    """
+
+    def __init__(
+        self,
+        target: tuple[int, int] = (3, 9),
+        entries: dict[str, tuple[str, list[ImportItem]]] | None = None,
+        path: Path | None = None,
+    ) -> None:
+        major, minor = target
+        self.target = (major, minor)
+        self.rule_sets = [rule_set.value for rule_set in get_rule_sets(target)]
+        self.transformers = list(get_transformers(get_rule_sets(target)))
+        self.entries: dict[str, tuple[str, list[ImportItem]]] = {} if entries is None else entries
+        self.path = path
+        # the keys transformed or reused in this run, only those are saved
+        self.used: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def key(self, statement: str, first: bool, indent: str, newline: str) -> str:
+        return hashlib.sha256(json.dumps([statement, first, indent, newline]).encode()).hexdigest()
+
+    def transform(self, code: str) -> str:
+        """
+        Transform code like `apply_transformer`, reusing the memoized statements.
+        """
+        tree = None if nesting_depth(code) > MAX_NESTING else ast.parse(code)
+        if tree is None or requires_whole_module(self.transformers, tree):
+            return apply_transformer(self.transformers, code)
+
+        indent, newline = detect_format(code)
+        pieces = split_statements(code, tree)
+        results = []
+        for i, statement in enumerate(pieces):
+            if not may_trigger(statement, self.transformers):
+                results.append((statement, []))
+                continue
+            key = self.key(statement, i == 0, indent, newline)
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                result = transform_chunk(self.transformers, statement, indent, newline, i == 0)
+                # a statement transformed by two threads at once is stored twice, with the same result
+                self.entries[key] = result
+            else:
+                self.hits += 1
+            self.used.add(key)
+            results.append(result)
+        return stitch_chunks(tree, pieces[0].count("\n"), results)
+
+    def part(self) -> StatementMemo:
+        """
+        Return a memo sharing the entries of this one with its own statistics, to be used by a worker and
+        merged back. Worker threads share the entries, worker processes get a copy.
+        """
+        return StatementMemo(self.target, self.entries)
+
+    def merge(self, part: StatementMemo) -> None:
+        for key in part.used:
+            self.entries[key] = part.entries[key]
+        self.used |= part.used
+        self.hits += part.hits
+        self.misses += part.misses
+
+    @classmethod
+    def load(cls, path: Path, target: tuple[int, int] = (3, 9)) -> StatementMemo:
+        """
+        Load a memo persisted at path, which is empty if there is none or it was written by another version
+        or for another target or other rule sets.
+        """
+        memo = cls(target, path=path)
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return memo
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring the statement memo {path}: {e}")
+            return memo
+        if data.get("version") != __version__ or tuple(data.get("target", ())) != memo.target:
+            return memo
+        if data.get("rule_sets") != memo.rule_sets:
+            return memo
+        for key, (code, imports) in data.get("entries", {}).items():
+            memo.entries[key] = (code, [ImportItem(*item) for item in imports])
+        return memo
+
+    def save(self, path: Path | None = None) -> None:
+        """
+        Save the statements used in this run to path, which defaults to the path the memo was loaded from.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the statement memo to")
+        entries = {
+            key: [code, [[item.module_name, item.obj_name, item.alias, item.relative] for item in imports]]
+            for key, (code, imports) in self.entries.items()
+            if key in self.used
+        }
+        data = {"version": __version__, "target": self.target, "rule_sets": self.rule_sets, "entries": entries}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_name(f"{path.name}.tmp")
+        tmp_file.write_text(json.dumps(data, sort_keys=True))
+        os.replace(tmp_file, path)
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import re
+import tokenize
+from collections.abc import Iterable
+
+import libcst as cst
+from libcst.codemod import Codemod, CodemodContext
+from libcst.codemod.visitors import AddImportsVisitor
+
+from . import events
+from .codemod.pep604 import TransformUnionTypesCommand
+
+# libcst visits, copies and generates code recursively, and the interpreter bounds the C stack regardless of
+# `sys.setrecursionlimit`, so top-level statements estimated to nest deeper than this are prepared up front
+MAX_NESTING = 100
+# the deepest syntax tree, in nodes, left to libcst
+MAX_DEPTH = 200
+
+# operators nesting their operands, e.g. `a | b | c` is parsed as `(a | b) | c`
+_NESTING_OPERATORS = frozenset(["|", "&", "^", "+", "-", "*", "/", "//", "%", "@", "**", "<<", ">>", "~", ".", ":="])
+_NESTING_KEYWORDS = frozenset(["and", "or", "not", "lambda", "await", "yield", "if", "else"])
+_CONTINUATION_KEYWORDS = frozenset(["else", "elif", "except", "finally"])
+# f-strings are tokenized as a single string before python 3.12
+_FSTRING_START = getattr(tokenize, "FSTRING_START", None)
+
+
+class NestingError(Exception):
+    """
+    A statement nested too deeply for libcst would still have to be transformed.
+    """
+
+
+def nesting_depth(code: str) -> int:
+    """
+    Estimate how deeply the syntax tree of code nests from its tokens, without building the tree.
+    Every open bracket, indentation level and `elif` nests one level, and so does every operator
+    and implicitly concatenated string since the last comma in the same brackets.
+    It over-estimates the nesting of expressions, and is only used to route statements to `prepare_nested`.
+
+    Example:
+    >>> nesting_depth("def f(x: int | str, y: str):\\n    return x\\n")
+    3
+    >>> nesting_depth("x = " + " + ".join(["a"] * 1000) + "\\n") > MAX_NESTING
+    True
+    """
+    depth = indent = 0
+    elifs: dict[int, int] = {}
+    # the operators seen in each open bracket of the current logical line since the last comma
+    operators = [0]
+    line_start = True
+    previous_type = None
+    with contextlib.suppress(tokenize.TokenError, SyntaxError):
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.INDENT:
+                indent += 1
+                continue
+            if token.type == tokenize.DEDENT:
+                elifs.pop(indent, None)
+                indent -= 1
+                continue
+            if token.type == tokenize.NEWLINE:
+                operators = [0]
+                line_start = True
+                continue
+            if token.type in (tokenize.NL, tokenize.COMMENT, tokenize.ENDMARKER):
+                continue
+
+            if line_start:
+                line_start = False
+                if token.string == "elif":
+                    elifs[indent] = elifs.get(indent, 0) + 1
+                elif token.string != "else":
+                    elifs[indent] = 0
+            elif token.string in "([{" and token.type == tokenize.OP:
+                operators.append(0)
+            elif token.string in ")]}" and token.type == tokenize.OP:
+                if len(operators) > 1:
+                    operators.pop()
+            elif token.string == "," and token.type == tokenize.OP:
+                operators[-1] = 0
+            elif (
+                (token.type == tokenize.OP and token.string in _NESTING_OPERATORS)
+                or (token.type == tokenize.NAME and token.string in _NESTING_KEYWORDS)
+                or (token.type == tokenize.STRING and previous_type == tokenize.STRING)
+                or (_FSTRING_START is not None and token.type == _FSTRING_START)
+            ):
+                operators[-1] += 1
+            previous_type = token.type
+            depth = max(depth, indent + sum(elifs.values()) + len(operators) + sum(operators))
+    return depth
+
+
+def split_top_level(code: str) -> list[str]:
+    """
+    Split code into top-level statements with tokenize, which does not build the nested syntax tree
+    unlike `ast`. Comments and blank lines between statements belong to the next statement.
+
+    Example:
+    >>> split_top_level("@dec\\ndef f(): pass\\n# comment\\nx = 1; y = 2\\nif x: pass\\nelse: pass\\n")
+    ['@dec\\ndef f(): pass\\n', '# comment\\nx = 1; y = 2\\n', 'if x: pass\\nelse: pass\\n']
+    """
+    lines = code.splitlines(keepends=True)
+    starts = [0]
+    level = 0
+    # the line following the last complete logical line
+    end = 0
+    line_start = True
+    decorated = False
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.INDENT:
+                level += 1
+            elif token.type == tokenize.DEDENT:
+                level -= 1
+            elif token.type == tokenize.NEWLINE:
+                end = token.end[0]
+                line_start = True
+            elif token.type not in (tokenize.NL, tokenize.COMMENT, tokenize.ENDMARKER) and line_start:
+                line_start = False
+                if level > 0:
+                    continue
+                if end > starts[-1] and not decorated and token.string not in _CONTINUATION_KEYWORDS:
+                    starts.append(end)
+                decorated = token.string == "@"
+    except (tokenize.TokenError, SyntaxError):
+        return [code]
+    starts.append(len(lines))
+    return ["".join(lines[start:end]) for start, end in zip(starts, starts[1:])]
+
+
+class _DepthGuard(cst.CSTVisitor):
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.depth = 0
+        self.exceeded = False
+
+    def on_visit(self, node: cst.CSTNode) -> bool:
+        self.depth += 1
+        self.exceeded = self.exceeded or self.depth > self.limit
+        return not self.exceeded
+
+    def on_leave(self, original_node: cst.CSTNode) -> None:
+        self.depth -= 1
+
+
+def exceeds_depth(node: cst.CSTNode, limit: int = MAX_DEPTH) -> bool:
+    """
+    Whether the syntax tree of node is deeper than limit, which never visits deeper than limit.
+
+    Example:
+    >>> exceeds_depth(cst.parse_module("x = " + " + ".join(["a"] * 1000) + "\\n"))
+    True
+    >>> exceeds_depth(cst.parse_module("x = a + b\\n"))
+    False
+    """
+    guard = _DepthGuard(limit)
+    try:
+        node.visit(guard)
+    except RecursionError:
+        return True
+    return guard.exceeded
+
+
+def _may_trigger(code: str, transformers: list[type[Codemod]]) -> bool:
+    from .incremental import may_trigger
+
+    try:
+        return may_trigger(code, transformers)
+    except RecursionError:
+        # too deep for the stdlib ast as well, so it may need any transformer
+        return True
+
+
+def prepare_nested(transformers: Iterable[type[Codemod]], code: str, context: CodemodContext) -> tuple[str, dict]:
+    """
+    Prepare the top-level statements of code nested deeper than `MAX_NESTING` to be transformed with libcst,
+    and return the new code with the placeholders to restore by `restore_nested`.
+
+    Long unions are flattened first if the PEP 604 rule is applied, and statements which are still too deep
+    are replaced by placeholders, so they are kept unchanged instead of failing the whole module.
+    Raises `NestingError` if such a statement contains a trigger of the transformers, since keeping it
+    would leave syntax the target does not support.
+
+    Example:
+    >>> from pyfuture.codemod.utils import RuleSet, get_transformers
+    >>> code = "x: " + " | ".join(["int"] * 1000) + "\\ny = " + " + ".join(["1"] * 1000) + "\\n"
+    >>> new_code, placeholders = prepare_nested(get_transformers(RuleSet.pep604), code, CodemodContext())
+    >>> new_code.startswith("x: Union[int, int")
+    True
+    >>> print(new_code.splitlines()[1])
+    __pyfuture_nested_0__ = None
+    >>> restore_nested(new_code, placeholders).splitlines()[1] == code.splitlines()[1]
+    True
+    """
+    transformers = list(transformers)
+    flatten = TransformUnionTypesCommand in transformers
+    newline = match.group() if (match := re.search(r"\r\n?|\n", code)) else "\n"
+    placeholders: dict[str, str] = {}
+    pieces = []
+    lineno = 1
+    for statement in split_top_level(code):
+        piece = statement
+        if nesting_depth(statement) > MAX_NESTING:
+            module = cst.parse_module(statement)
+            scratch = CodemodContext()
+            if flatten:
+                # the union rule does not visit the operands of unions, so it flattens long unions safely
+                with contextlib.suppress(RecursionError):
+                    module = module.visit(TransformUnionTypesCommand(scratch))
+            if exceeds_depth(module):
+                if _may_trigger(statement, transformers):
+                    raise NestingError(f"Statement at line {lineno} is nested too deeply to be transformed")
+                piece = f"__pyfuture_nested_{len(placeholders)}__ = None"
+                if statement.endswith(("\n", "\r")):
+                    piece += newline
+                placeholders[piece] = statement
+                message = f"Statement at line {lineno} is nested too deeply, kept as is"
+                events.emit(events.EventKind.error, message=message)
+            else:
+                piece = module.code
+                imports = scratch.scratch.get(AddImportsVisitor.CONTEXT_KEY, [])
+                context.scratch.setdefault(AddImportsVisitor.CONTEXT_KEY, []).extend(imports)
+        pieces.append(piece)
+        lineno += len(statement.splitlines())
+    return "".join(pieces), placeholders
+
+
+def restore_nested(code: str, placeholders: dict[str, str]) -> str:
+    for placeholder, statement in placeholders.items():
+        code = code.replace(placeholder, statement, 1)
+    return code
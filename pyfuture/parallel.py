@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import ast
+import contextlib
+import io
+import os
+import re
+import tokenize
+from collections.abc import Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import libcst as cst
+from libcst.codemod import Codemod, CodemodContext
+from libcst.codemod.visitors import AddImportsVisitor, ImportItem
+
+from .nesting import MAX_NESTING, nesting_depth
+from .utils import add_needed_imports, apply_transformer, suppress_stdout, transform_module
+
+
+def detect_format(code: str) -> tuple[str, str]:
+    """
+    Detect the indentation and the newline of code the same way libcst does,
+    so that chunks of a module are generated with the format of the whole module.
+
+    Example:
+    >>> detect_format("def test():\\r\\n\\treturn 1\\r\\n")
+    ('\\t', '\\r\\n')
+    >>> detect_format("x = 1")
+    ('    ', '\\n')
+    """
+    newline = match.group() if (match := re.search(r"\r\n?|\n", code)) else "\n"
+    indent = "    "
+    with contextlib.suppress(tokenize.TokenError, SyntaxError):
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.INDENT:
+                indent = token.string
+                break
+    return indent, newline
+
+
+def requires_whole_module(transformers: Iterable[type[Codemod]], tree: ast.Module) -> bool:
+    """
+    Whether the module has to be transformed as a whole.
+
+    Rules that do not declare `STATEMENT_LOCAL` may depend on other statements, if the module contains any
+    of their triggers (or always if they have none). Besides, `global` declarations bind module names from
+    inside a statement, so scope analysis (e.g. `ScopeProvider` in the PEP 695 rules) has to resolve them
+    across statements.
+
+    Example:
+    >>> from pyfuture.codemod.utils import RuleSet, get_transformers
+    >>> transformers = list(get_transformers(RuleSet.pep695))
+    >>> requires_whole_module(transformers, ast.parse("def test[T](x: T) -> T: return x"))
+    False
+    >>> requires_whole_module(transformers, ast.parse("def test():\\n    global x"))
+    True
+    >>> requires_whole_module(transformers, ast.parse("type Pair[T] = tuple[T, T]"))
+    True
+    """
+    from .incremental import get_ast_triggers
+
+    known_triggers = get_ast_triggers()
+    node_types: list[type[ast.AST]] = [ast.Global]
+    for transformer in transformers:
+        if getattr(transformer, "STATEMENT_LOCAL", False):
+            continue
+        triggers = getattr(transformer, "TRIGGERS", None)
+        if triggers is None or any(trigger not in known_triggers for trigger in triggers):
+            return True
+        for trigger in triggers:
+            node_types.extend(known_triggers[trigger])
+    types = tuple(node_types)
+    return any(isinstance(node, types) for node in ast.walk(tree))
+
+
+def split_statements(code: str, tree: ast.Module) -> list[str]:
+    """
+    Split code into top-level statements, which are concatenated back to code.
+    Leading comments belong to the next statement and indented trailing comments to the previous one,
+    as libcst does. The first piece always contains the docstring and the leading imports, where
+    imports are added.
+
+    Example:
+    >>> code = "import os\\nx = 1\\n# comment\\ny = 2; z = 3\\n"
+    >>> split_statements(code, ast.parse(code))
+    ['import os\\nx = 1\\n', '# comment\\ny = 2; z = 3\\n']
+    """
+    lines = code.splitlines(keepends=True)
+    statements = tree.body
+    head = 0
+    for i, statement in enumerate(statements):
+        head = i
+        is_docstring = i == 0 and isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant)
+        if not (is_docstring or isinstance(statement, (ast.Import, ast.ImportFrom))):
+            break
+
+    # the line where each statement (and its leading comments) starts
+    starts = [0]
+    for i in range(head + 1, len(statements)):
+        prev_end = statements[i - 1].end_lineno
+        assert prev_end is not None
+        start = min(
+            [statements[i].lineno, *(decorator.lineno for decorator in getattr(statements[i], "decorator_list", []))]
+        )
+        if start <= prev_end:
+            # statements separated by semicolons
+            continue
+        boundary = prev_end
+        for lineno in range(prev_end, start - 1):
+            line = lines[lineno]
+            if line[:1] in (" ", "\t") and line.lstrip().startswith("#"):
+                boundary = lineno + 1
+        starts.append(boundary)
+    starts.append(len(lines))
+    return ["".join(lines[start:end]) for start, end in zip(starts, starts[1:])]
+
+
+def group_statements(statements: list[str], groups: int) -> list[str]:
+    """
+    Group consecutive statements into at most `groups` pieces of similar line counts.
+
+    Example:
+    >>> group_statements(["a\\n", "b\\n", "c\\nd\\n", "e\\n"], 2)
+    ['a\\nb\\n', 'c\\nd\\ne\\n']
+    """
+    target_size = max(sum(statement.count("\n") for statement in statements) // max(groups, 1), 1)
+    pieces: list[list[str]] = []
+    size = target_size
+    for statement in statements:
+        if size >= target_size and len(pieces) < groups:
+            pieces.append([])
+            size = 0
+        pieces[-1].append(statement)
+        size += statement.count("\n")
+    return ["".join(piece) for piece in pieces]
+
+
+def transform_chunk(
+    transformers: list[type[Codemod]],
+    code: str,
+    indent: str,
+    newline: str,
+    first: bool,
+) -> tuple[str, list[ImportItem]]:
+    """
+    Transform a chunk of top-level statements of a module whose format is given by indent and newline,
+    and return the transformed code with the imports it needs.
+    """
+    with suppress_stdout():
+        module = cst.parse_module(code)
+        module = module.with_changes(default_indent=indent, default_newline=newline)
+        if not first and module.header and module.body:
+            # leading comments belong to the first statement in the whole module
+            statement = module.body[0]
+            statement = statement.with_changes(leading_lines=[*module.header, *statement.leading_lines])
+            module = module.with_changes(header=[], body=[statement, *module.body[1:]])
+        context = CodemodContext()
+        module = transform_module(transformers, module, context)
+    return module.code, context.scratch.get(AddImportsVisitor.CONTEXT_KEY, [])
+
+
+def stitch_chunks(tree: ast.Module, head_lines: int, results: list[tuple[str, list[ImportItem]]]) -> str:
+    """
+    Stitch the transformed chunks of a module together, and add the imports they need in one pass.
+    """
+    imports = [item for _, chunk_imports in results for item in chunk_imports]
+    if not imports:
+        return "".join(chunk_code for chunk_code, _ in results)
+
+    context = CodemodContext(scratch={AddImportsVisitor.CONTEXT_KEY: imports})
+    needed_modules = {item.module_name for item in imports}
+    later_imports = {
+        node.module
+        for node in tree.body
+        if isinstance(node, ast.ImportFrom) and node.level == 0 and node.lineno > head_lines
+    }
+    with suppress_stdout():
+        if needed_modules.isdisjoint(later_imports):
+            # imports only affect the first chunk, which contains the leading imports
+            head = add_needed_imports(cst.parse_module(results[0][0]), context).code
+            return head + "".join(chunk_code for chunk_code, _ in results[1:])
+        module = cst.parse_module("".join(chunk_code for chunk_code, _ in results))
+        return add_needed_imports(module, context).code
+
+
+def apply_transformer_parallel(
+    transformers: Iterable[type[Codemod]],
+    code: str,
+    *,
+    workers: int | None = None,
+    executor: Executor | None = None,
+) -> str:
+    """
+    Transform code like `apply_transformer`, but split the module into groups of top-level statements
+    which are transformed across worker processes and stitched together. Imports needed by all groups
+    are added once in the end. Falls back to `apply_transformer` if the module has to be transformed
+    as a whole, or if the interpreter is too old to parse it with `ast`.
+
+    Example:
+    >>> from pyfuture.codemod.utils import RuleSet, get_transformers
+    >>> transformers = list(get_transformers([RuleSet.pep695, RuleSet.pep604]))
+    >>> code = "def test[T](x: T) -> T: return x\\ny: int | str = 1\\n"
+    >>> new_code = apply_transformer_parallel(transformers, code, workers=2)
+    >>> new_code == apply_transformer(transformers, code)
+    True
+    """
+    transformers = list(transformers)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or nesting_depth(code) > MAX_NESTING:
+        return apply_transformer(transformers, code)
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return apply_transformer(transformers, code)
+    if requires_whole_module(transformers, tree):
+        return apply_transformer(transformers, code)
+    chunks = group_statements(split_statements(code, tree), workers * 4)
+    if len(chunks) <= 1:
+        return apply_transformer(transformers, code)
+
+    indent, newline = detect_format(code)
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(ProcessPoolExecutor(min(workers, len(chunks))))
+        futures = [
+            executor.submit(transform_chunk, transformers, chunk, indent, newline, i == 0)
+            for i, chunk in enumerate(chunks)
+        ]
+        results = [future.result() for future in futures]
+
+    return stitch_chunks(tree, chunks[0].count("\n"), results)
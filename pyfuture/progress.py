@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import heapq
+import sys
+import threading
+import time
+from collections import Counter
+from typing import TextIO
+
+from . import events
+
+_CLEAR_LINE = "\r\x1b[K"
+
+
+class BulkReporter:
+    """
+    Report the progress of a bulk run on a single line, and a summary of it at the end.
+
+    It is an event sink, which counts the queued and finished files, and a loguru sink (`write`), which batches
+    log messages. Events and messages are only formatted when the progress line is redrawn, at most every interval
+    seconds. On a stream which is not a terminal, e.g. a CI log, the progress is written as a plain line every
+    plain_interval seconds instead. Files copied verbatim after exceeding their budget are finished, not failed.
+
+    Example:
+    >>> import io
+    >>> stream = io.StringIO()
+    >>> with BulkReporter(stream, interval=0) as reporter:
+    ...     for i in range(3):
+    ...         events.emit(events.EventKind.queued, path=f"m{i}.py")
+    ...     events.emit(events.EventKind.transferred, path="m0.py", duration=0.25)
+    ...     events.emit(events.EventKind.transferred, path="m1.py", duration=0.5)
+    ...     events.emit(events.EventKind.error, path="m2.py", message="SyntaxError: invalid syntax")
+    >>> print(reporter.progress())
+    3/3 files, 1 failed
+    >>> print("\\n".join(reporter.summary().splitlines()[1:]))
+    Failed: m2.py: SyntaxError: invalid syntax
+    Slowest: m1.py 500.0 ms, m0.py 250.0 ms
+    """
+
+    def __init__(
+        self,
+        stream: TextIO | None = None,
+        *,
+        interval: float = 0.1,
+        plain_interval: float = 10.0,
+        slowest: int = 5,
+    ) -> None:
+        self.stream = sys.stderr if stream is None else stream
+        self.tty = self.stream.isatty()
+        self.interval = interval if self.tty else min(interval, plain_interval)
+        self.plain_interval = plain_interval
+        self.slowest = slowest
+        self.queued: set[str] = set()
+        self.finished: set[str] = set()
+        self.failures: dict[str, str] = {}
+        self.durations: dict[str, float] = {}
+        self.counts: Counter[str] = Counter()
+        self.pending: list[str] = []
+        self.start = self.last_draw = self.last_plain = time.monotonic()
+        self.line_drawn = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> BulkReporter:
+        events.add_sink(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        events.remove_sink(self)
+        self.close()
+
+    def __call__(self, event: events.Event) -> None:
+        with self.lock:
+            self.counts[event.kind.value] += 1
+            path = event.path
+            if path is not None:
+                match event.kind:
+                    case events.EventKind.queued:
+                        self.queued.add(path)
+                    case events.EventKind.transferred | events.EventKind.cache_hit | events.EventKind.copied:
+                        self.finished.add(path)
+                        if event.duration is not None:
+                            self.durations[path] = event.duration
+                    case events.EventKind.error:
+                        self.finished.add(path)
+                        self.failures.setdefault(path, event.message or "")
+            self._maybe_draw()
+
+    def write(self, message: str) -> None:
+        """
+        Queue a log message until the next redraw, a loguru sink.
+        """
+        text = str(message).rstrip("\n")
+        record = getattr(message, "record", None)
+        if record is not None and record["level"].no >= 30:
+            text = f"{record['level'].name}: {text}"
+        with self.lock:
+            self.pending.append(text)
+            if self.closed:
+                self._draw(final=True)
+            else:
+                self._maybe_draw()
+
+    def progress(self) -> str:
+        total = max(len(self.queued), len(self.finished))
+        parts = [f"{len(self.finished)}/{total} files"]
+        elapsed = time.monotonic() - self.start
+        if self.finished and elapsed > 0 and len(self.finished) < total:
+            parts.append(f"{len(self.finished) / elapsed:.0f} files/s")
+        if self.failures:
+            parts.append(f"{len(self.failures)} failed")
+        return ", ".join(parts)
+
+    def summary(self) -> str:
+        counts = self.counts
+        total = max(len(self.queued), len(self.finished))
+        outcomes = [
+            f"{counts['written']} written",
+            f"{counts['write_skipped']} unchanged",
+            f"{counts['linked']} linked",
+            f"{counts['cache_hit']} up to date",
+            f"{counts['copied']} copied verbatim",
+            f"{len(self.failures)} failed",
+        ]
+        elapsed = time.monotonic() - self.start
+        lines = [f"{len(self.finished)}/{total} files in {elapsed:.2f} s: " + ", ".join(outcomes)]
+        for path, message in self.failures.items():
+            lines.append(f"Failed: {path}: {message}")
+        slowest = heapq.nlargest(self.slowest, self.durations.items(), key=lambda item: item[1])
+        if slowest:
+            lines.append("Slowest: " + ", ".join(f"{path} {duration * 1000:.1f} ms" for path, duration in slowest))
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        """
+        Write the pending messages and the summary, and pass later messages through.
+        """
+        with self.lock:
+            self.closed = True
+            self._draw(final=True)
+            self.stream.write(self.summary() + "\n")
+            self.stream.flush()
+
+    def _maybe_draw(self) -> None:
+        if time.monotonic() - self.last_draw >= self.interval:
+            self._draw()
+
+    def _draw(self, final: bool = False) -> None:
+        now = self.last_draw = time.monotonic()
+        output = []
+        if self.pending:
+            if self.line_drawn:
+                output.append(_CLEAR_LINE)
+                self.line_drawn = False
+            output.extend(line + "\n" for line in self.pending)
+            self.pending.clear()
+        if final:
+            if self.line_drawn:
+                output.append(_CLEAR_LINE)
+                self.line_drawn = False
+        elif self.tty:
+            output.append(_CLEAR_LINE + self.progress())
+            self.line_drawn = True
+        elif now - self.last_plain >= self.plain_interval:
+            self.last_plain = now
+            output.append(self.progress() + "\n")
+        if output:
+            self.stream.write("".join(output))
+            self.stream.flush()
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import ast
+import marshal
+import os
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from .bytecode import find_interpreter
+from .check import needed_rule_sets
+from .codemod.utils import RuleSet
+from .utils import get_rule_sets
+
+_TYPE_PARAMETER_FACTORIES = frozenset(["TypeVar", "ParamSpec", "TypeVarTuple"])
+# match statements are missing from the ast of python 3.9, which can not parse them either
+_MATCH = getattr(ast, "Match", None)
+
+
+def count_constructs(tree: ast.AST) -> Counter[str]:
+    """
+    Count the constructs of a module which the rules introduce or lower.
+
+    Example:
+    >>> tree = ast.parse("def f[T](x: T) -> T:\\n    return f'{x}'\\nU = TypeVar('U')\\n")
+    >>> sorted(count_constructs(tree).items())
+    [('fstrings', 1), ('functions', 1), ('type_vars', 1)]
+    """
+    counts: Counter[str] = Counter()
+    for node in ast.walk(tree):
+        match node:
+            case ast.FunctionDef() | ast.AsyncFunctionDef() | ast.Lambda():
+                counts["functions"] += 1
+            case ast.Call(func=ast.Name(id=name) | ast.Attribute(attr=name)) if name in _TYPE_PARAMETER_FACTORIES:
+                counts["type_vars"] += 1
+            case ast.JoinedStr():
+                counts["fstrings"] += 1
+            case _ if _MATCH is not None and isinstance(node, _MATCH):
+                counts["matches"] += 1
+    return counts
+
+
+def bytecode_size(code: str, path: str = "<string>") -> int:
+    """
+    The size of the marshalled code object of code, compiled by the running interpreter.
+    """
+    return len(marshal.dumps(compile(code, path, "exec")))
+
+
+def module_name(path: Path) -> str:
+    """
+    Example:
+    >>> module_name(Path("pkg/sub/__init__.py")), module_name(Path("pkg/mod.py"))
+    ('pkg.sub', 'pkg.mod')
+    """
+    parts = path.with_suffix("").parts
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def import_time(interpreter: str, root: Path, module: str, repeat: int = 3) -> float | None:
+    """
+    Measure the cumulative import time of module in seconds, with modules in root on the path, in fresh
+    subprocesses of interpreter, and return the fastest of repeat runs, or None if the import fails.
+    Bytecode is cached in a temporary directory, which is warmed up by a first run that is not measured.
+    """
+    times = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = {**os.environ, "PYTHONPYCACHEPREFIX": cache_dir}
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        env["PYTHONPATH"] = os.pathsep.join([str(root), *filter(None, [os.environ.get("PYTHONPATH")])])
+        for _ in range(repeat + 1):
+            result = subprocess.run(
+                [interpreter, "-X", "importtime", "-c", f"import {module}"],
+                cwd=root,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            if result.returncode != 0:
+                return None
+            # the lines look like "import time:       self |  cumulative | name", nested imports are indented
+            for line in result.stderr.splitlines():
+                fields = line.removeprefix("import time:").split("|")
+                if len(fields) == 3 and fields[2].strip() == module:
+                    times.append(int(fields[1]) / 1e6)
+    return min(times[1:], default=None)
+
+
+@dataclass
+class ModuleReport:
+    """
+    The impact of the transform on one module. Import times are in seconds, `source` and `output` on the
+    running interpreter, `target` on the target interpreter if it is available.
+    """
+
+    path: str
+    module: str
+    rule_sets: list[str] = field(default_factory=list)
+    import_time: dict[str, float | None] = field(default_factory=dict)
+    bytecode_size: dict[str, int] = field(default_factory=dict)
+    extra_functions: int = 0
+    extra_type_vars: int = 0
+    lowered_matches: int = 0
+    lowered_fstrings: int = 0
+    error: str | None = None
+
+    @property
+    def import_overhead(self) -> float:
+        source, output = self.import_time.get("source"), self.import_time.get("output")
+        return 0.0 if source is None or output is None else output - source
+
+    @property
+    def size_overhead(self) -> int:
+        return self.bytecode_size.get("output", 0) - self.bytecode_size.get("source", 0)
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "import_overhead": self.import_overhead, "size_overhead": self.size_overhead}
+
+
+def report_module(
+    src_dir: Path,
+    build_dir: Path,
+    src_file: Path,
+    target: tuple[int, int] = (3, 9),
+    *,
+    repeat: int = 3,
+    measure_imports: bool = True,
+) -> ModuleReport:
+    """
+    Compare src_file in src_dir with its output in build_dir.
+    """
+    path = src_file.relative_to(src_dir)
+    report = ModuleReport(path.as_posix(), module_name(path))
+    try:
+        code = src_file.read_text()
+        output = (build_dir / path).read_text()
+        tree, output_tree = ast.parse(code), ast.parse(output)
+        report.bytecode_size = {"source": bytecode_size(code, str(path)), "output": bytecode_size(output, str(path))}
+    except (OSError, SyntaxError, ValueError, RecursionError) as e:
+        report.error = f"{type(e).__name__}: {e}"
+        return report
+
+    report.rule_sets = [
+        rule_set.value if isinstance(rule_set, RuleSet) else rule_set
+        for rule_set in needed_rule_sets(tree, get_rule_sets(target))
+    ]
+    counts, output_counts = count_constructs(tree), count_constructs(output_tree)
+    report.extra_functions = output_counts["functions"] - counts["functions"]
+    report.extra_type_vars = output_counts["type_vars"] - counts["type_vars"]
+    report.lowered_matches = counts["matches"] - output_counts["matches"]
+    report.lowered_fstrings = counts["fstrings"] - output_counts["fstrings"]
+
+    if measure_imports:
+        report.import_time["source"] = import_time(sys.executable, src_dir, report.module, repeat)
+        report.import_time["output"] = import_time(sys.executable, build_dir, report.module, repeat)
+        interpreter = find_interpreter(target)
+        if interpreter is not None:
+            report.import_time["target"] = import_time(interpreter, build_dir, report.module, repeat)
+    return report
+
+
+def summarize(reports: list[ModuleReport]) -> dict:
+    """
+    Summarize the reports by rule set, each module counts for every rule set it needs.
+
+    Example:
+    >>> report = ModuleReport("a.py", "a", ["pep604"], {"source": 0.5, "output": 1.5}, {"source": 10, "output": 30})
+    >>> summarize([report])["rule_sets"]
+    {'pep604': {'modules': 1, 'import_overhead': 1.0, 'size_overhead': 20}}
+    """
+    rule_sets: dict[str, dict[str, float]] = {}
+    for report in reports:
+        for rule_set in report.rule_sets:
+            summary = rule_sets.setdefault(rule_set, {"modules": 0, "import_overhead": 0.0, "size_overhead": 0})
+            summary["modules"] += 1
+            summary["import_overhead"] += report.import_overhead
+            summary["size_overhead"] += report.size_overhead
+    return {
+        "modules": len(reports),
+        "errors": sum(report.error is not None for report in reports),
+        "import_overhead": sum(report.import_overhead for report in reports),
+        "size_overhead": sum(report.size_overhead for report in reports),
+        "extra_functions": sum(report.extra_functions for report in reports),
+        "extra_type_vars": sum(report.extra_type_vars for report in reports),
+        "lowered_matches": sum(report.lowered_matches for report in reports),
+        "lowered_fstrings": sum(report.lowered_fstrings for report in reports),
+        "rule_sets": rule_sets,
+    }
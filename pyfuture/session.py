@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import libcst as cst
+from libcst.codemod import Codemod
+
+from . import events
+from .codemod.utils import RuleSet, get_transformers
+from .utils import apply_transformer, get_rule_sets, suppress_stdout
+
+
+@dataclass
+class Diagnostic:
+    message: str
+    line: int | None = None
+    column: int | None = None
+
+
+@dataclass
+class TransferResult:
+    """
+    The result of transforming one source, code is None if it failed.
+    """
+
+    code: str | None
+    diagnostics: list[Diagnostic] = field(default_factory=list)
+    cached: bool = False
+
+
+def _transform_source(transformers: list[type[Codemod]], code: str) -> TransferResult:
+    try:
+        new_code = apply_transformer(transformers, code)
+    except cst.ParserSyntaxError as e:
+        return TransferResult(None, [Diagnostic(e.message, e.raw_line, e.raw_column)])
+    except Exception as e:
+        return TransferResult(None, [Diagnostic(f"{type(e).__name__}: {e}")])
+    return TransferResult(new_code)
+
+
+def _transform_sources(transformers: list[type[Codemod]], sources: list[tuple[str, str]]) -> list[TransferResult]:
+    results = []
+    with suppress_stdout():
+        for path, code in sources:
+            with events.file_scope(path):
+                results.append(_transform_source(transformers, code))
+    return results
+
+
+class TransferSession:
+    """
+    A long-lived session to transform many sources in memory, which resolves the transformers once,
+    caches outputs by source and optionally transforms batches across worker processes.
+
+    Example:
+    >>> with TransferSession((3, 9)) as session:
+    ...     results = session.transform_many({"a.py": "x: int | None = None\\n", "b.py": "def f(:\\n"})
+    >>> print(results["a.py"].code)
+    from typing import Union
+    <BLANKLINE>
+    x: Union[int, None] = None
+    <BLANKLINE>
+    >>> results["b.py"].code is None, results["b.py"].diagnostics[0].line
+    (True, 1)
+    """
+
+    def __init__(
+        self,
+        target: tuple[int, int] = (3, 9),
+        *,
+        rule_sets: Iterable[RuleSet | str] | None = None,
+        workers: int = 1,
+        executor: Executor | None = None,
+        cache_size: int = 4096,
+    ) -> None:
+        self.target = target
+        self.transformers = list(get_transformers(get_rule_sets(target) if rule_sets is None else rule_sets))
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, TransferResult] = OrderedDict()
+        self._executor = executor
+        self._owns_executor = False
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+            self._owns_executor = True
+        return self._executor
+
+    def transform(self, code: str, path: str = "<string>") -> TransferResult:
+        return self.transform_many({path: code})[path]
+
+    def transform_many(self, sources: Mapping[str, str]) -> dict[str, TransferResult]:
+        """
+        Transform a mapping of path to source, and return the results in the same order.
+        Nothing is read from or written to the filesystem, paths are only used to identify sources.
+        """
+        results: dict[str, TransferResult] = {}
+        pending: dict[str, list[str]] = {}
+        for path, code in sources.items():
+            cached = self.cache.get(code)
+            if cached is not None:
+                self.cache.move_to_end(code)
+                events.emit(events.EventKind.cache_hit, path=path, size=len(code))
+                results[path] = TransferResult(cached.code, cached.diagnostics, cached=True)
+            else:
+                events.emit(events.EventKind.cache_miss, path=path, size=len(code))
+                pending.setdefault(code, []).append(path)
+
+        items = [(paths[0], code) for code, paths in pending.items()]
+        if self.workers > 1 and len(items) > 1:
+            batch_size = -(-len(items) // (self.workers * 4))
+            batches = [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+            futures = [self.executor.submit(_transform_sources, self.transformers, batch) for batch in batches]
+            outputs = [result for future in futures for result in future.result()]
+        else:
+            outputs = _transform_sources(self.transformers, items)
+
+        for (_, code), result in zip(items, outputs):
+            self.cache[code] = result
+            for path in pending[code]:
+                results[path] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return {path: results[path] for path in sources}
+
+    def close(self) -> None:
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._owns_executor = False
+
+    def __enter__(self) -> TransferSession:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import ast
+import io
+import itertools
+import keyword
+import tokenize
+from collections.abc import Callable, Iterable
+
+import libcst as cst
+from libcst.codemod import Codemod, CodemodContext
+from libcst.codemod.visitors import AddImportsVisitor
+
+from .codemod.pep604 import TransformUnionTypesCommand
+from .codemod.pep701 import TransformFStringCommand
+from .nesting import MAX_NESTING, nesting_depth
+
+# the syntax triggering the rules which are not spliced, a module containing it falls back to libcst
+_AST_TRIGGERS: dict[type[cst.CSTNode], Callable[[ast.AST], bool]] = {
+    cst.TypeParameters: lambda node: bool(getattr(node, "type_params", None)),
+    cst.Match: lambda node: type(node).__name__ == "Match",
+    cst.TypeAlias: lambda node: type(node).__name__ == "TypeAlias",
+}
+_BRACKETS = {"(": 1, "[": 1, "{": 1, ")": -1, "]": -1, "}": -1}
+# f-strings are tokenized into their parts since python 3.12, earlier hosts never splice
+_FSTRING_START = getattr(tokenize, "FSTRING_START", None)
+_FSTRING_MIDDLE = getattr(tokenize, "FSTRING_MIDDLE", None)
+_FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+
+
+class _Source:
+    """
+    Offsets into code from the positions of tokens (in characters) and of ast nodes (in utf-8 bytes).
+    """
+
+    def __init__(self, code: str) -> None:
+        self.code = code
+        self.lines = code.split("\n")
+        self.starts = list(itertools.accumulate((len(line) + 1 for line in self.lines), initial=0))
+
+    def token_offset(self, position: tuple[int, int]) -> int:
+        return self.starts[position[0] - 1] + position[1]
+
+    def node_span(self, node: ast.expr) -> tuple[int, int]:
+        assert node.end_lineno is not None and node.end_col_offset is not None
+        return self._offset(node.lineno, node.col_offset), self._offset(node.end_lineno, node.end_col_offset)
+
+    def _offset(self, lineno: int, col_offset: int) -> int:
+        line = self.lines[lineno - 1]
+        if not line.isascii():
+            col_offset = len(line.encode()[:col_offset].decode())
+        return self.starts[lineno - 1] + col_offset
+
+    def previous_char(self, offset: int) -> str:
+        while offset > 0 and self.code[offset - 1] in " \t":
+            offset -= 1
+        return self.code[offset - 1] if offset > 0 else ""
+
+
+def _union_items(op: ast.BinOp) -> list[ast.expr]:
+    # flattened like `pyfuture.codemod.utils.transform_bit_or`
+    items: list[ast.expr] = []
+    stack: list[ast.expr] = [op]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+            stack.append(node.right)
+            stack.append(node.left)
+        else:
+            items.append(node)
+    return items
+
+
+def _splice_union(source: _Source, op: ast.BinOp) -> tuple[int, int, list[str]] | None:
+    # only unions without parentheses, comments or line breaks between their operands
+    start, end = source.node_span(op)
+    items = [source.node_span(item) for item in _union_items(op)]
+    if items[0][0] != start or items[-1][1] != end:
+        return None
+    for (_, left_end), (right_start, _) in zip(items, items[1:]):
+        if source.code[left_end:right_start].strip(" \t") != "|":
+            return None
+    return start, end, [source.code[item_start:item_end] for item_start, item_end in items]
+
+
+def _is_bit_or(node: ast.expr | None) -> bool:
+    return isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr)
+
+
+def _annotations(node: ast.AST) -> Iterable[ast.expr | None]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        args = node.args
+        for arg in [*args.posonlyargs, *args.args, args.vararg, *args.kwonlyargs, args.kwarg]:
+            if arg is not None:
+                yield arg.annotation
+        yield node.returns
+    elif isinstance(node, ast.AnnAssign):
+        yield node.annotation
+
+
+def _union_edits(source: _Source, nodes: list[ast.AST]) -> tuple[list[tuple[int, int, str]], bool] | None:
+    """
+    The edits of `TransformUnionTypesCommand` in nodes, and whether `typing.Union` is needed.
+    """
+    edits = []
+    needs_union = False
+    for node in nodes:
+        for annotation in _annotations(node):
+            if not _is_bit_or(annotation):
+                continue
+            assert isinstance(annotation, ast.BinOp)
+            union = _splice_union(source, annotation)
+            if union is None or source.previous_char(union[0]) not in (":", ">"):
+                return None
+            start, end, items = union
+            edits.append((start, end, f"Union[{', '.join(items)}]"))
+            needs_union = True
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+            continue
+        if node.func.id not in ("isinstance", "issubclass"):
+            continue
+        # the rule expects a second argument, and drops any other argument along with a union
+        if len(node.args) < 2:
+            return None
+        if not isinstance(cls_info := node.args[1], ast.BinOp) or not _is_bit_or(cls_info):
+            continue
+        if len(node.args) != 2 or node.keywords:
+            return None
+        union = _splice_union(source, cls_info)
+        if union is None or source.previous_char(union[0]) != ",":
+            return None
+        start, end, items = union
+        # the rule also drops the whitespace and the trailing comma after the union, and imports no `Union`
+        call_end = source.node_span(node)[1] - 1
+        if source.code[call_end] != ")" or source.code[end:call_end].strip(" \t") not in ("", ","):
+            return None
+        edits.append((start, call_end, f"Union[{', '.join(items)}]"))
+    return edits, needs_union
+
+
+def _fstring_edit(source: _Source, tokens: list[tokenize.TokenInfo], i: int) -> tuple[int, int, str, int] | None:
+    """
+    The edit of `TransformFStringCommand` for the f-string starting at tokens[i], and the index of its end.
+    """
+    start_token = tokens[i]
+    # libcst rejects the raw f-strings the rule leaves, and the rule keeps the prefix "F"
+    if start_token.string.rstrip("'\"") != "f":
+        return None
+    start = source.token_offset(start_token.start)
+    text_start = source.token_offset(start_token.end)
+    string = ""
+    expressions = []
+    i += 1
+    while (token := tokens[i]).type != _FSTRING_END:
+        if token.type != tokenize.OP or token.string != "{":
+            i += 1
+            continue
+        string += source.code[text_start : source.token_offset(token.start)]
+        expression_start = source.token_offset(token.end)
+        depth = 0
+        i += 1
+        while True:
+            token = tokens[i]
+            if token.type == _FSTRING_START:
+                return None
+            if token.type == tokenize.OP:
+                if depth == 0 and token.string in ("}", ":", "!", "="):
+                    break
+                depth += _BRACKETS.get(token.string, 0)
+            i += 1
+        # conversions and self-documenting expressions
+        if token.string in ("!", "="):
+            return None
+        expression = source.code[expression_start : source.token_offset(token.start)]
+        if "\n" in expression:
+            return None
+        format_spec = ""
+        if token.string == ":":
+            spec_start = source.token_offset(token.end)
+            i += 1
+            while tokens[i].type == _FSTRING_MIDDLE:
+                i += 1
+            token = tokens[i]
+            # nested replacement fields
+            if token.string != "}":
+                return None
+            format_spec = source.code[spec_start : source.token_offset(token.start)]
+        expressions.append(expression.strip())
+        string += "{:" + format_spec + "}"
+        text_start = source.token_offset(token.end)
+        i += 1
+    end_token = tokens[i]
+    string += source.code[text_start : source.token_offset(end_token.start)]
+    new_code = f"{start_token.string.strip('f')}{string}{end_token.string}.format({', '.join(expressions)})"
+    return start, source.token_offset(end_token.end), new_code, i
+
+
+def _parenthesized(tokens: list[tokenize.TokenInfo], first: int, last: int) -> bool:
+    # the rule drops the parentheses around an f-string along with it, unlike the parentheses of a call
+    if first < 1 or tokens[first - 1].exact_type != tokenize.LPAR or tokens[last + 1].exact_type != tokenize.RPAR:
+        return False
+    if first < 2:
+        return True
+    before = tokens[first - 2]
+    if before.type == tokenize.NAME:
+        return keyword.iskeyword(before.string) or keyword.issoftkeyword(before.string)
+    return before.exact_type not in (tokenize.RPAR, tokenize.RSQB)
+
+
+def _fstring_edits(source: _Source) -> list[tuple[int, int, str]] | None:
+    tokens = [
+        token
+        for token in tokenize.generate_tokens(io.StringIO(source.code).readline)
+        if token.type not in (tokenize.NL, tokenize.COMMENT)
+    ]
+    strings = (tokenize.STRING, _FSTRING_START, _FSTRING_END)
+    edits = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i].type == getattr(tokenize, "TSTRING_START", None):
+            return None
+        if tokens[i].type != _FSTRING_START:
+            i += 1
+            continue
+        # implicitly concatenated strings
+        if i > 0 and tokens[i - 1].type in strings:
+            return None
+        first = i
+        edit = _fstring_edit(source, tokens, i)
+        if edit is None:
+            return None
+        start, end, new_code, i = edit
+        if i + 1 < len(tokens) and (tokens[i + 1].type in strings or _parenthesized(tokens, first, i)):
+            return None
+        edits.append((start, end, new_code))
+        i += 1
+    return edits
+
+
+def _import_union(source: _Source, tree: ast.Module) -> tuple[int, str] | None:
+    """
+    Add `from typing import Union` to the head of the module like `pyfuture.utils.add_needed_imports`,
+    and return the end of the head and its new code.
+    Without `typing` imports, the import is added after the docstring and imports leading the module (the head).
+    Otherwise the head is parsed with libcst on its own, followed by a placeholder for the next statement
+    which keeps its leading lines.
+    """
+    from .utils import add_needed_imports
+
+    body = tree.body
+    # the statements imports are added after, see `AddImportsVisitor`: a docstring or `__strict__` flag, which also
+    # covers some statements libcst does not skip, and the imports following it
+    head = 1 if body and _is_docstring_or_flag(body[0]) else 0
+    while head < len(body) and isinstance(body[head], (ast.Import, ast.ImportFrom)):
+        head += 1
+    if head == len(body):
+        return None
+    first_lines = [
+        min([statement.lineno] + [decorator.lineno for decorator in _decorators(statement)])
+        for statement in body[: head + 1]
+    ]
+    # statements sharing a line are a single statement line for libcst
+    for statement, next_line in zip(body[:head], first_lines[1:]):
+        if statement.end_lineno is None or statement.end_lineno >= next_line:
+            return None
+    end = source.starts[first_lines[-1] - 1]
+
+    if (
+        head > 0
+        and _imports_after(source, body[0])
+        and not any(_imports_typing(statement) for statement in body[:head])
+    ):
+        # a new statement after the head, and an empty line before the next statement unless it starts with one
+        last_line = body[head - 1].end_lineno
+        assert last_line is not None
+        insert = source.starts[last_line]
+        leading_lines = source.code[insert:end]
+        empty_line = "" if leading_lines and not leading_lines.split("\n", 1)[0].strip() else "\n"
+        return end, f"{source.code[:insert]}from typing import Union\n{empty_line}{leading_lines}"
+
+    context = CodemodContext()
+    AddImportsVisitor.add_needed_import(context, "typing", "Union")
+    module = add_needed_imports(cst.parse_module(source.code[:end] + "pass\n"), context)
+    new_code = module.code
+    if not new_code.endswith("pass\n"):
+        return None
+    return end, new_code.removesuffix("pass\n")
+
+
+def _decorators(statement: ast.stmt) -> list[ast.expr]:
+    return getattr(statement, "decorator_list", [])
+
+
+def _imports_after(source: _Source, statement: ast.stmt) -> bool:
+    # whether libcst adds imports after the first statement, a docstring of a single string or an import
+    if isinstance(statement, (ast.Import, ast.ImportFrom)):
+        return True
+    if not isinstance(statement, ast.Expr) or not isinstance(statement.value, ast.Constant):
+        return False
+    start, end = source.node_span(statement.value)
+    tokens = tokenize.generate_tokens(io.StringIO(source.code[start:end]).readline)
+    return sum(token.type == tokenize.STRING for token in tokens) == 1
+
+
+def _imports_typing(statement: ast.stmt) -> bool:
+    return isinstance(statement, ast.ImportFrom) and (statement.module or "").endswith("typing")
+
+
+def _is_docstring_or_flag(statement: ast.stmt) -> bool:
+    if isinstance(statement, ast.Expr):
+        return isinstance(statement.value, ast.Constant) and isinstance(statement.value.value, (str, bytes))
+    return isinstance(statement, ast.Assign) and any(
+        isinstance(target, ast.Name) and target.id == "__strict__" for target in statement.targets
+    )
+
+
+def splice_code(transformers: Iterable[type[Codemod]], code: str) -> str | None:
+    """
+    Transform code with some transformers by splicing the rewritten text into it, without building a libcst tree,
+    and return the transformed code, which is the same as `pyfuture.utils.apply_transformer` returns.
+
+    Only the simple cases of `TransformFStringCommand` and `TransformUnionTypesCommand` are spliced: f-strings
+    without conversions, nested fields or implicit concatenation, and unions without parentheses or line breaks.
+    None is returned for any other module, e.g. if other transformers could apply, which falls back to libcst.
+
+    Example:
+    >>> from pyfuture.utils import get_rule_sets, get_transformers
+    >>> transformers = list(get_transformers(get_rule_sets((3, 9))))
+    >>> print(splice_code(transformers, "import os\\ndef f(x: int | None):\\n    return f'{x:>4}{os.sep}'\\n"))
+    import os
+    from typing import Union
+    <BLANKLINE>
+    def f(x: Union[int, None]):
+        return '{:>4}{:}'.format(x, os.sep)
+    >>> splice_code(transformers, "def f[T](x: T) -> T:\\n    return x\\n") is None
+    True
+    """
+    if _FSTRING_START is None or "\r" in code:
+        return None
+    transformers = list(transformers)
+    triggers = []
+    for transformer in transformers:
+        if transformer in (TransformFStringCommand, TransformUnionTypesCommand):
+            continue
+        transformer_triggers = getattr(transformer, "TRIGGERS", None)
+        if transformer_triggers is None or any(trigger not in _AST_TRIGGERS for trigger in transformer_triggers):
+            return None
+        triggers.extend(_AST_TRIGGERS[trigger] for trigger in transformer_triggers)
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    nodes = list(ast.walk(tree))
+    if any(trigger(node) for node in nodes for trigger in triggers):
+        return None
+    if nesting_depth(code) > MAX_NESTING:
+        return None
+
+    source = _Source(code)
+    edits = []
+    needs_union = False
+    if TransformUnionTypesCommand in transformers:
+        union_edits = _union_edits(source, nodes)
+        if union_edits is None:
+            return None
+        edits, needs_union = union_edits
+    # only modules with f-strings (or t-strings, which fall back) are tokenized
+    strings = any(type(node).__name__ in ("JoinedStr", "TemplateStr") for node in nodes)
+    if TransformFStringCommand in transformers and strings:
+        fstring_edits = _fstring_edits(source)
+        if fstring_edits is None:
+            return None
+        edits.extend(fstring_edits)
+    edits.sort()
+    # nested rewrites take several passes of the rules
+    for (_, end, _), (next_start, _, _) in zip(edits, edits[1:]):
+        if next_start < end:
+            return None
+
+    head_end, head = 0, ""
+    if needs_union:
+        imported = _import_union(source, tree)
+        if imported is None or edits[0][0] < imported[0]:
+            return None
+        head_end, head = imported
+    parts = [head]
+    position = head_end
+    for start, end, new_code in edits:
+        parts.append(code[position:start])
+        parts.append(new_code)
+        position = end
+    parts.append(code[position:])
+    return "".join(parts)
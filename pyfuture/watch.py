@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Protocol
+
+from loguru import logger
+
+from . import events
+from .incremental import IncrementalTransformer
+from .latency import LatencyTracker
+
+
+class StopEvent(Protocol):
+    def is_set(self) -> bool: ...
+
+
+def transfer_changed(
+    incremental: IncrementalTransformer, src_file: Path, tgt_file: Path, received: float
+) -> dict[str, float]:
+    """
+    Transfer a source reported changed at received (`time.time()`) and return the latency of each stage,
+    see `pyfuture.latency.STAGES`. The debounce wait is measured from the modification time of the source,
+    which also covers the time the file watcher took to notice it.
+    """
+    try:
+        modified = src_file.stat().st_mtime
+    except OSError:
+        modified = received
+    latency = incremental.transfer_file(src_file, tgt_file)
+    latency["debounce"] = max(received - modified, 0.0)
+    latency["total"] = max(time.time() - modified, 0.0)
+    return latency
+
+
+def watch_tree(
+    src_dir: Path,
+    build_dir: Path,
+    incremental: IncrementalTransformer,
+    tracker: LatencyTracker,
+    *,
+    debounce: int = 1600,
+    stop_event: StopEvent | None = None,
+) -> None:
+    """
+    Transfer the python files in src_dir changed while watching to build_dir, until stop_event is set.
+    Changes are grouped for debounce milliseconds, the latency of each is recorded in tracker, and its summary
+    is logged periodically.
+    """
+    from watchfiles import Change, PythonFilter, watch
+
+    for changes in watch(src_dir, watch_filter=PythonFilter(), debounce=debounce, stop_event=stop_event):
+        received = time.time()
+        for mode, path in changes:
+            tgt_file = build_dir / Path(path).relative_to(src_dir)
+            match mode:
+                case Change.added | Change.modified:
+                    events.emit(events.EventKind.queued, path=path)
+                    latency = transfer_changed(incremental, Path(path), tgt_file, received)
+                    tracker.record(latency)
+                    reused, total = incremental.reused, incremental.total
+                    logger.info(
+                        f"Transferred {path} in {latency['total'] * 1000:.1f} ms, {reused}/{total} statements reused"
+                    )
+                case Change.deleted:
+                    logger.info(f"Deleted: {path}")
+                    incremental.forget(path)
+                    tgt_file.unlink(missing_ok=True)
+        if tracker.due():
+            logger.info(f"Latency: {tracker.summary()}")
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import os
+import time
+
+import pytest
+from typer.testing import CliRunner
+
+from pyfuture.__main__ import app
+from pyfuture.budget import Budget, BudgetExceeded, close_workers
+from pyfuture.utils import transfer_code
+
+CODE = "def test[T](x: T) -> T: return x\n"
+
+
+def test_iterations():
+    assert Budget(iterations=2).run(transfer_code, CODE) == transfer_code(CODE)
+    with pytest.raises(BudgetExceeded, match="did not converge in 1 iterations"):
+        Budget(iterations=1).run(transfer_code, CODE)
+    # the limit only applies within the budget
+    assert transfer_code(CODE)
+
+
+def test_time():
+    budget = Budget(time=0.5)
+    start = time.perf_counter()
+    with pytest.raises(BudgetExceeded, match="time budget"):
+        budget.run(time.sleep, 60)
+    assert time.perf_counter() - start < 30
+    # the killed worker is replaced
+    assert budget.run(transfer_code, CODE) == transfer_code(CODE)
+    close_workers()
+
+
+def test_memory():
+    budget = Budget(memory=2 * 1024**3)
+    with pytest.raises(BudgetExceeded, match="memory budget"):
+        budget.run(bytearray, 4 * 1024**3)
+    with pytest.raises(BudgetExceeded, match="died"):
+        budget.run(os._exit, 1)
+    # other errors are raised as they are
+    with pytest.raises(ValueError):
+        budget.run(int, "x")
+    close_workers()
+
+
+@pytest.mark.parametrize("isolated", [False, True])
+def test_transfer_dir_budget(tmp_path, isolated):
+    src_dir, build_dir = tmp_path / "src", tmp_path / "build"
+    src_dir.mkdir()
+    (src_dir / "generic.py").write_text(CODE)
+    (src_dir / "plain.py").write_text("x = 1\n")
+    args = ["transfer-dir", str(src_dir), str(build_dir), *(["--time-budget", "60"] if isolated else [])]
+    result = CliRunner().invoke(app, [*args, "--max-iterations", "1"])
+    assert isinstance(result.exception, BudgetExceeded)
+
+    result = CliRunner().invoke(app, [*args, "--max-iterations", "1", "--budget-fallback", "copy", "--progress"])
+    assert result.exit_code == 0
+    assert "did not converge" in result.output
+    # copied verbatim, not failed
+    assert "1 copied verbatim, 0 failed" in result.output
+    assert (build_dir / "generic.py").read_text() == CODE
+    assert (build_dir / "plain.py").read_text() == "x = 1\n"
+
+    # files over budget are not recorded, and transferred again with a larger budget
+    result = CliRunner().invoke(app, [*args, "--max-iterations", "2"])
+    assert result.exit_code == 0
+    assert (build_dir / "generic.py").read_text() == transfer_code(CODE)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from pyfuture import check
+from pyfuture.check import check_file, check_files
+from pyfuture.manifest import BuildManifest
+from pyfuture.utils import transfer_file
+
+
+def test_check_without_host_parser(tmp_path, monkeypatch):
+    src_file = tmp_path / "example.py"
+    src_file.write_text("def f[T](x: T) -> T:\n    return x\n")
+    invalid_file = tmp_path / "invalid.py"
+    invalid_file.write_text("def f(:\n")
+
+    def parse(*args, **kwargs):
+        # like the parser of an interpreter older than the syntax of the module
+        raise SyntaxError("invalid syntax")
+
+    monkeypatch.setattr(check.ast, "parse", parse)
+    assert check_file(src_file).rule_sets == ["pep695"]
+    assert check_file(invalid_file).error == "SyntaxError: invalid syntax"
+
+
+def test_check_files_with_manifest(tmp_path, monkeypatch):
+    build_dir = tmp_path / "build"
+    pairs = []
+    for name in ("a", "b"):
+        src_file = tmp_path / f"{name}.py"
+        src_file.write_text("def f[T](x: T) -> T:\n    return x\n")
+        pairs.append((src_file, build_dir / f"{name}.py"))
+    manifest = BuildManifest.load(build_dir)
+    for src_file, tgt_file in pairs:
+        transfer_file(src_file, tgt_file, preserve_lines=True, manifest=manifest)
+    manifest.save()
+
+    def transfer_code(*args, **kwargs):
+        raise AssertionError("recorded outputs are not transformed")
+
+    monkeypatch.setattr(check, "transfer_code", transfer_code)
+    manifest = BuildManifest.load(build_dir)
+    assert [result.output for result in check_files(pairs, workers=1, manifest=manifest)] == ["up-to-date"] * 2
+    pairs[1][1].write_text("changed outside")
+    assert [result.output for result in check_files(pairs, workers=1, manifest=manifest)] == ["up-to-date", "stale"]
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
+import json
+import subprocess
+import sys
+
 import pytest
 from typer.testing import CliRunner
 
 from pyfuture.__main__ import app
+from pyfuture.linemap import LINE_MAP_NAME, load_line_map
+from pyfuture.manifest import BuildManifest
 
 runner = CliRunner()
 
@@ -55,3 +61,246 @@ def test_transfer_dir(code_dir):
     )
     for code_file in code_dir.iterdir():
         assert code_file.read_text() == expected
+
+
+def test_transfer_dir_compile_bytecode(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    target = f"py{sys.version_info[0]}{sys.version_info[1]}"
+    result = runner.invoke(
+        app,
+        ["transfer-dir", str(code_dir), str(build_dir), "--target", target, "--compile-bytecode"],
+    )
+    assert result.exit_code == 0
+    for code_file in code_dir.iterdir():
+        pyc_file = build_dir / "__pycache__" / f"{code_file.stem}.{sys.implementation.cache_tag}.pyc"
+        assert pyc_file.exists()
+        # flags: hash-based and check source
+        assert int.from_bytes(pyc_file.read_bytes()[4:8], "little") == 0b11
+
+
+def test_transfer_dir_events(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    events_file = build_dir / "events.jsonl"
+    metrics_file = build_dir / "pyfuture.prom"
+    args = ["transfer-dir", str(code_dir), str(build_dir), "--events-file", str(events_file)]
+    result = runner.invoke(app, [*args, "--metrics-file", str(metrics_file)])
+    assert result.exit_code == 0
+    kinds = [json.loads(line)["kind"] for line in events_file.read_text().splitlines()]
+    assert kinds.count("queued") == 5
+    assert kinds.count("written") == 5
+    assert 'pyfuture_events_total{kind="parsed"} 5' in metrics_file.read_text()
+
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    kinds = [json.loads(line)["kind"] for line in events_file.read_text().splitlines()]
+    assert kinds.count("cache_hit") == 5
+
+    result = runner.invoke(app, [*args, "--no-use-manifest"])
+    assert result.exit_code == 0
+    kinds = [json.loads(line)["kind"] for line in events_file.read_text().splitlines()]
+    assert kinds.count("write_skipped") == 5
+
+
+@pytest.mark.parametrize("executor", ["threads", "processes"])
+def test_transfer_dir_executor(code_dir, tmp_path_factory, executor):
+    serial_dir, build_dir = tmp_path_factory.mktemp("serial"), tmp_path_factory.mktemp("build")
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(serial_dir), "--executor", "serial"])
+    assert result.exit_code == 0
+    args = ["transfer-dir", str(code_dir), str(build_dir), "--executor", executor, "--workers", "2"]
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    for code_file in code_dir.iterdir():
+        assert (build_dir / code_file.name).read_text() == (serial_dir / code_file.name).read_text()
+    assert len(json.loads((build_dir / ".pyfuture-manifest.json").read_text())["entries"]) == 5
+
+    # the parts of the manifest of all workers are merged
+    events_file = tmp_path_factory.mktemp("events") / "events.jsonl"
+    result = runner.invoke(app, [*args, "--events-file", str(events_file)])
+    assert result.exit_code == 0
+    kinds = [json.loads(line)["kind"] for line in events_file.read_text().splitlines()]
+    assert kinds.count("queued") == 5
+    # also the events of worker processes
+    assert kinds.count("cache_hit") == 5
+
+
+def test_transfer_dir_manifest(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    events_file = tmp_path_factory.mktemp("events") / "events.jsonl"
+    args = ["transfer-dir", str(code_dir), str(build_dir), "--events-file", str(events_file)]
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    expected = (build_dir / "example0.py").read_text()
+
+    def run():
+        events_file.unlink()
+        result = runner.invoke(app, args)
+        assert result.exit_code == 0
+        return {
+            (event["kind"], event["path"].rsplit("/", 1)[-1])
+            for event in map(json.loads, events_file.read_text().splitlines())
+            if event["kind"] in ("cache_hit", "parsed", "written")
+        }
+
+    (code_dir / "example0.py").write_text("x: int | None = None\n")
+    (code_dir / "example1.py").unlink()
+    # touched but unchanged
+    (code_dir / "example2.py").write_text((code_dir / "example2.py").read_text())
+    (build_dir / "example3.py").write_text("changed outside")
+    (build_dir / "example4.py").unlink()
+    assert run() == {
+        ("parsed", "example0.py"),
+        ("written", "example0.py"),
+        ("cache_hit", "example2.py"),
+        ("cache_hit", "example3.py"),
+        ("cache_hit", "example4.py"),
+    }
+    assert (build_dir / "example0.py").read_text() == "from typing import Union\n\nx: Union[int, None] = None\n"
+    assert not (build_dir / "example1.py").exists()
+    assert (build_dir / "example2.py").read_text() == expected
+    assert {kind for kind, _ in run()} == {"cache_hit"}
+
+    # another target invalidates the manifest
+    result = runner.invoke(app, [*args, "--target", "py310"])
+    assert result.exit_code == 0
+    assert (build_dir / "example0.py").read_text() == "x: int | None = None\n"
+
+
+def test_transfer_dir_manifest_shared_build_dir(tmp_path_factory):
+    src_a, src_b = tmp_path_factory.mktemp("a"), tmp_path_factory.mktemp("b")
+    build_dir = tmp_path_factory.mktemp("build")
+    (src_a / "ma.py").write_text("x: int | None = None\n")
+    (src_b / "mb.py").write_text("y: int | None = None\n")
+    for src_dir in (src_a, src_b):
+        assert runner.invoke(app, ["transfer-dir", str(src_dir), str(build_dir)]).exit_code == 0
+    assert (build_dir / "ma.py").exists()
+    assert (build_dir / "mb.py").exists()
+
+    # the outputs of another source directory are only removed once their source is deleted
+    (src_a / "ma.py").unlink()
+    assert runner.invoke(app, ["transfer-dir", str(src_b), str(build_dir)]).exit_code == 0
+    assert not (build_dir / "ma.py").exists()
+    assert (build_dir / "mb.py").exists()
+
+
+def test_transfer_dir_changed_since(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@test", *args], cwd=code_dir, check=True)
+
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-qm", "init")
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir)])
+    assert result.exit_code == 0
+    expected = (build_dir / "example0.py").read_text()
+
+    (code_dir / "example0.py").write_text("x: int | None = None\n")
+    (code_dir / "example1.py").unlink()
+    git("mv", "example2.py", "renamed.py")
+    (code_dir / "new.py").write_text("def test[T](x: T) -> T: return x\n")
+    (build_dir / "example3.py").write_text("untouched")
+
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir), "--changed-since", "HEAD"])
+    assert result.exit_code == 0
+    assert (build_dir / "example0.py").read_text() == "from typing import Union\n\nx: Union[int, None] = None\n"
+    assert not (build_dir / "example1.py").exists()
+    assert not (build_dir / "example2.py").exists()
+    assert (build_dir / "renamed.py").read_text() == expected
+    assert (build_dir / "new.py").read_text() == expected
+    assert (build_dir / "example3.py").read_text() == "untouched"
+
+
+def test_transfer_dir_changed_since_forgets_entries(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@test", *args], cwd=code_dir, check=True)
+
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-qm", "init")
+    args = ["transfer-dir", str(code_dir), str(build_dir), "--preserve-lines"]
+    assert runner.invoke(app, args).exit_code == 0
+
+    (code_dir / "example1.py").unlink()
+    git("mv", "example2.py", "renamed.py")
+    assert runner.invoke(app, [*args, "--changed-since", "HEAD"]).exit_code == 0
+    expected = {"example0.py", "renamed.py", "example3.py", "example4.py"}
+    assert set(load_line_map(build_dir / LINE_MAP_NAME)) == expected
+    assert set(BuildManifest.load(build_dir).entries) == expected
+    # the moved output is up to date with its renamed source
+    events_file = tmp_path_factory.mktemp("events") / "events.jsonl"
+    assert runner.invoke(app, [*args, "--events-file", str(events_file)]).exit_code == 0
+    kinds = [json.loads(line)["kind"] for line in events_file.read_text().splitlines()]
+    assert kinds.count("cache_hit") == 4
+
+
+def test_transfer_dir_mirror(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    (code_dir / "pkg").mkdir()
+    (code_dir / "pkg" / "py.typed").write_text("")
+    (code_dir / "pkg" / "plain.py").write_text("x = 1\n")
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir), "--mirror"])
+    assert result.exit_code == 0
+    assert (build_dir / "pkg" / "py.typed").samefile(code_dir / "pkg" / "py.typed")
+    assert (build_dir / "pkg" / "plain.py").samefile(code_dir / "pkg" / "plain.py")
+    assert not (build_dir / "example0.py").samefile(code_dir / "example0.py")
+
+    # a transformed file never writes through a link into the source
+    (code_dir / "pkg" / "plain.py").write_text("x: int | None = 1\n")
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir), "--mirror"])
+    assert result.exit_code == 0
+    assert (code_dir / "pkg" / "plain.py").read_text() == "x: int | None = 1\n"
+    assert not (build_dir / "pkg" / "plain.py").samefile(code_dir / "pkg" / "plain.py")
+
+
+def test_check(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    (code_dir / "plain.py").write_text("x: int = 1\n")
+
+    result = runner.invoke(app, ["check", str(code_dir), "--workers", "2"])
+    assert result.exit_code == 1
+
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir)])
+    assert result.exit_code == 0
+    files = {path: path.read_text() for path in build_dir.iterdir()}
+    result = runner.invoke(app, ["check", str(code_dir), "--build-dir", str(build_dir)])
+    assert result.exit_code == 0
+    assert {path: path.read_text() for path in build_dir.iterdir()} == files
+
+    (code_dir / "plain.py").write_text("x: int | None = 1\n")
+    result = runner.invoke(app, ["check", str(code_dir), "--build-dir", str(build_dir)])
+    assert result.exit_code == 1
+    result = runner.invoke(app, ["check", str(code_dir), "--target", "py312"])
+    assert result.exit_code == 0
+
+
+def test_check_preserve_lines(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir), "--preserve-lines"])
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["check", str(code_dir), "--build-dir", str(build_dir)])
+    assert result.exit_code == 0
+
+    (code_dir / "example0.py").write_text("x: int | None = 1\n")
+    result = runner.invoke(app, ["check", str(code_dir), "--build-dir", str(build_dir)])
+    assert result.exit_code == 1
+
+
+def test_report(code_dir, tmp_path_factory):
+    build_dir = tmp_path_factory.mktemp("build")
+    output = tmp_path_factory.mktemp("report") / "report.json"
+    result = runner.invoke(app, ["transfer-dir", str(code_dir), str(build_dir)])
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["report", str(code_dir), str(build_dir), "--repeat", "1", "--output", str(output)])
+    assert result.exit_code == 0
+    data = json.loads(output.read_text())
+    assert data["summary"]["modules"] == 5
+    assert data["summary"]["extra_functions"] == 5
+    assert data["summary"]["extra_type_vars"] == 5
+    assert data["summary"]["rule_sets"]["pep695"]["modules"] == 5
+    module = data["modules"][0]
+    assert module["import_time"]["source"] > 0
+    assert module["import_time"]["output"] > 0
+    assert module["size_overhead"] > 0
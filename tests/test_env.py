@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+from typer.testing import CliRunner
+
+from pyfuture.__main__ import app
+from pyfuture.env import EnvCache, find_distributions, transfer_env
+
+MODULES = {
+    "modern/__init__.py": "from .types import Pair\n",
+    "modern/types.py": "type Pair[T] = tuple[T, T]\n\ndef show(x: int | None) -> str:\n    return f'{x}'\n",
+    "modern/plain.py": "x = 1\n",
+    "modern/broken.py": "def f(:\n",
+}
+
+
+def install(site_packages: Path, name: str, files: dict[str, str], requires_python: str | None = None) -> None:
+    dist_info = site_packages / f"{name}-1.0.dist-info"
+    dist_info.mkdir(parents=True)
+    metadata = f"Metadata-Version: 2.1\nName: {name}\nVersion: 1.0\n"
+    if requires_python is not None:
+        metadata += f"Requires-Python: {requires_python}\n"
+    (dist_info / "METADATA").write_text(metadata)
+    for file, code in files.items():
+        (site_packages / file).parent.mkdir(parents=True, exist_ok=True)
+        (site_packages / file).write_text(code)
+    record = [f"{file},sha256=x,{len(code)}" for file, code in files.items()]
+    record += ["../../../bin/modern,,", f"{name}-1.0.dist-info/METADATA,,", f"{name}-1.0.dist-info/RECORD,,"]
+    (dist_info / "RECORD").write_text("\n".join(record) + "\n")
+
+
+@pytest.fixture
+def site_packages(tmp_path):
+    site_packages = tmp_path / "env" / "site-packages"
+    install(site_packages, "modern", MODULES)
+    install(site_packages, "compatible", {"compatible.py": "x = 1\n"}, requires_python=">=3.8")
+    # written for 3.12, but installable on 3.9
+    install(site_packages, "internal", {"internal.py": "def f[T](x: T) -> T:\n    return x\n"}, ">=3.9")
+    return site_packages
+
+
+def test_find_distributions(site_packages):
+    compatible, internal, modern = find_distributions(site_packages)
+    assert modern.files == sorted(MODULES)
+    assert compatible.compatible((3, 9)) and internal.compatible((3, 9)) and not modern.compatible((3, 9))
+    assert modern.cache_key((3, 9)) != modern.cache_key((3, 10))
+
+
+def test_transfer_env(site_packages, tmp_path):
+    cache_dir = tmp_path / "cache"
+    results = transfer_env(site_packages, cache_dir=cache_dir, workers=1)
+    assert [(result.name, result.status, result.files) for result in results] == [
+        ("compatible", "transferred", 0),
+        ("internal", "transferred", 1),
+        ("modern", "transferred", 1),
+    ]
+    assert "TypeVar" in (site_packages / "internal.py").read_text()
+    assert "Union[int, None]" in (site_packages / "modern/types.py").read_text()
+    assert (site_packages / "modern/plain.py").read_text() == "x = 1\n"
+    assert (site_packages / "modern/broken.py").read_text() == "def f(:\n"
+    assert (site_packages / "compatible.py").read_text() == "x = 1\n"
+
+    # an environment recreated with the same distributions reuses the outputs
+    recreated = tmp_path / "recreated" / "site-packages"
+    install(recreated, "modern", MODULES)
+    results = transfer_env(recreated, cache_dir=cache_dir, workers=1)
+    assert [(result.name, result.status) for result in results] == [("modern", "cached")]
+    for file in MODULES:
+        assert (recreated / file).read_text() == (site_packages / file).read_text()
+
+    # the files lowered to 3.9 need nothing for 3.10
+    results = transfer_env(site_packages, target=(3, 10), cache_dir=cache_dir, workers=1)
+    assert [(result.name, result.status, result.files) for result in results] == [
+        ("compatible", "transferred", 0),
+        ("internal", "transferred", 0),
+        ("modern", "transferred", 0),
+    ]
+
+
+def test_transfer_env_trust_requires_python(site_packages, tmp_path):
+    results = transfer_env(site_packages, cache_dir=tmp_path / "cache", trust_requires_python=True, workers=1)
+    assert [(result.name, result.status) for result in results] == [
+        ("compatible", "compatible"),
+        ("internal", "compatible"),
+        ("modern", "transferred"),
+    ]
+    assert "def f[T]" in (site_packages / "internal.py").read_text()
+
+
+def test_env_cache_incomplete(site_packages, tmp_path):
+    cache = EnvCache(tmp_path / "cache")
+    (modern,) = [dist for dist in find_distributions(site_packages) if dist.name == "modern"]
+    key = modern.cache_key((3, 9))
+    cache.output_dir(key).mkdir(parents=True)
+    assert cache.load(key) is None
+    cache.index_path(key).write_text("{")
+    assert cache.load(key) is None
+
+
+def test_transfer_env_cli(site_packages, tmp_path):
+    cache_dir = tmp_path / "cache"
+    args = ["transfer-env", str(site_packages), "--cache-dir", str(cache_dir), "--workers", "2"]
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0
+    assert "Union[int, None]" in (site_packages / "modern/types.py").read_text()
+    indexes = [json.loads(index.read_text()) for index in cache_dir.glob("*.json")]
+    assert {"name": "modern", "version": "1.0", "files": ["modern/types.py"]} in indexes
+    assert {"name": "internal", "version": "1.0", "files": ["internal.py"]} in indexes
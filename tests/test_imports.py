@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import libcst as cst
+import pytest
+from libcst.codemod import CodemodContext
+from libcst.codemod.visitors import AddImportsVisitor, ImportItem
+
+from pyfuture.utils import add_needed_imports
+
+IMPORTS = [
+    ImportItem("typing", "Union"),
+    ImportItem("typing", "TypeVar"),
+    ImportItem("collections.abc"),
+    ImportItem("typing", "Any", "A"),
+    ImportItem("__future__", "annotations"),
+]
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "",
+        "x = 1\n",
+        '"""doc"""\nx = 1\n',
+        '"""doc"""\n\n# comment\nfrom typing import Any\nimport os\n\nx = 1\n',
+        "__strict__ = True\nfrom typing import TypeVar\n",
+        "from typing import *\nimport collections.abc\n",
+        "from __future__ import annotations\nfrom typing import Any as A\nx = 1\nfrom typing import List\n",
+        "class A:\n    from typing import Union\nfrom typing import Any\n",
+        "from . import x\nfrom typing import (\n    Any,\n)\ndef f():\n    from typing import Union\n",
+        "import os; import sys\nfrom typing import Any\n",
+    ],
+)
+def test_same_as_visitor(code: str):
+    module = cst.parse_module(code)
+    context = CodemodContext(scratch={AddImportsVisitor.CONTEXT_KEY: list(IMPORTS)})
+    expected = AddImportsVisitor(CodemodContext(scratch={AddImportsVisitor.CONTEXT_KEY: list(IMPORTS)}))
+    assert add_needed_imports(module, context).code == expected.transform_module(module).code
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import ast
+
+import libcst as cst
+
+from pyfuture import incremental
+from pyfuture.incremental import IncrementalTransformer, get_ast_triggers, may_trigger
+from pyfuture.utils import transfer_code
+
+from .test_parallel import BLOCK, HEADER
+
+
+def test_incremental_matches_whole_module():
+    transformer = IncrementalTransformer((3, 9))
+    code = HEADER + "".join(BLOCK.format(i=i) for i in range(4))
+    assert transformer.transform("example.py", code) == transfer_code(code, target=(3, 9))
+
+    # edit a single function
+    new_code = code.replace('name = f"value {x}"', 'name = f"new value {x}"', 1)
+    assert transformer.transform("example.py", new_code) == transfer_code(new_code, target=(3, 9))
+    assert transformer.reused == transformer.total - 1
+
+    # a new import is needed by an appended statement
+    new_code += "\nfrom typing import Dict\n\ndef appended[T](x: T) -> T:\n    return x\n"
+    assert transformer.transform("example.py", new_code) == transfer_code(new_code, target=(3, 9))
+
+
+def test_incremental_falls_back_for_global():
+    transformer = IncrementalTransformer((3, 9))
+    code = HEADER + BLOCK.format(i=0) + "\ndef setter():\n    global value0\n    value0 = 1\n"
+    assert transformer.transform("example.py", code) == transfer_code(code, target=(3, 9))
+
+
+def test_incremental_falls_back_without_host_parser(monkeypatch):
+    transformer = IncrementalTransformer((3, 9))
+    code = HEADER + BLOCK.format(i=0)
+    expected = transfer_code(code, target=(3, 9))
+
+    def parse(*args, **kwargs):
+        # like the parser of an interpreter older than the syntax of the module
+        raise SyntaxError("invalid syntax")
+
+    monkeypatch.setattr(incremental.ast, "parse", parse)
+    assert may_trigger("x = 1\n", transformer.transformers)
+    assert transformer.transform("example.py", code) == expected
+    assert transformer.total == 1
+
+
+def test_ast_triggers_without_newer_nodes(monkeypatch):
+    for name in ("Match", "TypeVar", "ParamSpec", "TypeVarTuple", "TypeAlias"):
+        monkeypatch.delattr(ast, name)
+    get_ast_triggers.cache_clear()
+    try:
+        triggers = get_ast_triggers()
+    finally:
+        get_ast_triggers.cache_clear()
+    assert triggers[cst.TypeParameters] == ()
+    assert triggers[cst.BitOr] == (ast.BitOr,)
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import ast
+import json
+import traceback
+
+import pytest
+from typer.testing import CliRunner
+
+from pyfuture.__main__ import app
+from pyfuture.linemap import LINE_MAP_NAME, remap_line, transfer_code_preserving_lines
+from pyfuture.utils import transfer_code
+
+CASES = {
+    "generic function": (
+        '"""Module docstring."""\n'
+        "from __future__ import annotations\n"
+        "\n"
+        "import os\n"
+        "\n"
+        "\n"
+        "def first[T](items: list[T]) -> T | None:\n"
+        "    return items[0] if items else None\n"
+    ),
+    "generic class": (
+        "class Box[T]:\n"
+        "    def __init__(self, item: T) -> None:\n"
+        "        self.item = item\n"
+        "\n"
+        "    def map[U](self, f: Callable[[T], U]) -> Box[U]:\n"
+        "        return Box(f(self.item))\n"
+    ),
+    "match": (
+        "def describe(point):\n"
+        "    match point:\n"
+        "        case (x, 0):\n"
+        "            return f'x={x}'\n"
+        "        case {'y': y}:\n"
+        "            return f'y={y}'\n"
+        "        case _:\n"
+        "            return 'other'\n"
+    ),
+    "multi-line statements": (
+        "@decorator(\n"
+        "    1,\n"
+        ")\n"
+        "def f[T](x: T) -> T:\n"
+        '    s = """\n'
+        "    text\n"
+        '    """\n'
+        "    return call(\n"
+        "        x,  # comment\n"
+        "    )\n"
+    ),
+    "type alias": "type Pair[T] = tuple[T, T]\nx: int | None = None\n",
+    "no change": "x = 1\n\n# comment\ny = 2\n",
+}
+
+
+@pytest.mark.parametrize("code", CASES.values(), ids=CASES.keys())
+def test_same_code(code):
+    new_code, runs = transfer_code_preserving_lines(code)
+    assert ast.dump(ast.parse(new_code)) == ast.dump(ast.parse(transfer_code(code)))
+    for out_start, src_start, length in runs:
+        assert [remap_line(runs, out_start + i) for i in range(length)] == list(range(src_start, src_start + length))
+
+
+@pytest.mark.parametrize("code", CASES.values(), ids=CASES.keys())
+def test_lines_kept(code):
+    new_code, runs = transfer_code_preserving_lines(code)
+    lines, new_lines = code.splitlines(), new_code.splitlines()
+    for out_line, new_line in enumerate(new_lines, 1):
+        src_line = remap_line(runs, out_line)
+        if not new_line.strip() or new_line.strip() in lines[src_line - 1]:
+            continue
+        # only lines generated by the rules, or rewritten by them, are not found on their source line
+        assert not any(new_line.strip() == line.strip() for line in lines), new_line
+
+
+def test_traceback_line():
+    code = "from __future__ import annotations\n\n\ndef fail[T](x: T) -> T:\n    raise ValueError(x)\n"
+    new_code, _ = transfer_code_preserving_lines(code)
+    namespace: dict = {}
+    exec(compile(new_code, "example.py", "exec"), namespace)
+    with pytest.raises(ValueError) as exc_info:
+        namespace["fail"](1)
+    assert traceback.extract_tb(exc_info.tb)[-1].lineno == 5
+
+
+def test_moved_lines():
+    # no blank lines to hold the generated lines
+    code = "def f[T](x: T) -> T:\n    return x\ny = f(1)\n"
+    new_code, runs = transfer_code_preserving_lines(code)
+    new_lines = new_code.splitlines()
+    assert new_lines[-1] == "f = __wrapper_func_f(); y = f(1)"
+    assert [remap_line(runs, line) for line in range(1, len(new_lines) + 1)] == [1, 1, 1, 1, 2, 3, 3]
+
+
+def test_transfer_dir_preserve_lines(tmp_path):
+    src_dir, build_dir = tmp_path / "src", tmp_path / "build"
+    src_dir.mkdir()
+    (src_dir / "moved.py").write_text("def f[T](x: T) -> T:\n    return x\n")
+    (src_dir / "kept.py").write_text("import os\n\n\ndef f[T](x: T) -> T:\n    return x\n\n\ny = f(1)\n")
+    args = ["transfer-dir", str(src_dir), str(build_dir), "--preserve-lines"]
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0
+    line_map = json.loads((build_dir / LINE_MAP_NAME).read_text())
+    assert list(line_map["files"]) == ["moved.py"]
+    assert (build_dir / "kept.py").read_text().splitlines()[4] == "        return x"
+
+    # unchanged files keep their line map from the manifest, deleted files are dropped
+    (src_dir / "kept.py").write_text("def f[T](x: T) -> T:\n    return x\n")
+    (src_dir / "moved.py").unlink()
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0
+    line_map = json.loads((build_dir / LINE_MAP_NAME).read_text())
+    assert list(line_map["files"]) == ["kept.py"]
+    assert not (build_dir / "moved.py").exists()
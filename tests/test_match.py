@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import collections
+import textwrap
+
+import pytest
+
+from pyfuture.codemod.utils import RuleSet, get_transformers
+from pyfuture.utils import apply_transformer
+
+TRANSFORMERS = list(get_transformers([RuleSet.pep622]))
+
+PRELUDE = """
+import dataclasses
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+class Color:
+    RED = "red"
+"""
+
+FUNCTIONS = {
+    "literals": """
+def classify(value):
+    match value:
+        case 0 | 1:
+            return "bit"
+        case None:
+            return "none"
+        case True:
+            return "true"
+        case Color.RED:
+            return "red"
+        case -1:
+            return "minus one"
+        case "text" | b"bytes":
+            return "string"
+        case other:
+            return ("other", other)
+""",
+    "sequences": """
+def classify(value):
+    match value:
+        case []:
+            return "empty"
+        case [x]:
+            return ("one", x)
+        case [x, y] if x == y:
+            return ("pair of", x)
+        case (x, y):
+            return ("pair", x, y)
+        case [first, *rest, last]:
+            return ("many", first, rest, last)
+        case [*_]:
+            return "unreachable"
+        case _:
+            return "no sequence"
+""",
+    "nested": """
+def classify(value):
+    match value:
+        case [[x, y], [z, *_]] | [x, [y, z]]:
+            return ("nested", x, y, z)
+        case [Point(x=0, y=y), *rest] if rest:
+            return ("point on y axis first", y, rest)
+        case [(1 | 2) as digit, str(text)]:
+            return ("digit and text", digit, text)
+        case [_, _, *_]:
+            return "long"
+""",
+    "mappings": """
+def classify(value):
+    match value:
+        case {"kind": "point", "x": int(x), "y": int(y)}:
+            return ("point", x, y)
+        case {"kind": "named", "name": str() as name, **rest}:
+            return ("named", name, rest)
+        case {"kind": kind, **rest} if not rest:
+            return ("kind only", kind)
+        case {}:
+            return "mapping"
+""",
+    "classes": """
+def classify(value):
+    match value:
+        case Point(0, 0):
+            return "origin"
+        case Point(x, 0) | Point(0, x):
+            return ("on axis", x)
+        case Point(x=x, y=y) if x == y:
+            return ("diagonal", x)
+        case Point():
+            return "point"
+        case int(number) | float(number):
+            return ("number", number)
+        case str(text) if text:
+            return ("text", text)
+        case dict(items) | list(items):
+            return ("container", items)
+""",
+    "subject": """
+calls = []
+
+def classify(value):
+    match calls.append(value) or value:
+        case [value, *_]:
+            return ("first", value, len(calls))
+        case value:
+            return ("value", value, len(calls))
+""",
+    "nested_match": """
+def classify(value):
+    match value:
+        case [x, y]:
+            match x:
+                case 0:
+                    return ("zero then", y)
+                case _:
+                    return ("pair", x, y)
+        case _:
+            return None
+""",
+    "method": """
+class Classifier:
+    def classify(self, value):
+        match value:
+            case [x] | {"x": x}:
+                return x
+            case [x, *rest]:
+                return (x, rest)
+
+classify = Classifier().classify
+""",
+}
+
+
+def make_subjects(namespace):
+    point = namespace["Point"]
+    points = [point(0, 0), point(3, 0), point(0, 4), point(2, 2), point(1, 2), [point(0, 5), 1], [point(0, 5)]]
+    return [
+        0,
+        1,
+        -1,
+        None,
+        True,
+        False,
+        2.5,
+        "red",
+        "text",
+        "",
+        "ab",
+        b"bytes",
+        bytearray(b"ab"),
+        [],
+        (),
+        [1],
+        [1, 1],
+        [1, 2],
+        (1, 2, 3, 4),
+        [[1, 2], [3, 4, 5]],
+        [1, [2, 3]],
+        [2, "two"],
+        range(3),
+        collections.deque([1, 2]),
+        {"kind": "point", "x": 1, "y": 2},
+        {"kind": "point", "x": 1, "y": "2"},
+        {"kind": "named", "name": "a", "extra": 1},
+        {"kind": "named", "name": 1},
+        {"kind": "other"},
+        {"kind": "other", "extra": 1},
+        {},
+        {"x": 5},
+        collections.OrderedDict(kind="other"),
+        *points,
+    ]
+
+
+def run(code):
+    namespace = {}
+    exec(compile(code, "<test>", "exec"), namespace)
+    return namespace
+
+
+@pytest.mark.parametrize("name", list(FUNCTIONS))
+def test_lowered_match_matches_native(name):
+    code = PRELUDE + textwrap.dedent(FUNCTIONS[name])
+    new_code = apply_transformer(TRANSFORMERS, code)
+    assert "match " not in new_code
+    native, lowered = run(code), run(new_code)
+    for native_subject, lowered_subject in zip(make_subjects(native), make_subjects(lowered), strict=True):
+        expected = native["classify"](native_subject)
+        assert repr(lowered["classify"](lowered_subject)) == repr(expected), (native_subject, new_code)
+
+
+def test_lowered_large_match():
+    cases = "".join(f"        case {i} | '{i}':\n            result = {i}\n" for i in range(300))
+    nested = "            match x:\n" + cases.replace("        ", "                ").replace("result =", "result = -")
+    code = (
+        "def classify(x):\n"
+        "    result = None\n"
+        f"    match x:\n{cases}        case [x]:\n{nested}"
+        "        case _:\n"
+        "            result = 'other'\n"
+        "    return result\n"
+    )
+    new_code = apply_transformer(TRANSFORMERS, code)
+    native, lowered = run(code), run(new_code)
+    for subject in [0, 63, 64, 65, "128", 299, 300, [0], [299], ["300"], None]:
+        assert lowered["classify"](subject) == native["classify"](subject)
+
+
+def test_lowered_large_match_with_wildcard_alone_in_last_chain():
+    cases = "".join(f"        case {i}:\n            return {i}\n" for i in range(128))
+    code = f"def classify(x):\n    match x:\n{cases}        case _:\n            return 'other'\n"
+    lowered = run(apply_transformer(TRANSFORMERS, code))
+    assert [lowered["classify"](subject) for subject in [0, 127, 128]] == [0, 127, "other"]
+
+
+def test_lowered_class_pattern_without_match_args():
+    # dataclasses get no `__match_args__` before python 3.10
+    code = (
+        "import dataclasses\n"
+        "@dataclasses.dataclass(match_args=False)\n"
+        "class Point:\n"
+        "    x: int\n"
+        "    y: int = dataclasses.field(default=0, init=False)\n"
+        "class Plain:\n"
+        "    x = 1\n"
+        "def classify(value):\n"
+        "    match value:\n"
+        "        case Point(0):\n"
+        "            return 'origin'\n"
+        "        case Point(x):\n"
+        "            return ('point', x)\n"
+        "        case Plain(x):\n"
+        "            return ('plain', x)\n"
+    )
+    lowered = run(apply_transformer(TRANSFORMERS, code))
+    point = lowered["Point"]
+    assert not hasattr(point, "__match_args__")
+    assert lowered["classify"](point(0)) == "origin"
+    assert lowered["classify"](point(2)) == ("point", 2)
+    with pytest.raises(TypeError, match=r"Plain\(\) accepts 0 positional sub-patterns \(1 given\)"):
+        lowered["classify"](lowered["Plain"]())
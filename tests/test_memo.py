@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+
+from typer.testing import CliRunner
+
+from pyfuture.__main__ import app
+from pyfuture.memo import StatementMemo
+from pyfuture.utils import transfer_code
+
+from .test_parallel import BLOCK, HEADER
+
+
+def test_memo_matches_whole_module():
+    memo = StatementMemo((3, 9))
+    code = HEADER + "".join(BLOCK.format(i=i) for i in range(3))
+    assert memo.transform(code) == transfer_code(code, target=(3, 9))
+    misses = memo.misses
+
+    # the same statements in another module with other imports
+    other_code = "from typing import Dict\n" + "".join(BLOCK.format(i=i) for i in range(3))
+    assert memo.transform(other_code) == transfer_code(other_code, target=(3, 9))
+    assert memo.misses == misses + 1
+    assert memo.hits == misses - 1
+
+
+def test_memo_falls_back_for_global():
+    memo = StatementMemo((3, 9))
+    code = HEADER + BLOCK.format(i=0) + "\ndef setter():\n    global value0\n    value0 = 1\n"
+    assert memo.transform(code) == transfer_code(code, target=(3, 9))
+    assert memo.hits == memo.misses == 0
+
+
+def test_memo_persisted(tmp_path):
+    memo_file = tmp_path / "memo.json"
+    memo = StatementMemo.load(memo_file, (3, 9))
+    code = BLOCK.format(i=0)
+    memo.transform(code)
+    memo.save()
+
+    memo = StatementMemo.load(memo_file, (3, 9))
+    assert memo.transform(code) == transfer_code(code, target=(3, 9))
+    assert memo.misses == 0
+    assert StatementMemo.load(memo_file, (3, 10)).entries == {}
+
+    # only the statements used in the last run are kept
+    memo = StatementMemo.load(memo_file, (3, 9))
+    memo.transform(BLOCK.format(i=1))
+    memo.save()
+    assert len(json.loads(memo_file.read_text())["entries"]) == memo.misses
+
+
+def test_transfer_dir_memo(tmp_path):
+    src_dir, build_dir, memo_file = tmp_path / "src", tmp_path / "build", tmp_path / "memo.json"
+    src_dir.mkdir()
+    for i in range(4):
+        (src_dir / f"copy{i}.py").write_text(f"import mod{i}\n" + BLOCK.format(i=0))
+    args = ["transfer-dir", str(src_dir), str(build_dir), "--memo-file", str(memo_file), "--no-use-manifest"]
+    result = CliRunner().invoke(app, [*args, "--executor", "threads", "--workers", "2"])
+    assert result.exit_code == 0
+    for i in range(4):
+        code = (src_dir / f"copy{i}.py").read_text()
+        assert (build_dir / f"copy{i}.py").read_text() == transfer_code(code, target=(3, 9))
+
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0
+    assert "12 hits, 0 misses" in result.stdout
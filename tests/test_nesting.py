@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import pytest
+
+from pyfuture import events
+from pyfuture.codemod.utils import get_transformers
+from pyfuture.nesting import NestingError, split_top_level
+from pyfuture.session import TransferSession
+from pyfuture.utils import apply_transformer, get_rule_sets, transfer_code
+
+TRANSFORMERS = list(get_transformers(get_rule_sets((3, 9))))
+GENERIC = "def identity[T](x: T) -> T:\n    return x\n"
+
+
+@pytest.mark.parametrize("depth", [1000, 2000])
+def test_long_union_annotation(depth: int):
+    union = " | ".join(f"T{i}" for i in range(depth))
+    new_code = apply_transformer(TRANSFORMERS, f"x: {union} = None\ndef f(y: {union}): pass\n")
+    items = ", ".join(f"T{i}" for i in range(depth))
+    assert new_code == f"from typing import Union\n\nx: Union[{items}] = None\ndef f(y: Union[{items}]): pass\n"
+
+
+def test_long_union_isinstance():
+    new_code = apply_transformer(TRANSFORMERS, "isinstance(x, " + " | ".join(["int"] * 2000) + ")\n")
+    assert new_code.startswith("isinstance(x, Union[int, int, ")
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "x = " + " + ".join(["1"] * 2000) + "\n",
+        "x = a" + ".b" * 2000 + "\n",
+        "x = " + "not " * 2000 + "a\n",
+        "if x:\n    pass\n" + "elif x:\n    pass\n" * 2000,
+    ],
+    ids=["operators", "attributes", "unary", "elif"],
+)
+def test_deep_statement_kept(statement: str):
+    errors = []
+    events.add_sink(errors.append)
+    try:
+        new_code = apply_transformer(TRANSFORMERS, f"{GENERIC}{statement}{GENERIC}")
+    finally:
+        events.remove_sink(errors.append)
+    assert statement in new_code
+    assert new_code.count("identity = __wrapper_func_identity()\n") == 2
+    assert [event.message for event in errors if event.kind == events.EventKind.error] == [
+        "Statement at line 3 is nested too deeply, kept as is"
+    ]
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "def f[T](x: T):\n    return " + " - ".join(["x"] * 2000) + "\n",
+        "x = f'{y}' + " + " + ".join(["1"] * 2000) + "\n",
+    ],
+    ids=["generic", "fstring"],
+)
+def test_deep_statement_with_trigger(statement: str):
+    with pytest.raises(NestingError, match="Statement at line 3 is nested too deeply to be transformed"):
+        apply_transformer(TRANSFORMERS, f"{GENERIC}{statement}{GENERIC}")
+
+
+def test_deep_code_paths():
+    code = f"{GENERIC}y: " + " | ".join(["int"] * 1000) + "\n"
+    expected = apply_transformer(TRANSFORMERS, code)
+    assert transfer_code(code, target=(3, 9), split_threshold=1) == expected
+    with TransferSession((3, 9)) as session:
+        assert session.transform(code).code == expected
+
+
+def test_shallow_statements_unchanged():
+    code = "x = [" + ", ".join(f"a + b + {i}" for i in range(200)) + "]\ny: int | str\n"
+    assert len(split_top_level(code)) == 2
+    assert apply_transformer(TRANSFORMERS, code) == "from typing import Union\n\n" + code.replace(
+        "int | str", "Union[int, str]"
+    )
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pyfuture import parallel
+from pyfuture.codemod.utils import RuleSet, get_transformers
+from pyfuture.parallel import apply_transformer_parallel
+from pyfuture.utils import apply_transformer
+
+TRANSFORMERS = list(get_transformers([RuleSet.pep695, RuleSet.pep701, RuleSet.pep622, RuleSet.pep604]))
+
+HEADER = """\
+# header comment
+"Module docstring."
+from __future__ import annotations
+
+import os
+from typing import List
+"""
+
+BLOCK = """
+
+# leading comment {i}
+@decorator
+def func{i}[T: int | str](x: T, y: List[int] | None = None) -> T:
+    name = f"value {{x}}"
+    match x:
+        case 1:
+            return x
+        case _:
+            return x
+    # trailing comment {i}
+
+
+class Class{i}[T]:
+    def method[P](self, x: T, y: P) -> tuple[T, P]:
+        return x, y
+
+
+value{i}: int | None = {i}
+"""
+
+
+@pytest.fixture
+def large_code():
+    return HEADER + "".join(BLOCK.format(i=i) for i in range(6))
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_matches_whole_module(large_code, workers):
+    assert apply_transformer_parallel(TRANSFORMERS, large_code, workers=workers) == apply_transformer(
+        TRANSFORMERS, large_code
+    )
+
+
+def test_parallel_merges_later_typing_import(large_code):
+    code = large_code + "\nfrom typing import Dict\n"
+    assert apply_transformer_parallel(TRANSFORMERS, code, workers=2) == apply_transformer(TRANSFORMERS, code)
+
+
+def test_parallel_falls_back_for_global(large_code):
+    code = large_code + "\ndef setter():\n    global value0\n    value0 = 1\n"
+    assert apply_transformer_parallel(TRANSFORMERS, code, workers=2) == apply_transformer(TRANSFORMERS, code)
+
+
+def test_parallel_falls_back_without_host_parser(large_code, monkeypatch):
+    expected = apply_transformer(TRANSFORMERS, large_code)
+
+    def parse(*args, **kwargs):
+        # like the parser of an interpreter older than the syntax of the module
+        raise SyntaxError("invalid syntax")
+
+    monkeypatch.setattr(parallel.ast, "parse", parse)
+    assert apply_transformer_parallel(TRANSFORMERS, large_code, workers=2) == expected
+
+
+def test_threads_match_whole_module(large_code):
+    stdout = sys.stdout
+    codes = [large_code.replace("value", f"value_{i}_") for i in range(8)]
+    with ThreadPoolExecutor(4) as executor:
+        new_codes = list(executor.map(lambda code: apply_transformer(TRANSFORMERS, code), codes))
+        assert apply_transformer_parallel(TRANSFORMERS, large_code, workers=4, executor=executor) == new_codes[
+            0
+        ].replace("value_0_", "value")
+    assert new_codes == [apply_transformer(TRANSFORMERS, code) for code in codes]
+    assert sys.stdout is stdout
+
+
+def test_threads_keep_stdout(capsys):
+    def transform(code: str) -> str:
+        new_code = apply_transformer(TRANSFORMERS, code)
+        print("printed")
+        return new_code
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(transform, ["x: int | None = 1\n"] * 8))
+    assert capsys.readouterr().out == "printed\n" * 8
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import ast
+import os
+from types import GenericAlias
+from typing import Any
+
+import pytest
+
+from pyfuture.codemod.utils import RuleSet, get_transformers
+from pyfuture.memo import StatementMemo
+from pyfuture.parallel import apply_transformer_parallel
+from pyfuture.utils import apply_transformer, get_rule_sets, transfer_code
+
+TRANSFORMERS = list(get_transformers([RuleSet.pep695]))
+
+
+def test_class_accesses_in_nested_scopes():
+    code = (
+        "class Box[T]:\n"
+        "    items: list[T]\n"
+        "    def types(self):\n"
+        "        return [T for _ in range(2)]\n"
+        "    def first[S](self, default: S) -> T | S:\n"
+        "        def inner(x: T) -> S: ...\n"
+        "        return inner\n"
+    )
+    new_code = apply_transformer(TRANSFORMERS, code)
+    assert "return [__Box_T for _ in range(2)]" in new_code
+    assert "def first(self, default: __Box_first_S) -> __Box_T | __Box_first_S:" in new_code
+    assert "def inner(x: __Box_T) -> __Box_first_S: ..." in new_code
+
+
+def test_method_type_parameter_shadows_class():
+    code = "class Box[T]:\n    def get[T](self, x: T) -> T:\n        return x\n"
+    new_code = apply_transformer(TRANSFORMERS, code)
+    assert "def get(self, x: __Box_get_T) -> __Box_get_T:" in new_code
+
+
+def test_large_class():
+    methods = "".join(f"    def get_{i}[E](self, x: T, e: E) -> T:\n        return x\n" for i in range(200))
+    new_code = apply_transformer(TRANSFORMERS, f"class Box[T]:\n{methods}")
+    assert new_code.count("__Box_T") == 200 * 2 + 3
+    assert new_code.count('TypeVar("__Box_get_199_E")') == 1
+
+
+ALIASES = (
+    "from collections.abc import Callable\n"
+    "\n"
+    "calls = []\n"
+    "\n"
+    "def expensive():\n"
+    "    calls.append(1)\n"
+    "    return int\n"
+    "\n"
+    "type Tree = dict[str, Tree] | int\n"
+    "type Later = Missing | None\n"
+    "type Costly = list[expensive()]\n"
+    "type Pair[T] = tuple[T, T]\n"
+    "type Handler[**P, R: int] = Callable[P, R]\n"
+    "\n"
+    "class Missing: ...\n"
+)
+
+
+def test_type_alias_lazy():
+    new_code = transfer_code(ALIASES, target=(3, 9))
+    assert new_code.count("class _LazyTypeAlias:") == 1
+    ast.parse(new_code, feature_version=(3, 9))
+    namespace: dict[str, Any] = {}
+    exec(new_code, namespace)
+    assert namespace["calls"] == []
+    assert namespace["Costly"].__value__ == list[int]
+    assert namespace["Costly"].__value__ == list[int]
+    assert namespace["calls"] == [1]
+    assert namespace["Later"].__value__ == namespace["Missing"] | None
+    tree = namespace["Tree"]
+    assert repr(tree) == "Tree"
+    assert tree.__value__.__args__ == (dict[str, tree], int)
+    assert (tree | None).__args__ == (tree, type(None))
+    assert (None | tree).__args__ == (type(None), tree)
+    with pytest.raises(TypeError):
+        tree[int]
+    pair = namespace["Pair"]
+    assert pair[int] == GenericAlias(pair, (int,))
+    assert [param.__name__ for param in pair.__type_params__] == ["__Pair_T"]
+    assert pair.__value__ == tuple[pair.__type_params__[0], pair.__type_params__[0]]
+    assert [param.__name__ for param in namespace["Handler"].__type_params__] == ["__Handler_P", "__Handler_R"]
+
+
+def test_type_alias_statements():
+    code = (
+        '"""Doc."""\n'
+        "from __future__ import annotations\n"
+        "import os\n"
+        "class Box:\n"
+        "    type Items = list[int]; size = 1\n"
+        "    if size: type Pair[T] = tuple[T, T]\n"
+        "def f():\n"
+        "    type Local = os.PathLike[str] | str\n"
+        "    return Local\n"
+    )
+    new_code = transfer_code(code, target=(3, 9))
+    ast.parse(new_code, feature_version=(3, 9))
+    assert new_code.startswith('"""Doc."""\nfrom __future__ import annotations\nimport os\n')
+    assert '    Items = _LazyTypeAlias("Items", lambda: list[int]); size = 1\n' in new_code
+    assert "    if size:\n        def __wrapper_type_Pair():\n" in new_code
+    namespace: dict[str, Any] = {}
+    exec(new_code, namespace)
+    assert namespace["Box"].Pair.__type_params__[0].__name__ == "__Pair_T"
+    assert namespace["f"]().__value__ == os.PathLike[str] | str
+
+
+def test_type_alias_nested_unions():
+    new_code = transfer_code("type Items = list[int | None] | dict[str, int | str]\n", target=(3, 9))
+    assert new_code.startswith("from typing import Union\n")
+    assert "GenericAlias" not in new_code.split("class _LazyTypeAlias:")[0]
+    assert "lambda: Union[list[Union[int, None]], dict[str, Union[int, str]]]" in new_code
+    ast.parse(new_code, feature_version=(3, 9))
+    namespace: dict[str, Any] = {}
+    exec(new_code, namespace)
+    assert namespace["Items"].__value__ == list[int | None] | dict[str, int | str]
+
+
+def test_type_alias_imports_only_used_names():
+    new_code = transfer_code("type Items = list[int]\n", target=(3, 9))
+    assert new_code.startswith("class _LazyTypeAlias:")
+    namespace: dict[str, Any] = {}
+    exec(new_code, namespace)
+    items = namespace["Items"]
+    assert (items | None).__args__ == (items, type(None))
+
+
+def test_type_alias_class_once():
+    new_code = transfer_code("type Items = list[int]\n", target=(3, 9))
+    new_code = transfer_code(f"{new_code}type Sizes = list[int]\n", target=(3, 9))
+    assert new_code.count("class _LazyTypeAlias:") == 1
+
+
+def test_type_alias_whole_module():
+    transformers = list(get_transformers(get_rule_sets((3, 9))))
+    code = f"import os\n\nx: int | None = None\n\n{ALIASES}"
+    new_code = apply_transformer(transformers, code)
+    assert StatementMemo((3, 9)).transform(code) == new_code
+    assert apply_transformer_parallel(transformers, code, workers=2) == new_code
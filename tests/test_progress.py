@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import io
+
+from typer.testing import CliRunner
+
+from pyfuture import events
+from pyfuture.__main__ import app
+from pyfuture.progress import BulkReporter
+
+
+class _Terminal(io.StringIO):
+    def isatty(self) -> bool:
+        return True
+
+
+def _run(reporter: BulkReporter, paths: list[str]) -> None:
+    with reporter:
+        for path in paths:
+            events.emit(events.EventKind.queued, path=path)
+        for path in paths:
+            with events.file_scope(path):
+                events.emit(events.EventKind.written, size=10)
+                events.emit(events.EventKind.transferred, duration=0.01, size=10)
+            reporter.write(f"done {path}\n")
+
+
+def test_reporter_plain():
+    stream = io.StringIO()
+    reporter = BulkReporter(stream, interval=0, plain_interval=0)
+    _run(reporter, ["a.py", "b.py"])
+    lines = stream.getvalue().splitlines()
+    assert "\x1b" not in stream.getvalue()
+    assert lines[:2] == ["0/1 files", "0/2 files"]
+    assert "done a.py" in lines and "done b.py" in lines
+    assert lines[-3] == "2/2 files"
+    assert lines[-2].startswith("2/2 files in ")
+    assert lines[-2].endswith(": 2 written, 0 unchanged, 0 linked, 0 up to date, 0 copied verbatim, 0 failed")
+
+    # without the plain progress lines
+    stream = io.StringIO()
+    _run(BulkReporter(stream, interval=0), ["a.py", "b.py"])
+    assert stream.getvalue().splitlines()[:2] == ["done a.py", "done b.py"]
+
+
+def test_reporter_terminal():
+    stream = _Terminal()
+    reporter = BulkReporter(stream, interval=0)
+    assert reporter.tty
+    _run(reporter, ["a.py", "b.py"])
+    output = stream.getvalue()
+    assert "\r\x1b[K2/2 files" in output
+    # messages clear the progress line before they are written
+    assert "\r\x1b[Kdone a.py\n" in output
+    summary = output.rsplit("\r\x1b[K", 1)[1]
+    assert summary.startswith("2/2 files in ")
+    assert "Slowest: a.py 10.0 ms, b.py 10.0 ms" in summary
+
+
+def test_reporter_throttled():
+    stream = _Terminal()
+    reporter = BulkReporter(stream, interval=3600)
+    _run(reporter, [f"m{i}.py" for i in range(100)])
+    output, summary = stream.getvalue().split("100/100 files in ")
+    # nothing is drawn before the end, where the batched messages are written at once
+    assert "/100 files" not in output
+    assert output.count("done ") == 100
+    assert summary.startswith("0.")
+    assert reporter.counts["transferred"] == 100
+
+
+def test_reporter_failures():
+    stream = io.StringIO()
+    with BulkReporter(stream, interval=0, slowest=1) as reporter:
+        events.emit(events.EventKind.queued, path="a.py")
+        events.emit(events.EventKind.queued, path="b.py")
+        events.emit(events.EventKind.error, path="a.py", message="SyntaxError: invalid syntax")
+        events.emit(events.EventKind.transferred, path="b.py", duration=0.5)
+    assert reporter.failures == {"a.py": "SyntaxError: invalid syntax"}
+    assert stream.getvalue().splitlines()[-2:] == [
+        "Failed: a.py: SyntaxError: invalid syntax",
+        "Slowest: b.py 500.0 ms",
+    ]
+
+    # messages after the summary are written through
+    reporter.write("late\n")
+    assert stream.getvalue().endswith("late\n")
+
+
+def test_transfer_dir_progress(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    for i in range(3):
+        (src_dir / f"module{i}.py").write_text("x: int | None = None\n")
+    args = ["transfer-dir", str(src_dir), str(tmp_path / "build"), "--progress"]
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0
+    assert ": 3 written, 0 unchanged, 0 linked, 0 up to date, 0 copied verbatim, 0 failed" in result.output
+    assert "Slowest: " in result.output
+
+    # the build stops at the first failure
+    (src_dir / "broken.py").write_text("def f(:\n")
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code != 0
+    assert "/4 files in " in result.output
+    assert "Failed: " + str(src_dir / "broken.py") in result.output
+
+
+def test_transfer_dir_progress_processes(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    for i in range(3):
+        (src_dir / f"module{i}.py").write_text("x: int | None = None\n")
+    args = ["transfer-dir", str(src_dir), str(tmp_path / "build"), "--progress", "--executor", "processes"]
+    result = CliRunner().invoke(app, [*args, "--workers", "2"])
+    assert result.exit_code == 0
+    assert "3/3 files in " in result.output
+    assert ": 3 written, 0 unchanged, 0 linked, 0 up to date, 0 copied verbatim, 0 failed" in result.output
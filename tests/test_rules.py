@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import libcst as cst
+import pytest
+
+from pyfuture import utils
+from pyfuture.codemod.utils import _RULES, NodeTypeIndex, RuleCommand, RuleSet, get_transformers, register_rule
+from pyfuture.utils import apply_transformer
+
+
+@pytest.fixture
+def rename_rule():
+    @register_rule("rename")
+    class RenameCommand(RuleCommand):
+        TRIGGERS = (cst.Lambda,)
+
+        def leave_Name(self, original_node: cst.Name, updated_node: cst.Name):
+            if updated_node.value == "x":
+                return updated_node.with_changes(value="y")
+            return updated_node
+
+    yield RenameCommand
+    _RULES.pop("rename")
+
+
+def test_custom_rule(rename_rule):
+    assert list(get_transformers("rename")) == [rename_rule]
+    code = "a = x\nb = lambda: x\n"
+    assert apply_transformer(list(get_transformers("rename")), code) == "a = x\nb = lambda: y\n"
+
+
+def test_skip_untriggered_module(rename_rule):
+    code = "a = x\n"
+    assert apply_transformer(list(get_transformers("rename")), code) == code
+
+
+def test_unchanged_module_keeps_index(rename_rule, monkeypatch):
+    indexes = []
+    monkeypatch.setattr(utils, "NodeTypeIndex", lambda module: indexes.append(module) or NodeTypeIndex(module))
+    code = "b = lambda: z\n"
+    assert apply_transformer(list(get_transformers("rename")), code) == code
+    assert len(indexes) == 1
+
+
+def test_rule_sets_iterable():
+    assert list(get_transformers((RuleSet.pep604,))) == list(get_transformers(RuleSet.pep604))
+
+
+def test_unknown_rule_set():
+    with pytest.raises(ValueError, match="Unknown rule set"):
+        list(get_transformers("unknown"))
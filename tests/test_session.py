@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from pyfuture.session import TransferSession
+from pyfuture.utils import transfer_code
+
+SOURCES = {f"snippet{i}.py": f"def func{i}[T](x: T) -> T:\n    return f'{{x}} {i}'\n" for i in range(8)}
+
+
+def test_transform_many_matches_transfer_code():
+    with TransferSession((3, 9), workers=2) as session:
+        results = session.transform_many(SOURCES)
+    assert list(results) == list(SOURCES)
+    for path, code in SOURCES.items():
+        assert results[path].code == transfer_code(code, target=(3, 9))
+        assert not results[path].diagnostics
+
+
+def test_transform_many_cache():
+    session = TransferSession((3, 9), cache_size=4)
+    session.transform_many(SOURCES)
+    results = session.transform_many({"a.py": SOURCES["snippet7.py"], "b.py": SOURCES["snippet0.py"]})
+    assert results["a.py"].cached
+    assert not results["b.py"].cached
+    assert len(session.cache) == 4
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from typer.testing import CliRunner
+
+from pyfuture.__main__ import app
+from pyfuture.splice import splice_code
+from pyfuture.utils import get_rule_sets, get_transformers, transfer_code
+
+PACKAGE_DIR = Path(__file__).parents[1] / "pyfuture"
+TARGETS = [(3, 9), (3, 10), (3, 11)]
+
+SPLICED = [
+    "x: int | None = None\n",
+    '"""doc"""\n\nfrom __future__ import annotations\n\nimport os\n# comment\nx: int | None = None\n',
+    "# header\n\n# attached\nx: int | None = None; y = 1\n",
+    "from typing import Union\nx: int | None = None\n",
+    "from typing import Any\nimport os\n\n\ndef f(a: int|str, *b: int | None, **c: str | None) -> Any:\n    pass\n",
+    "import os\n@decorator\nasync def f(a: int | str): pass\n",
+    "class A:\n    x: list[int] | dict[str, int | None]\n    def f(self, y: A | None = None) -> A | None: ...\n",
+    "def f(\n    a: int | None,\n    b: str | None = None,\n) -> None: ...\n",
+    "isinstance(x, int | str)\nissubclass(x, int | str , )\n",
+    'x: "é" | None = "é"\nprint(f"é{x}é {x:>4} {{}}")\n',
+    'print(f"""\nmulti {x}\nline {y:>3}\n""")\n',
+    "print(f'{ x + 1 }', f'{d[\"k\"]} {a[1:2]} {(lambda: 1)()} {x != y}', f\"plain\", f'{x:}', f'{t:%H:%M}')\n",
+    'print(f"\\N{EM DASH}{x}")\nf(a)(f"{b}")\n',
+    "y = a | b\nz: list[int | None] = []\n",
+    "__strict__ = True\nimport os\ny: int | None = 2\n",
+    "x = 1\nfrom typing import Union\ny: int | None = 2\n",
+]
+
+FALLBACK = [
+    "isinstance(x, (int | str))\n",
+    "x: (int | None) = 1\n",
+    "x: int | (str | bytes) = 1\n",
+    "def f(a:\n int | None): ...\n",
+    "import os; x: int | None = 1\n",
+    "isinstance(x, int | str, y)\n",
+    'print(f"{x!r}", f"{x=}")\n',
+    'print(f"{x:{width}}")\n',
+    'print(f"{f"{x}"}")\n',
+    'print("a" f"{x}")\n',
+    'print(F"{x}", rf"{x}")\n',
+    'x = (\n    f"{a}"\n)\n',
+    "def f[T](x: T) -> T:\n    return x\n",
+    "match x:\n    case 1:\n        pass\n",
+    "type X = int\ny: int | None = None\n",
+]
+
+
+@pytest.mark.parametrize("target", TARGETS)
+@pytest.mark.parametrize("code", SPLICED)
+def test_splice_matches_libcst(code: str, target: tuple[int, int]):
+    new_code = splice_code(get_transformers(get_rule_sets(target)), code)
+    assert new_code is not None
+    assert new_code == transfer_code(code, target=target)
+
+
+@pytest.mark.parametrize("code", FALLBACK)
+def test_splice_falls_back(code: str):
+    assert splice_code(get_transformers(get_rule_sets((3, 9))), code) is None
+
+
+@pytest.mark.parametrize("name", ["__main__.py", "parallel.py", "splice.py", "utils.py", "watch.py"])
+def test_splice_matches_libcst_on_sources(name: str):
+    code = (PACKAGE_DIR / name).read_text()
+    transformers = list(get_transformers(get_rule_sets((3, 9))))
+    new_code = splice_code(transformers, code)
+    if new_code is not None:
+        assert new_code == transfer_code(code, target=(3, 9))
+
+
+def test_transfer_dir_splice(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    for i, code in enumerate([*SPLICED[:4], *FALLBACK[-2:]]):
+        (src_dir / f"module{i}.py").write_text(code)
+    for engine in ("libcst", "splice"):
+        args = ["transfer-dir", str(src_dir), str(tmp_path / engine), "--engine", engine, "--no-use-manifest"]
+        result = CliRunner().invoke(app, args)
+        assert result.exit_code == 0
+    for src_file in src_dir.iterdir():
+        assert (tmp_path / "splice" / src_file.name).read_text() == (tmp_path / "libcst" / src_file.name).read_text()
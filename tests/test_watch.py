@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from pyfuture.incremental import IncrementalTransformer
+from pyfuture.latency import STAGES, LatencyTracker
+from pyfuture.utils import transfer_code
+from pyfuture.watch import transfer_changed, watch_tree
+
+CODE = "def test[T](x: T) -> T: return x\n"
+
+
+def test_transfer_changed(tmp_path):
+    src_file, tgt_file = tmp_path / "example.py", tmp_path / "build" / "example.py"
+    src_file.write_text(CODE)
+    latency = transfer_changed(IncrementalTransformer((3, 9)), src_file, tgt_file, time.time())
+    assert set(latency) == set(STAGES)
+    assert latency["total"] >= latency["debounce"] + latency["transform"] - 0.01
+    assert tgt_file.read_text() == transfer_code(CODE)
+
+
+def test_watch_tree(tmp_path):
+    pytest.importorskip("watchfiles")
+    src_dir, build_dir = tmp_path / "src", tmp_path / "build"
+    src_dir.mkdir()
+    tracker = LatencyTracker(interval=0)
+    stop_event = threading.Event()
+    watcher = threading.Thread(
+        target=watch_tree,
+        args=(src_dir, build_dir, IncrementalTransformer((3, 9)), tracker),
+        kwargs={"debounce": 50, "stop_event": stop_event},
+    )
+    watcher.start()
+    try:
+        time.sleep(0.5)
+        (src_dir / "example.py").write_text(CODE)
+        deadline = time.monotonic() + 30
+        while not (build_dir / "example.py").exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop_event.set()
+        watcher.join()
+    assert (build_dir / "example.py").read_text() == transfer_code(CODE)
+    assert tracker.count >= 1
+    assert tracker.percentiles("total")[99] is not None